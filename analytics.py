@@ -0,0 +1,289 @@
+"""
+Usage analytics for peak-hour planning (SC6).
+
+Closed sessions are folded into two bucket tables (migrations/007):
+  usage_hourly  per machine and clock hour: sessions started and minutes
+                occupied (TIMEIN..TIMEOUT, including pickup delay)
+  usage_delays  per machine and day: pickups per DELAY_BUCKETS range
+
+refresh() adds only sessions picked up since the last refresh (the
+ANALYTICS_WATERMARK row in analytics_state), with one set-based SQL
+statement per table; spreading a session across the hours it spans is a
+recursive CTE, not a Python loop. The reports below then read a few
+thousand bucket rows instead of years of sessions, and are memoised until
+the watermark moves.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+from helpers import TIME_FORMAT
+from machine_catalog import ALL_MACHINE_IDS
+
+# Lower bounds (minutes) of the late-pickup histogram buckets.
+DELAY_BUCKETS = (0, 1, 6, 16, 31, 61)
+DELAY_BUCKET_LABELS = ("on time", "1-5", "6-15", "16-30", "31-60", "60+")
+
+# Reports refresh the buckets first if the last refresh is older than this.
+REFRESH_INTERVAL = float(os.getenv("ANALYTICS_REFRESH_SECONDS", "60"))
+
+# TIMEOUT is stamped before the pickup commits, which can wait up to the
+# 5 s busy_timeout; only fold pickups older than this so none are skipped.
+SETTLE_SECONDS = 10
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+_WATERMARK = "ANALYTICS_WATERMARK"
+
+
+def _delay_bucket_sql(column: str) -> str:
+    cases = " ".join(
+        f"WHEN {column} >= {lower} THEN {i}"
+        for i, lower in reversed(list(enumerate(DELAY_BUCKETS)))
+    )
+    return f"CASE {cases} ELSE 0 END"
+
+
+def _closed_sessions_sql(include_archive: bool) -> str:
+    sql = """
+        SELECT MACHINEID, TIMEIN, TIMEOUT, DELAY_MIN FROM sessions
+        WHERE STATUS = 'picked_up' AND TIMEOUT > :since AND TIMEOUT <= :through
+    """
+    if include_archive:
+        sql += """
+        UNION ALL
+        SELECT MACHINEID, TIMEIN, TIMEOUT, DELAY_MIN FROM sessions_archive
+        WHERE TIMEOUT > :since AND TIMEOUT <= :through
+        """
+    return sql
+
+
+def _fold_hourly(conn, include_archive: bool, params: dict) -> None:
+    conn.execute(f"""
+        WITH RECURSIVE
+        closed AS ({_closed_sessions_sql(include_archive)}),
+        slots (MACHINEID, HOUR, TIMEIN, TIMEOUT) AS (
+            SELECT MACHINEID, strftime('%Y-%m-%d %H:00:00', TIMEIN), TIMEIN, TIMEOUT FROM closed
+            UNION ALL
+            SELECT MACHINEID, datetime(HOUR, '+1 hour'), TIMEIN, TIMEOUT FROM slots
+            WHERE datetime(HOUR, '+1 hour') < TIMEOUT
+        )
+        INSERT INTO usage_hourly (MACHINEID, HOUR, HOUR_OF_WEEK, STARTS, BUSY_MINUTES)
+        SELECT
+            MACHINEID,
+            HOUR,
+            ((CAST(strftime('%w', HOUR) AS INTEGER) + 6) % 7) * 24 + CAST(strftime('%H', HOUR) AS INTEGER),
+            SUM(HOUR = strftime('%Y-%m-%d %H:00:00', TIMEIN)),
+            SUM(MAX(0, julianday(MIN(TIMEOUT, datetime(HOUR, '+1 hour'))) - julianday(MAX(TIMEIN, HOUR))) * 1440)
+        FROM slots
+        GROUP BY MACHINEID, HOUR
+        ON CONFLICT (MACHINEID, HOUR) DO UPDATE SET
+            STARTS = STARTS + excluded.STARTS,
+            BUSY_MINUTES = BUSY_MINUTES + excluded.BUSY_MINUTES
+    """, params)
+
+
+def _fold_delays(conn, include_archive: bool, params: dict) -> None:
+    conn.execute(f"""
+        WITH closed AS ({_closed_sessions_sql(include_archive)})
+        INSERT INTO usage_delays (MACHINEID, DAY, BUCKET, COUNT)
+        SELECT MACHINEID, date(TIMEIN), {_delay_bucket_sql("DELAY_MIN")}, COUNT(*)
+        FROM closed
+        GROUP BY 1, 2, 3
+        ON CONFLICT (MACHINEID, DAY, BUCKET) DO UPDATE SET
+            COUNT = COUNT + excluded.COUNT
+    """, params)
+
+
+# -----------------------------
+# Incremental refresh
+# -----------------------------
+
+_lock = threading.Lock()
+_last_refresh = 0.0
+_results: dict[tuple, tuple] = {}  # (report, args) -> (watermark, result)
+MAX_CACHED_RESULTS = 256
+
+
+def refresh(through: str | None = None) -> str:
+    """
+    Folds sessions picked up after the watermark (up to `through`, default
+    SETTLE_SECONDS ago) into the bucket tables and advances the watermark, all
+    in one transaction; safe to run from several processes. The first run
+    backfills from sessions_archive too. Returns the new watermark.
+    """
+    global _last_refresh
+    if through is None:
+        through = (datetime.now() - timedelta(seconds=SETTLE_SECONDS)).strftime(TIME_FORMAT)
+
+    with db.immediate_transaction() as conn:
+        row = conn.execute("SELECT VALUE FROM analytics_state WHERE NAME = ?", (_WATERMARK,)).fetchone()
+        since = row["VALUE"] if row is not None else None
+
+        if since is None or through > since:
+            params = {"since": since or "", "through": through}
+            _fold_hourly(conn, since is None, params)
+            _fold_delays(conn, since is None, params)
+            conn.execute("""
+                INSERT INTO analytics_state (NAME, VALUE) VALUES (?, ?)
+                ON CONFLICT (NAME) DO UPDATE SET VALUE = excluded.VALUE
+            """, (_WATERMARK, through))
+            since = through
+
+    _last_refresh = time.monotonic()
+    return since
+
+
+def rebuild() -> str:
+    """Drops all buckets and recomputes them from sessions and sessions_archive."""
+    with db.immediate_transaction() as conn:
+        conn.execute("DELETE FROM usage_hourly")
+        conn.execute("DELETE FROM usage_delays")
+        conn.execute("DELETE FROM analytics_state WHERE NAME = ?", (_WATERMARK,))
+    with _lock:
+        _results.clear()
+    return refresh()
+
+
+def _current_watermark() -> str:
+    if time.monotonic() - _last_refresh > REFRESH_INTERVAL:
+        return refresh()
+    row = db.get_connection().execute(
+        "SELECT VALUE FROM analytics_state WHERE NAME = ?", (_WATERMARK,)
+    ).fetchone()
+    return row["VALUE"] if row is not None else refresh()
+
+
+def _cached(report: str, args: tuple, compute):
+    watermark = _current_watermark()
+    key = (report, args)
+    with _lock:
+        hit = _results.get(key)
+        if hit is not None and hit[0] == watermark:
+            return hit[1]
+    result = compute()
+    with _lock:
+        if len(_results) >= MAX_CACHED_RESULTS:
+            _results.clear()
+        _results[key] = (watermark, result)
+    return result
+
+
+# -----------------------------
+# Reports
+# -----------------------------
+
+def _machine_filter(machine_ids: tuple | None) -> tuple[str, tuple]:
+    if not machine_ids:
+        return "", ()
+    return f" AND MACHINEID IN ({','.join('?' * len(machine_ids))})", tuple(machine_ids)
+
+
+def _weekday_counts(since_dt: datetime, until_dt: datetime) -> list[int]:
+    # How many times each weekday (Mon=0) occurs in [since, until), by calendar day.
+    days = max((until_dt.date() - since_dt.date()).days, 0)
+    if until_dt.time() != datetime.min.time():
+        days += 1
+    start = since_dt.weekday()
+    return [days // 7 + (1 if (w - start) % 7 < days % 7 else 0) for w in range(7)]
+
+
+def heatmap(since: str, until: str, machine_ids: tuple | None = None) -> dict:
+    """
+    Hour-of-week occupancy: for each weekday (Mon first) and hour, the
+    percentage of machine-minutes in use, averaged over the weeks in
+    [since, until), plus the number of loads started in that slot.
+    """
+    def compute():
+        id_sql, id_params = _machine_filter(machine_ids)
+        rows = db.get_connection().execute(f"""
+            SELECT HOUR_OF_WEEK, TOTAL(BUSY_MINUTES) AS busy, TOTAL(STARTS) AS starts
+            FROM usage_hourly
+            WHERE HOUR >= ? AND HOUR < ?{id_sql}
+            GROUP BY HOUR_OF_WEEK
+        """, (since, until) + id_params).fetchall()
+
+        machines = len(machine_ids) if machine_ids else len(ALL_MACHINE_IDS)
+        weeks = _weekday_counts(datetime.strptime(since, TIME_FORMAT), datetime.strptime(until, TIME_FORMAT))
+        occupancy = [[0.0] * 24 for _ in WEEKDAYS]
+        starts = [[0] * 24 for _ in WEEKDAYS]
+        for r in rows:
+            day, hour = divmod(r["HOUR_OF_WEEK"], 24)
+            capacity = 60 * machines * weeks[day]
+            if capacity:
+                occupancy[day][hour] = round(100 * r["busy"] / capacity, 2)
+            starts[day][hour] = int(r["starts"])
+
+        return {"weekdays": list(WEEKDAYS), "occupancy_pct": occupancy, "starts": starts}
+
+    return _cached("heatmap", (since, until, machine_ids), compute)
+
+
+def utilization(since: str, until: str, machine_ids: tuple | None = None) -> dict:
+    """
+    Per machine: percentage of [since, until) it was occupied, and loads started.
+    """
+    def compute():
+        # An explicit ID list turns this into one primary-key range seek per
+        # machine, already grouped, instead of sorting the whole date range.
+        id_sql, id_params = _machine_filter(machine_ids or ALL_MACHINE_IDS)
+        rows = db.get_connection().execute(f"""
+            SELECT MACHINEID, TOTAL(BUSY_MINUTES) AS busy, TOTAL(STARTS) AS starts
+            FROM usage_hourly
+            WHERE HOUR >= ? AND HOUR < ?{id_sql}
+            GROUP BY MACHINEID
+        """, (since, until) + id_params).fetchall()
+        by_machine = {r["MACHINEID"]: r for r in rows}
+
+        span = (datetime.strptime(until, TIME_FORMAT) - datetime.strptime(since, TIME_FORMAT)).total_seconds() / 60
+        result = {}
+        for machine_id in machine_ids or ALL_MACHINE_IDS:
+            r = by_machine.get(machine_id)
+            busy = r["busy"] if r is not None else 0.0
+            result[machine_id] = {
+                "utilization_pct": round(100 * busy / span, 2) if span > 0 else 0.0,
+                "busy_minutes": round(busy, 1),
+                "starts": int(r["starts"]) if r is not None else 0,
+            }
+        return result
+
+    return _cached("utilization", (since, until, machine_ids), compute)
+
+
+def late_distribution(since: str, until: str, machine_ids: tuple | None = None) -> dict:
+    """
+    Pickups per DELAY_BUCKETS range for sessions started in [since, until).
+    """
+    def compute():
+        id_sql, id_params = _machine_filter(machine_ids)
+        rows = db.get_connection().execute(f"""
+            SELECT BUCKET, TOTAL(COUNT) AS n
+            FROM usage_delays
+            WHERE DAY >= date(?) AND DAY < date(?){id_sql}
+            GROUP BY BUCKET
+        """, (since, until) + id_params).fetchall()
+
+        counts = [0] * len(DELAY_BUCKETS)
+        for r in rows:
+            counts[r["BUCKET"]] = int(r["n"])
+        total = sum(counts)
+        return {
+            "buckets": list(DELAY_BUCKET_LABELS),
+            "counts": counts,
+            "late_pct": round(100 * (total - counts[0]) / total, 2) if total else 0.0,
+        }
+
+    return _cached("late_distribution", (since, until, machine_ids), compute)
+
+
+def report(since: str, until: str, machine_ids: tuple | None = None) -> dict:
+    return {
+        "since": since,
+        "until": until,
+        "heatmap": heatmap(since, until, machine_ids),
+        "utilization": utilization(since, until, machine_ids),
+        "late_distribution": late_distribution(since, until, machine_ids),
+        "refreshed_through": _current_watermark(),
+    }
@@ -1,92 +1,265 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timedelta
 import secrets
 import string
+import functools
+import math
 import os
 import hmac
+import time
+import csv
+import io
+import json
 
-from db import (
-    insert_session,
-    get_connection,
-    get_session_by_id,
-    update_finish_sms,
-    get_active_session_by_machine,
-    set_verification_code,
-    mark_picked_up,
-
-    ensure_machine_exists,
-    get_machine_by_id,
-    set_machine_occupied,
-    set_machine_vacant,
-    update_machine_condition,
-
-    get_machine_summary_stats,
-)
-
-from helpers import ISVALIDMACHINEID, KEEPDIGITSONLY
+import click
 from dotenv import load_dotenv
-load_dotenv()
-
-from sms_service import send_finish_sms as twilio_send_finish_sms, build_finish_message
+load_dotenv()  # before local imports: metrics/db read DLMS_* settings at import time.
+
+from db import HISTORY_COLUMNS
+
+from helpers import GRACE_MINUTES, ISVALIDMACHINEID, KEEPDIGITSONLY, LATEBYMINUTES, PICKUPDELAYMINUTES
+from machine_catalog import CATALOG
+import metrics
+import analytics
+import ratelimit
+import storage
+from sms_service import build_finish_message, format_machine_location
+from render_cache import RenderCache, template_fingerprint
+from sms_worker import SmsOutboxWorker
+from finish_scheduler import FinishScheduler
+from sweeper import IdempotencyKeyPurger, StaleSessionSweeper
+from board import BoardBroadcaster
+import waitlist
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "dev"
 
+# Opt-in timing: /metrics and Server-Timing headers when DLMS_METRICS=1.
+if metrics.ENABLED:
+    metrics.init_app(app)
+
+# SC5/SC6: every database call below goes through this; DLMS_STORAGE picks the
+# connection strategy (see storage.py).
+repository = storage.from_env()
+repository.init_app(app)
+
 CYCLE_DURATION_MINUTES = 1
-GRACE_MINUTES = 6  # SC6: grace period used when calculating pickup delay.
 
 SUPERVISOR_CODE = os.getenv("SUPERVISOR_CODE", "767877")  # SC4/SC5: supervisor override for pickup/condition updates.
 
+# SC3: finish SMS are sent from the outbox by this worker, not inside requests.
+sms_worker = SmsOutboxWorker(max_concurrency=int(os.getenv("SMS_MAX_CONCURRENCY", "4")))
+
+# SC2/SC3: queues each finish SMS when EXPECTED_END passes. Like the other
+# background workers it only runs after start_background_workers(); under
+# `flask run` or gunicorn, run `flask run-workers` alongside (finish_scheduler.py).
+finish_scheduler = FinishScheduler(on_queued=sms_worker.wake)
+
+# SC4/SC6: auto-closes sessions left uncollected (STALE_SESSION_MINUTES).
+stale_sweeper = StaleSessionSweeper()
+
+# Drops expired Idempotency-Key responses; independent of the sweeper above.
+idempotency_purger = IdempotencyKeyPurger()
+
+# SC1/SC4: rendered scan pages keyed on the machine row (see render_cache.py).
+# ETags change with APP_VERSION, or with the template files when it is unset.
+scan_pages = RenderCache(
+    version=os.getenv("APP_VERSION") or template_fingerprint(os.path.join(app.root_path, app.template_folder))
+)
+
+# SC3/SC6: location text and machine metadata for templates, from machine_catalog.
+app.jinja_env.globals["machine_location"] = format_machine_location
+app.jinja_env.globals["machine_catalog"] = CATALOG
+
+# SC5: live availability board; one state computation per change for all viewers.
+board = BoardBroadcaster()
+repository.add_machine_listener(board.notify)
+
+# SC2/SC5: per-hallway queues; predicted free times follow machine writes.
+hallway_queues = waitlist.HallwayQueues(cycle_minutes=CYCLE_DURATION_MINUTES)
+repository.add_machine_listener(hallway_queues.notify)
+
+
+# SC4/SC5: attempt limits on the routes that check a 6-digit code (see ratelimit.py).
+code_attempts = ratelimit.from_env()
+
+# Behind N reverse proxies, take the client address (the rate-limit key) from
+# X-Forwarded-For instead of the proxy's own address.
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+if TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT)
+
+
+def limit_attempts(scope: str, methods: tuple = ("POST",)):
+    """
+    Answers requests to the decorated view (POSTs unless `methods` says
+    otherwise) with 429 before the view (and db.py) runs while the client,
+    keyed by address and machine, is out of attempts. Only wrong codes use
+    up attempts; the view reports them with record_failed_code(scope, machine_id).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in methods and code_attempts is not None:
+                machine_id = kwargs.get("machine_id")
+                retry_after = code_attempts.check(
+                    scope, request.remote_addr, machine_id if ISVALIDMACHINEID(machine_id) else None
+                )
+                if retry_after:
+                    return Response(
+                        "Too many attempts. Please try again later.",
+                        status=429,
+                        mimetype="text/plain",
+                        headers={"Retry-After": str(math.ceil(retry_after))},
+                    )
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_failed_code(scope: str, machine_id: str | None) -> None:
+    """Charges a wrong verification/supervisor code against the client's attempts."""
+    if code_attempts is not None:
+        code_attempts.fail(scope, request.remote_addr, machine_id)
+
+
+def idempotent(view):
+    """
+    POSTs carrying an Idempotency-Key header run at most once per key and
+    URL: a retry gets the first response replayed (no session or SMS I/O)
+    and one that arrives while the first is still running gets 409. Keys
+    are scoped to the URL, so clients that happen to pick the same key for
+    different sessions do not collide. Server errors release the key.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.headers.get("Idempotency-Key") or "").strip()
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": "Idempotency-Key is too long."}), 400
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        existing = repository.reserve_idempotency_key(key, request.path, now)
+        if existing is not None:
+            if existing["STATUS_CODE"] is None:
+                return jsonify({"error": "A request with this Idempotency-Key is in progress."}), 409
+            response = Response(existing["BODY"], status=existing["STATUS_CODE"],
+                                content_type=existing["CONTENT_TYPE"])
+            if existing["LOCATION"]:
+                response.headers["Location"] = existing["LOCATION"]
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            repository.release_idempotency_key(key, request.path)
+            raise
+        if response.status_code >= 500:
+            repository.release_idempotency_key(key, request.path)
+        else:
+            repository.store_idempotent_response(key, request.path, response.status_code, response.content_type,
+                                                 response.headers.get("Location"), response.get_data())
+        return response
+    return wrapper
+
+
+def use_sms_worker(worker) -> None:
+    """Swaps in another outbox worker (asgi.py uses AsyncSmsOutboxWorker)."""
+    global sms_worker
+    sms_worker = worker
+    finish_scheduler.on_queued = worker.wake
+
+
+def start_background_workers() -> None:
+    sms_worker.start()
+    finish_scheduler.start()
+    stale_sweeper.start()
+    idempotency_purger.start()
+
 
 @app.route("/init-db")
 def init_db():
     with open("schema.sql", "r", encoding="utf-8") as f:
         schema = f.read()
 
-    with get_connection() as conn:
+    with repository.connection() as conn:
         conn.executescript(schema)
         conn.commit()
 
+    repository.migrate_db()
+
     return "Database initialized."
 
 
+@app.route("/migrate-db")
+def migrate_db_route():
+    # Non-destructive upgrade for existing databases (keeps all sessions).
+    applied = repository.migrate_db()
+    if not applied:
+        return "Database already up to date."
+    return "Applied migrations: " + ", ".join(applied)
+
+
 def generate_verification_code(length: int = 6) -> str:
     digits = string.digits
     return "".join(secrets.choice(digits) for _ in range(length))
 
 
+def scan_page(machine_id: str, machine: dict | None, has_active: bool) -> Response:
+    """
+    SC1/SC4: the blank start form or verify screen, served from scan_pages.
+    Both depend only on the machine row, so the row is the cache/ETag key.
+    """
+    template = "verify_code.html" if has_active else "machine_start.html"
+    key = (template, machine_id, tuple(sorted(machine.items())) if machine else None)
+    etag = scan_pages.etag(key)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = scan_pages.get(key)
+        if body is None:
+            if has_active:
+                body = render_template(template, machine_id=machine_id, machine=machine, error=None)
+            else:
+                body = render_template(
+                    template,
+                    machine_id=machine_id,
+                    machine=machine,
+                    errors=[],
+                    values={"first_name": "", "last_name": "", "phone_number": ""}
+                )
+            scan_pages.put(key, body)
+        response = Response(body, mimetype="text/html")
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"  # always revalidate: state changes often.
+    return response
+
+
 @app.route("/machine/<machine_id>/start", methods=["GET", "POST"])
+@limit_attempts("verify")
 def start_load(machine_id):
     # SC1: validate machine ID from the QR-based route.
     if not ISVALIDMACHINEID(machine_id):
         return "Invalid machine ID.", 400
 
     # SC5: ensure machine row exists and load occupancy/condition state.
-    ensure_machine_exists(machine_id)
-    machine = get_machine_by_id(machine_id)
+    repository.ensure_machine_exists(machine_id)
+    machine = repository.get_machine_by_id(machine_id)
 
     errors = []
     form_values = {"first_name": "", "last_name": "", "phone_number": ""}
 
     # SC4: check for an active session to require verification on re-scan.
-    active = get_active_session_by_machine(machine_id)
+    active = repository.get_active_session_by_machine(machine_id)
 
     # SC1/SC4: GET shows verify screen if active session exists, otherwise start form.
     if request.method == "GET":
-        if active is not None:
-            return render_template(
-                "verify_code.html",
-                machine_id=machine_id,
-                machine=machine,
-                error=None
-            )
-        return render_template(
-            "machine_start.html",
-            machine_id=machine_id,
-            machine=machine,
-            errors=errors,
-            values=form_values
-        )
+        return scan_page(machine_id, machine, active is not None)
 
     # SC4 vs SC1/SC2/SC5/SC6: POST verifies pickup for active sessions or starts a new session.
     if active is not None:
@@ -98,6 +271,7 @@ def start_load(machine_id):
         ok_supervisor = hmac.compare_digest(str(entered), str(SUPERVISOR_CODE))
 
         if not (ok_student or ok_supervisor):
+            record_failed_code("verify", machine_id)
             return render_template(
                 "verify_code.html",
                 machine_id=machine_id,
@@ -148,33 +322,54 @@ def start_load(machine_id):
     expected_end_dt = time_in_dt + timedelta(minutes=CYCLE_DURATION_MINUTES)
     expected_end = expected_end_dt.strftime("%Y-%m-%d %H:%M:%S")
 
-    status = "active"
-
-    session_id = insert_session(
+    # SC1/SC4/SC5: insert the session with its code and mark the machine
+    # occupied in one transaction, re-checking active/broken under the lock.
+    result = repository.start_session(
         machine_id=machine_id,
         first_name=first_name,
         last_name=last_name,
         phone_number=phone_clean,
         time_in=time_in,
         expected_end=expected_end,  # SC6
-        status=status
+        verification_code=generate_verification_code(6)
     )
 
-    code = generate_verification_code(6)
-    set_verification_code(session_id, code)
+    if result["outcome"] == "active":
+        # SC4: another scan started a load first; show the verify screen.
+        return redirect(url_for("start_load", machine_id=machine_id))
 
-    # SC5: mark machine occupied when a load starts.
-    set_machine_occupied(machine_id)
+    if result["outcome"] == "broken":
+        return render_template(
+            "machine_start.html",
+            machine_id=machine_id,
+            machine=result["machine"],
+            errors=["Machine is marked broken. New loads cannot be started."],
+            values=form_values,
+        )
+
+    # SC3: the server sends the finish SMS when the cycle ends. Without a scheduler
+    # in this process, the run-workers process picks the session up on resync.
+    finish_scheduler.schedule(result["session"]["SESSIONID"], expected_end)
 
-    return redirect(url_for("session_page", session_id=session_id))
+    # SC2: a student who came from the hallway queue link leaves the queue;
+    # the link carries the entry's token, so nobody else's entry is closed.
+    entry_id = request.args.get("queue_entry", type=int)
+    if entry_id is not None:
+        entry = repository.get_queue_entry(entry_id, waitlist.queue_cutoff(time_in_dt))
+        if _queue_entry_token_ok(entry, request.args.get("queue_token")) and \
+                (entry["HALLWAY"], entry["MACHINE_TYPE"]) == waitlist.group_of(machine_id):
+            repository.close_queue_entry(entry_id, "served", time_in, machine_id)
+
+    return redirect(url_for("session_page", session_id=result["session"]["SESSIONID"]))
 
 
 @app.route("/machine/<machine_id>/condition", methods=["POST"])
+@limit_attempts("supervisor")
 def change_machine_condition(machine_id):
     if not ISVALIDMACHINEID(machine_id):
         return "Invalid machine ID.", 400
 
-    ensure_machine_exists(machine_id)
+    repository.ensure_machine_exists(machine_id)
 
     action = request.form.get("action")  # SC5: report broken or resolve issue action.
     code_in = (request.form.get("supervisor_code") or "").strip()
@@ -185,8 +380,9 @@ def change_machine_condition(machine_id):
 
     # SC5: require supervisor code to change machine condition.
     if not hmac.compare_digest(str(code_in), str(SUPERVISOR_CODE)):
-        machine = get_machine_by_id(machine_id)
-        active = get_active_session_by_machine(machine_id)
+        record_failed_code("supervisor", machine_id)
+        machine = repository.get_machine_by_id(machine_id)
+        active = repository.get_active_session_by_machine(machine_id)
         msg = "Invalid supervisor code — condition not changed."
 
         if active is not None:
@@ -208,14 +404,14 @@ def change_machine_condition(machine_id):
     new_condition = "broken" if action == "REPORT_BROKEN" else "normal"
 
     # SC5/SC6: update condition status and stamp problem timestamps.
-    update_machine_condition(machine_id, new_condition, reason)
+    repository.update_machine_condition(machine_id, new_condition, reason)
 
     return redirect(url_for("start_load", machine_id=machine_id))
 
 
 @app.route("/session/<int:session_id>")
 def session_page(session_id):
-    row = get_session_by_id(session_id)
+    row = repository.get_session_by_id(session_id)
     if row is None:
         return "Session not found.", 404
 
@@ -228,13 +424,15 @@ def session_page(session_id):
         "session_started.html",
         session=row,
         expected_end=expected_end,
-        expected_end_epoch=expected_end_epoch
+        expected_end_epoch=expected_end_epoch,
+        message_preview=build_finish_message(row["MACHINEID"], row["FIRSTNAME"])
     )
 
 
 @app.route("/session/<int:session_id>/send-finish-sms", methods=["POST"])
+@idempotent
 def send_finish_sms(session_id):
-    row = get_session_by_id(session_id)
+    row = repository.get_session_by_id(session_id)
     if row is None:
         return jsonify({"error": "Session not found"}), 404
 
@@ -244,49 +442,51 @@ def send_finish_sms(session_id):
     if current_status.startswith("SENT"):
         return jsonify({
             "already_sent": True,
+            "queued": False,
+            "already_queued": False,
             "finish_sms_status": row["FINISH_SMS_STATUS"],
             "finish_sms_sent_at": row["FINISH_SMS_SENT_AT"],
             "message_preview": message_preview
         }), 200
 
-    sent_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    result = twilio_send_finish_sms(row["PHONENUMBER"], row["MACHINEID"], row["FIRSTNAME"])
-
-    if result["success"]:
-        status_text = f"SENT:{result['sid']}"
+    # SC3: queue the message; sms_worker sends it and records SENT/FAILED.
+    # The compare-and-set in enqueue_finish_sms lets one concurrent caller win.
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    queued = repository.enqueue_finish_sms(session_id, now)
+    if queued:
+        sms_worker.wake()
     else:
-        status_text = f"FAILED:{result['error_type']}"
-
-    update_finish_sms(session_id, status_text, sent_at)
+        row = repository.get_session_by_id(session_id)  # another request queued (or sent) it first
 
+    # 202 only when this request queued the message; otherwise 200 with the current state.
+    already_sent = not queued and (row["FINISH_SMS_STATUS"] or "").startswith("SENT")
     return jsonify({
-        "already_sent": False,
-        "success": status_text.startswith("SENT"),
-        "finish_sms_status": status_text,
-        "finish_sms_sent_at": sent_at,
-        "message_preview": message_preview,
-        "twilio_debug": result
-    }), 200
+        "already_sent": already_sent,
+        "queued": queued,
+        "already_queued": not queued and not already_sent,
+        "finish_sms_status": "QUEUED" if queued else row["FINISH_SMS_STATUS"],
+        "finish_sms_sent_at": None if queued else row["FINISH_SMS_SENT_AT"],
+        "message_preview": message_preview
+    }), 202 if queued else 200
 
 
 @app.route("/session/<int:session_id>/confirm-pickup")
 def confirm_pickup(session_id):
-    row = get_session_by_id(session_id)
+    row = repository.get_session_by_id(session_id)
     if row is None:
         return "Session not found.", 404
 
     # SC6: show delay preview using grace rule.
-    expected_end_dt = datetime.strptime(row["EXPECTED_END"], "%Y-%m-%d %H:%M:%S")
-    now_dt = datetime.now()
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    late_by_min = max(0, int((now_dt - expected_end_dt).total_seconds() // 60))
-    delay_recorded = max(0, late_by_min - GRACE_MINUTES)
+    late_by_min = LATEBYMINUTES(row["EXPECTED_END"], now_str)
+    delay_recorded = PICKUPDELAYMINUTES(row["EXPECTED_END"], now_str)
 
     return render_template(
         "confirm_pickup.html",
         session=row,
         machine_id=row["MACHINEID"],
-        now_str=now_dt.strftime("%Y-%m-%d %H:%M:%S"),
+        now_str=now_str,
         late_by_min=late_by_min,
         grace_min=GRACE_MINUTES,
         delay_recorded=delay_recorded
@@ -294,34 +494,34 @@ def confirm_pickup(session_id):
 
 
 @app.route("/session/<int:session_id>/pickup", methods=["POST"])
+@idempotent
 def pickup(session_id):
-    row = get_session_by_id(session_id)
+    row = repository.get_session_by_id(session_id)
     if row is None:
         return "Session not found.", 404
 
-    time_out_dt = datetime.now()
-    time_out = time_out_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-    # SC6: compute delay with 6-minute grace.
-    expected_end_dt = datetime.strptime(row["EXPECTED_END"], "%Y-%m-%d %H:%M:%S")
-    late_by_min = max(0, int((time_out_dt - expected_end_dt).total_seconds() // 60))
-    delay_min = max(0, late_by_min - GRACE_MINUTES)
+    # SC4: a repeated pickup (retry, double submit) changes nothing.
+    if row["STATUS"] == "active":
+        time_out = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    mark_picked_up(session_id, time_out, delay_min)
+        # SC6: compute delay with 6-minute grace (same rule as the stale-session sweeper).
+        delay_min = PICKUPDELAYMINUTES(row["EXPECTED_END"], time_out)
 
-    # SC5: update occupancy when a load finishes
-    set_machine_vacant(row["MACHINEID"])
+        # SC5: also marks the machine vacant, in the same transaction, unless
+        # another session is active on it; a no-op if a concurrent pickup won.
+        repository.mark_picked_up(session_id, time_out, delay_min)
 
     return redirect(url_for("start_load", machine_id=row["MACHINEID"]))
 
 
 @app.route("/machine/<machine_id>/summary-login", methods=["GET", "POST"])
+@limit_attempts("supervisor")
 def summary_login(machine_id):
     if not ISVALIDMACHINEID(machine_id):
         return "Invalid machine ID.", 400
 
-    ensure_machine_exists(machine_id)
-    machine = get_machine_by_id(machine_id)
+    repository.ensure_machine_exists(machine_id)
+    machine = repository.get_machine_by_id(machine_id)
 
     error = None
 
@@ -331,6 +531,7 @@ def summary_login(machine_id):
         if hmac.compare_digest(str(code_in), str(SUPERVISOR_CODE)):
             return redirect(url_for("machine_summary", machine_id=machine_id))
 
+        record_failed_code("supervisor", machine_id)
         error = "Invalid supervisor code."
 
     return render_template(
@@ -346,10 +547,10 @@ def machine_summary(machine_id):
     if not ISVALIDMACHINEID(machine_id):
         return "Invalid machine ID.", 400
 
-    ensure_machine_exists(machine_id)
-    machine = get_machine_by_id(machine_id)
+    repository.ensure_machine_exists(machine_id)
+    machine = repository.get_machine_by_id(machine_id)
 
-    stats = get_machine_summary_stats(machine_id)
+    stats = repository.get_machine_summary_stats(machine_id)
 
     return render_template(
         "summary.html",
@@ -360,5 +561,367 @@ def machine_summary(machine_id):
     )
 
 
+@app.route("/summary")
+def dorm_summary():
+    # SC6: dorm-wide view; one aggregate query for every machine.
+    stats = repository.get_machine_summary_stats_many()
+
+    return render_template(
+        "dorm_summary.html",
+        stats=stats,
+        grace_min=GRACE_MINUTES
+    )
+
+
+# -----------------------------
+# Session history API (SC6): supervisor-only audit access.
+# -----------------------------
+
+HISTORY_PAGE_DEFAULT = 100
+HISTORY_PAGE_MAX = 1000
+ANALYTICS_DEFAULT_DAYS = 28
+
+
+def supervisor_authorized() -> bool:
+    """
+    True if the X-Supervisor-Code header holds the supervisor code. Only the
+    header is read: query strings end up in access logs and browser history.
+    A wrong code is charged to the client (see limit_attempts).
+    """
+    code_in = (request.headers.get("X-Supervisor-Code") or "").strip()
+    if not code_in:
+        return False
+    if hmac.compare_digest(code_in, str(SUPERVISOR_CODE)):
+        return True
+    record_failed_code("supervisor", None)
+    return False
+
+
+def _parse_history_time(value: str, end: bool) -> str:
+    # Dates are whole days: "until=2026-01-31" includes all of the 31st.
+    if len(value) == 10:
+        day = datetime.strptime(value, "%Y-%m-%d")
+        if end:
+            day += timedelta(days=1)
+        return day.strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+
+
+def history_filters() -> tuple[dict, str | None]:
+    """
+    Reads machine/since/until/status from the query string.
+    Returns (filters for db.get_session_history, error message or None).
+    """
+    filters = {}
+
+    machine_id = (request.args.get("machine") or "").strip()
+    if machine_id:
+        if not ISVALIDMACHINEID(machine_id):
+            return {}, "Invalid machine ID."
+        filters["machine_id"] = machine_id
+
+    for arg, end in (("since", False), ("until", True)):
+        value = (request.args.get(arg) or "").strip()
+        if value:
+            try:
+                filters[arg] = _parse_history_time(value, end)
+            except ValueError:
+                return {}, f"{arg} must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS."
+
+    status = (request.args.get("status") or "").strip()
+    if status:
+        if status not in ("active", "picked_up"):
+            return {}, "status must be active or picked_up."
+        filters["status"] = status
+
+    return filters, None
+
+
+@app.route("/api/sessions")
+@limit_attempts("supervisor", methods=("GET",))
+def api_sessions():
+    if not supervisor_authorized():
+        return jsonify({"error": "Supervisor code required"}), 403
+
+    filters, error = history_filters()
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        limit = min(int(request.args.get("limit", HISTORY_PAGE_DEFAULT)), HISTORY_PAGE_MAX)
+        cursor = request.args.get("cursor")
+        before_id = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    sessions = repository.get_session_history(before_id=before_id, limit=limit, **filters)
+    next_cursor = sessions[-1]["SESSIONID"] if len(sessions) == limit else None
+
+    return jsonify({"sessions": sessions, "next_cursor": next_cursor})
+
+
+def _csv_lines(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(HISTORY_COLUMNS)
+    for row in rows:
+        writer.writerow([row[c] for c in HISTORY_COLUMNS])
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, separators=(",", ":")) + "\n"
+
+
+@app.route("/api/sessions/export")
+@limit_attempts("supervisor", methods=("GET",))
+def api_sessions_export():
+    if not supervisor_authorized():
+        return jsonify({"error": "Supervisor code required"}), 403
+
+    filters, error = history_filters()
+    if error:
+        return jsonify({"error": error}), 400
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    # Streamed straight from keyset pages; nothing is collected in memory. The body
+    # is sent after the request's teardown, so it borrows its own connection.
+    rows = repository.iter_session_history(**filters)
+    if fmt == "csv":
+        body, mimetype = _csv_lines(rows), "text/csv"
+    else:
+        body, mimetype = _ndjson_lines(rows), "application/x-ndjson"
+
+    return Response(
+        body,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=sessions.{fmt}"}
+    )
+
+
+@app.route("/api/analytics")
+@limit_attempts("supervisor", methods=("GET",))
+def api_analytics():
+    # SC6: peak-hour heatmap, utilization and late pickups from analytics.py buckets.
+    if not supervisor_authorized():
+        return jsonify({"error": "Supervisor code required"}), 403
+
+    filters, error = history_filters()
+    if error or "status" in filters:
+        return jsonify({"error": error or "status is not supported here"}), 400
+
+    until = filters.get("until") or (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d 00:00:00")
+    since = filters.get("since") or (
+        datetime.strptime(until, "%Y-%m-%d %H:%M:%S") - timedelta(days=ANALYTICS_DEFAULT_DAYS)
+    ).strftime("%Y-%m-%d %H:%M:%S")
+    machine_ids = (filters["machine_id"],) if "machine_id" in filters else None
+
+    return jsonify(analytics.report(since, until, machine_ids))
+
+
+def _queue_kind() -> str | None:
+    kind = request.values.get("kind") or (request.get_json(silent=True) or {}).get("kind")
+    return waitlist.KINDS.get(kind)
+
+
+def _queue_entry_token_ok(entry: dict | None, token: str | None) -> bool:
+    # SC2: only the student who joined holds the entry's token.
+    return entry is not None and bool(token) and hmac.compare_digest(str(token), str(entry["TOKEN"] or ""))
+
+
+def _queue_entry_json(entry: dict) -> dict:
+    result = {
+        "entry_id": entry["ENTRYID"],
+        "hallway": entry["HALLWAY"],
+        "machine_type": entry["MACHINE_TYPE"],
+        "joined_at": entry["JOINED_AT"],
+        "status": entry["STATUS"],
+        "position": entry["POSITION"],
+    }
+    if entry["STATUS"] == "waiting":
+        status = hallway_queues.status(entry["HALLWAY"], entry["MACHINE_TYPE"], entry["POSITION"])
+        result["next"] = status["next"]
+        if status["next"] is not None:
+            result["start_url"] = url_for(
+                "start_load", machine_id=status["next"]["machine_id"],
+                queue_entry=entry["ENTRYID"], queue_token=entry["TOKEN"],
+            )
+    elif entry["STATUS"] == "served":
+        result["machine_id"] = entry["MACHINEID"]
+    return result
+
+
+@app.route("/api/queue/<hallway_id>", methods=["GET", "POST"])
+def api_hallway_queue(hallway_id):
+    # SC2/SC5: where to go next when a machine is taken, and how long the wait is.
+    if hallway_id not in waitlist.HALLWAY_IDS:
+        return jsonify({"error": "Unknown hallway."}), 404
+    machine_type = _queue_kind()
+    if machine_type is None:
+        return jsonify({"error": "kind must be one of: " + ", ".join(waitlist.KINDS)}), 400
+    group = (hallway_id, machine_type)
+
+    now = datetime.now()
+    if request.method == "POST":
+        data = request.get_json(silent=True) or request.form
+        first_name = (data.get("first_name") or "").strip() or None
+        entry = repository.join_queue(*group, first_name, secrets.token_urlsafe(16),
+                                      now.strftime("%Y-%m-%d %H:%M:%S"), waitlist.queue_cutoff(now))
+        # The token is only handed out here; reading or leaving the entry needs it.
+        return jsonify(dict(_queue_entry_json(entry), token=entry["TOKEN"])), 201
+
+    waiting = repository.count_queue_waiting(*group, waitlist.queue_cutoff(now))
+    status = hallway_queues.status(*group, position=waiting)
+    return jsonify({
+        "hallway": hallway_id,
+        "machine_type": group[1],
+        "waiting": waiting,
+        "next": status["next"],  # for someone joining the queue now
+        "machines": status["machines"],
+    })
+
+
+@app.route("/api/queue/entries/<int:entry_id>", methods=["GET", "DELETE"])
+def api_queue_entry(entry_id):
+    # SC2: the X-Queue-Token header must hold the token returned when joining.
+    now = datetime.now()
+    entry = repository.get_queue_entry(entry_id, waitlist.queue_cutoff(now))
+    if not _queue_entry_token_ok(entry, request.headers.get("X-Queue-Token")):
+        return jsonify({"error": "Queue entry not found."}), 404
+
+    if request.method == "DELETE":
+        if not repository.close_queue_entry(entry_id, "left", now.strftime("%Y-%m-%d %H:%M:%S")):
+            return jsonify({"error": "Entry is not waiting."}), 409
+        entry = repository.get_queue_entry(entry_id, waitlist.queue_cutoff(now))
+    return jsonify(_queue_entry_json(entry))
+
+
+@app.route("/machines")
+def machines_snapshot():
+    # SC5: all machines and their active sessions in one response, for dashboards.
+    machines, tag = repository.get_machines_snapshot()
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
+    else:
+        response = jsonify({"machines": machines})
+    response.set_etag(tag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/board")
+def board_page():
+    # SC2/SC5: dorm-wide availability; live updates come from /board/stream.
+    return render_template("board.html", state=repository.get_board_state())
+
+
+@app.route("/board/stream")
+def board_stream():
+    return Response(
+        board.stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.cli.command("provision-machines")
+def provision_machines_command():
+    """Create a machines row for every machine ID in the catalog, in one transaction."""
+    added = repository.provision_machines()
+    print(f"Provisioned {added} new machines ({len(CATALOG)} in the catalog).")
+
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute the machine_stats rollup from sessions and the incident log."""
+    count = repository.rebuild_machine_stats()
+    print(f"Rebuilt stats for {count} machines.")
+
+
+@app.cli.command("check-stats")
+def check_stats_command():
+    """Report machine_stats rows that disagree with sessions and the incident log."""
+    mismatches = repository.check_machine_stats()
+    for m in mismatches:
+        print(f"{m['machine_id']} {m['column']}: expected {m['expected']}, stored {m['actual']}")
+    if mismatches:
+        raise SystemExit(1)
+    print("machine_stats is consistent.")
+
+
+@app.cli.command("refresh-analytics")
+@click.option("--rebuild", is_flag=True, help="Recompute all usage buckets from scratch.")
+def refresh_analytics_command(rebuild):
+    """Fold newly picked-up sessions into the analytics usage buckets."""
+    watermark = analytics.rebuild() if rebuild else analytics.refresh()
+    print(f"Usage buckets include sessions picked up through {watermark}.")
+
+
+@app.cli.command("archive-sessions")
+@click.option("--days", type=int, default=lambda: int(os.getenv("ARCHIVE_AFTER_DAYS", "180")),
+              help="Archive sessions picked up more than this many days ago.")
+def archive_sessions_command(days):
+    """Move old picked-up sessions from sessions into sessions_archive."""
+    now = datetime.now()
+    cutoff = (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    analytics.refresh()  # incremental analytics only reads the hot table.
+    moved = repository.archive_sessions(cutoff, now.strftime("%Y-%m-%d %H:%M:%S"))
+    print(f"Archived {moved} sessions picked up before {cutoff}.")
+
+
+@app.cli.command("sweep-sessions")
+@click.option("--minutes", type=int, default=None,
+              help="Close sessions whose cycle ended more than this many minutes ago.")
+def sweep_sessions_command(minutes):
+    """Auto-close active sessions that were never picked up."""
+    sweeper = StaleSessionSweeper() if minutes is None else StaleSessionSweeper(stale_after_minutes=minutes)
+    if not sweeper.enabled:
+        print("Stale-session sweeping is disabled (STALE_SESSION_MINUTES=0).")
+        return
+    closed = sweeper.sweep()
+    print(f"Closed {closed} sessions ending more than {sweeper.stale_after_minutes} minutes ago.")
+
+
+@app.cli.command("purge-idempotency-keys")
+def purge_idempotency_keys_command():
+    """Drop stored Idempotency-Key responses older than IDEMPOTENCY_TTL_HOURS."""
+    purger = IdempotencyKeyPurger()
+    purged = purger.purge()
+    print(f"Purged {purged} idempotency keys older than {purger.ttl_hours:g} hours.")
+
+
+@app.cli.command("run-workers")
+def run_workers_command():
+    """
+    Run the background workers in this process until interrupted.
+
+    Needed next to `flask run` or gunicorn: the finish scheduler, SMS outbox
+    worker, stale-session sweeper and idempotency-key purger only run here.
+    """
+    repository.warm_machine_cache()
+    start_background_workers()
+    print("Background workers running. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stale_sweeper.stop()
+        idempotency_purger.stop()
+        finish_scheduler.stop()
+        sms_worker.stop()
+
+
 if __name__ == "__main__":
+    repository.warm_machine_cache()
+    start_background_workers()
     app.run()
@@ -0,0 +1,148 @@
+"""
+ASGI entry point: the same routes as app.py, served on an event loop.
+
+    uvicorn asgi:application --workers 2
+
+Flask views keep their sync code and run on a bounded thread pool
+(DLMS_ASGI_THREADS, default 32) whose threads each keep their own
+SQLite connection, so a view blocked on a commit no longer blocks the
+server's accept loop. The two I/O-bound paths that do not need a thread
+at all are moved onto the loop:
+  - /board/stream: each SSE viewer is a coroutine (BoardBroadcaster.astream),
+    not a thread parked on a queue for minutes.
+  - SC3 finish SMS: AsyncSmsOutboxWorker sends through an httpx
+    AsyncClient; its short claim/record SQLite calls are offloaded.
+
+Needs asgiref and httpx (plus an ASGI server such as uvicorn).
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+import db
+from sms_worker import AsyncSmsOutboxWorker
+
+ASGI_THREADS = int(os.getenv("DLMS_ASGI_THREADS", "32"))
+
+
+class _PooledWsgiToAsgi(WsgiToAsgi):
+    """
+    WsgiToAsgi that runs each request on `executor`.
+
+    The stock adapter runs the WSGI app thread-sensitively, which funnels
+    every request through one shared thread. Here each request is driven
+    from a thread of `executor` via async_to_sync, and asgiref runs
+    thread-sensitive code in the outermost sync thread, so the view runs
+    on that pool thread instead.
+    """
+
+    def __init__(self, wsgi_application, executor: ThreadPoolExecutor, **kwargs):
+        super().__init__(wsgi_application, **kwargs)
+        self.executor = executor
+        self._run_in_pool = sync_to_async(
+            async_to_sync(super().__call__), thread_sensitive=False, executor=executor
+        )
+
+    async def __call__(self, scope, receive, send):
+        await self._run_in_pool(scope, receive, send)
+
+
+view_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="dlms-view")
+wsgi = _PooledWsgiToAsgi(flask_app.app, view_executor)
+
+sms_worker = AsyncSmsOutboxWorker(max_concurrency=int(os.getenv("SMS_MAX_CONCURRENCY", "4")))
+
+
+# -----------------------------
+# Native async routes
+# -----------------------------
+
+async def board_stream(scope, receive, send):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def pump():
+        async for frame in flask_app.board.astream():
+            await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+
+    disconnect = asyncio.ensure_future(wait_for_disconnect())
+    stream = asyncio.ensure_future(pump())
+    try:
+        await asyncio.wait({disconnect, stream}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (disconnect, stream):
+            task.cancel()
+        await asyncio.gather(disconnect, stream, return_exceptions=True)
+
+
+ASYNC_ROUTES = {
+    ("GET", "/board/stream"): board_stream,
+}
+
+
+# -----------------------------
+# Lifespan
+# -----------------------------
+
+async def startup() -> None:
+    await asyncio.to_thread(db.warm_machine_cache)
+    flask_app.use_sms_worker(sms_worker)
+    sms_worker.start()
+    flask_app.finish_scheduler.start()
+    flask_app.stale_sweeper.start()
+    flask_app.idempotency_purger.start()
+
+
+async def shutdown() -> None:
+    flask_app.stale_sweeper.stop(timeout=5)
+    flask_app.idempotency_purger.stop(timeout=5)
+    flask_app.finish_scheduler.stop(timeout=5)
+    flask_app.board.stop(timeout=5)
+    await sms_worker.aclose()
+    flask_app.repository.close()
+    view_executor.shutdown(wait=False)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    if scope["type"] == "http":
+        handler = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            await handler(scope, receive, send)
+            return
+
+    await wsgi(scope, receive, send)
@@ -0,0 +1,814 @@
+"""
+Benchmarks for DLMS.
+
+    python benchmark.py pool [--threads 8] [--requests 400]
+    python benchmark.py scan [--requests 2000]
+    python benchmark.py catalog [--iterations 200000]
+    python benchmark.py seed --db dlms.sqlite3 [--sessions 10000]
+    python benchmark.py routes [--sessions 10000] [--threads 8] [--cycles 50]
+                               [--url http://127.0.0.1:5000] [--json out.json]
+    python benchmark.py servers [--sessions 10000] [--threads 32] [--cycles 20]
+                                [--viewers 50] [--workers 2] [--json out.json]
+    python benchmark.py storage [--threads 16] [--cycles 50] [--pool-size 4] [--json out.json]
+    python benchmark.py ratelimit [--attackers 8] [--guesses 200] [--threads 4]
+                                  [--cycles 20] [--json out.json]
+
+pool: requests/second for start + pickup cycles through the Flask test
+client, once with a fresh SQLite connection per db.py call (the old
+behaviour) and once with the per-thread connection pool.
+
+scan: GET /machine/<id>/start requests/second with the render cache
+disabled, with it enabled, and as conditional GETs answered with 304.
+
+catalog: microbenchmark of machine ID validation, location formatting and
+phone digit extraction, string parsing versus the machine_catalog table.
+
+seed: fills a database with N historical (picked up) sessions spread over
+the past year across all 64 machines, then rebuilds machine_stats.
+
+routes: per-route latency (p50/p95/p99) and requests/second for
+start_load, session_page, confirm_pickup, pickup and machine_summary.
+Each cycle starts a load, views it, confirms and picks it up, then opens
+the machine summary. A route's req/s is its count over the time the
+clients spent in that route; the total line is over wall time. Runs against a freshly seeded temporary database
+through the Flask test client with sms_service stubbed out, or against a
+running server with --url (seed that server's database with `seed`).
+--json writes the report in a stable, diffable form.
+
+servers: sync vs async deployment. Seeds one temporary database, then runs
+the routes benchmark over real HTTP against `flask run` (threaded WSGI)
+and against `uvicorn asgi:application --workers N`, each while --viewers
+clients hold /board/stream open. Needs uvicorn, asgiref and httpx.
+
+storage: operations/second for start/read/snapshot/pickup cycles called
+directly on per-thread connections, the connection pool on a file and the
+connection pool on an in-memory database, with more threads than pooled
+connections, and how many connections each opened.
+
+ratelimit: brute-force stress test. Attackers post wrong verification
+codes for one occupied machine while students run normal cycles, with
+the attempt limiter off, in memory and in SQLite mode; reports how many
+guesses reached db.py, lockouts and the students' latency.
+
+The correctness checks (query plans, idempotency, storage conformance,
+attempt limits) live in tests/; run them with `python -m pytest`.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# The benchmarks replay many POSTs from one address; ratelimit is measured separately.
+os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+
+import db
+import helpers
+import sms_service
+import storage
+from machine_catalog import ALL_MACHINE_IDS
+
+MACHINE_IDS = list(ALL_MACHINE_IDS)
+
+
+def _unpooled_connection() -> sqlite3.Connection:
+    # Pre-pool get_connection(): one new connection per call, default pragmas.
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _fresh_database(directory: str, name: str) -> str:
+    path = os.path.join(directory, name)
+    db.DB_PATH = path
+    with open("schema.sql", "r", encoding="utf-8") as f:
+        schema = f.read()
+    with db.get_connection() as conn:
+        conn.executescript(schema)
+        conn.commit()
+    db.migrate_db()
+    return path
+
+
+def _run_cycles(app, machine_ids: list[str], count: int, errors: list) -> None:
+    client = app.test_client()
+    for i in range(count):
+        machine_id = machine_ids[i % len(machine_ids)]
+        resp = client.post(f"/machine/{machine_id}/start", data={
+            "first_name": "Bench",
+            "last_name": "Student",
+            "phone_number": "5550001111",
+        })
+        location = resp.headers.get("Location", "")
+        if resp.status_code != 302 or "/session/" not in location:
+            errors.append(resp.status_code)
+            continue
+        session_id = location.rstrip("/").split("/")[-1]
+        resp = client.post(f"/session/{session_id}/pickup")
+        if resp.status_code != 302:
+            errors.append(resp.status_code)
+    db.close_connection()
+
+
+def bench_pool(threads: int, requests_total: int) -> dict:
+    from app import app
+
+    results = {}
+    pooled_connection = db.get_connection
+    per_thread = max(1, requests_total // threads)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, factory in (("unpooled", _unpooled_connection), ("pooled", pooled_connection)):
+            _fresh_database(tmp, f"{label}.sqlite3")
+            db.get_connection = factory  # db.py helpers resolve this name at call time.
+
+            # Each thread owns its own machines so cycles never collide.
+            groups = [[m for j, m in enumerate(MACHINE_IDS) if j % threads == t] or MACHINE_IDS
+                      for t in range(threads)]
+            errors = []
+            workers = [
+                threading.Thread(target=_run_cycles, args=(app, groups[t], per_thread, errors))
+                for t in range(threads)
+            ]
+
+            start = time.perf_counter()
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            elapsed = time.perf_counter() - start
+
+            # Each cycle is two requests: start POST + pickup POST.
+            results[label] = {
+                "requests": per_thread * threads * 2,
+                "seconds": round(elapsed, 3),
+                "rps": round(per_thread * threads * 2 / elapsed, 1),
+                "errors": len(errors),
+            }
+        db.get_connection = pooled_connection
+
+    return results
+
+
+def bench_scan(requests_total: int) -> dict:
+    import app as app_module
+
+    results = {}
+    client = app_module.app.test_client()
+    cache = app_module.scan_pages
+    default_size = cache.max_entries
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _fresh_database(tmp, "scan.sqlite3")
+        etags = {m: client.get(f"/machine/{m}/start").headers["ETag"] for m in MACHINE_IDS}
+
+        modes = (("uncached", 0, False), ("cached", default_size, False), ("304", default_size, True))
+        try:
+            for label, size, conditional in modes:
+                cache.clear()
+                cache.max_entries = size
+                errors = 0
+                t0 = time.perf_counter()
+                for i in range(requests_total):
+                    machine_id = MACHINE_IDS[i % len(MACHINE_IDS)]
+                    headers = {"If-None-Match": etags[machine_id]} if conditional else {}
+                    resp = client.get(f"/machine/{machine_id}/start", headers=headers)
+                    if resp.status_code != (304 if conditional else 200):
+                        errors += 1
+                elapsed = time.perf_counter() - t0
+                results[label] = {
+                    "requests": requests_total,
+                    "seconds": round(elapsed, 3),
+                    "rps": round(requests_total / elapsed, 1),
+                    "errors": errors,
+                }
+        finally:
+            cache.max_entries = default_size
+            cache.clear()
+        db.close_connection()
+
+    return results
+
+
+def _parsed_is_valid(machine_id) -> bool:
+    # Pre-catalog helpers.ISVALIDMACHINEID.
+    if machine_id is None:
+        return False
+    return re.fullmatch(r"^[MF][A-D][1-8]$", str(machine_id)) is not None
+
+
+def _parsed_location(machine_id: str) -> str:
+    # Pre-catalog sms_service.format_machine_location.
+    num = int(machine_id[2])
+    floor_text = "third floor (Boys)" if machine_id[0] == "M" else "second floor (Girls)"
+    machine_type = "washing machine" if 1 <= num <= 4 else "drying machine"
+    return f"{machine_type} {num} in hallway {machine_id[1]}, {floor_text}"
+
+
+def _concat_digits(text: str) -> str:
+    # Pre-catalog helpers.KEEPDIGITSONLY.
+    digits = ""
+    for ch in str(text):
+        if ch.isdigit():
+            digits = digits + ch
+    return digits
+
+
+def bench_catalog(iterations: int) -> dict:
+    # Half valid IDs, half near misses, like real scans plus typos.
+    ids = MACHINE_IDS + [m[:2] + "9" for m in MACHINE_IDS]
+    phones = ["(555) 000-1111", "555.000.1111 ext 2", "+1 555 000 1111"]
+
+    cases = {
+        "validate": (_parsed_is_valid, helpers.ISVALIDMACHINEID, ids),
+        "location": (_parsed_location, sms_service.format_machine_location, MACHINE_IDS),
+        "digits": (_concat_digits, helpers.KEEPDIGITSONLY, phones),
+    }
+    results = {}
+    for name, (before, after, inputs) in cases.items():
+        for a in inputs:
+            assert before(a) == after(a), (name, a)
+        timings = {}
+        for label, fn in (("before", before), ("after", after)):
+            t0 = time.perf_counter()
+            for i in range(iterations):
+                fn(inputs[i % len(inputs)])
+            timings[label] = time.perf_counter() - t0
+        results[name] = {
+            "before_ns": round(timings["before"] / iterations * 1e9, 1),
+            "after_ns": round(timings["after"] / iterations * 1e9, 1),
+            "speedup": round(timings["before"] / timings["after"], 2),
+        }
+    return results
+
+
+def seed_history(sessions: int, seed: int = 1) -> None:
+    """
+    Appends `sessions` picked-up sessions to the current db.DB_PATH and
+    provisions every machine. Inserts in chunks inside one transaction.
+    """
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=365)
+    chunk = 50_000
+
+    with db.immediate_transaction() as conn:
+        conn.executemany("""
+            INSERT OR IGNORE INTO machines (MACHINEID, OCCUPANCY_STATUS, CONDITION_STATUS)
+            VALUES (?, 'vacant', 'normal')
+        """, [(m,) for m in MACHINE_IDS])
+
+        for offset in range(0, sessions, chunk):
+            rows = []
+            for _ in range(min(chunk, sessions - offset)):
+                time_in = start + timedelta(minutes=rng.randrange(365 * 24 * 60))
+                expected_end = time_in + timedelta(minutes=45)
+                delay = rng.choice((0, 0, 0, 0, 1, 3, 8, 15, 40))
+                time_out = expected_end + timedelta(minutes=delay + (6 if delay else rng.randrange(7)))
+                rows.append((
+                    rng.choice(MACHINE_IDS), "Seed", "Student", "5550001111",
+                    time_in.strftime("%Y-%m-%d %H:%M:%S"),
+                    expected_end.strftime("%Y-%m-%d %H:%M:%S"),
+                    time_out.strftime("%Y-%m-%d %H:%M:%S"),
+                    delay,
+                ))
+            conn.executemany("""
+                INSERT INTO sessions (
+                    MACHINEID, FIRSTNAME, LASTNAME, PHONENUMBER,
+                    TIMEIN, EXPECTED_END, TIMEOUT, DELAY_MIN, STATUS, FINISH_SMS_STATUS
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'picked_up', 'SENT:SEED')
+            """, rows)
+
+    db.rebuild_machine_stats()
+
+
+class StubSmsClient:
+    """Stands in for sms_service.SmsClient; never touches the network."""
+
+    def send_finish_sms(self, phone10: str, machine_id: str, first_name: str | None = None) -> dict:
+        return {"success": True, "sid": "SM_BENCH"}
+
+    def send_many(self, messages: list[tuple], max_workers: int | None = None) -> list[dict]:
+        return [self.send_finish_sms(*m) for m in messages]
+
+    def close(self) -> None:
+        pass
+
+
+class _HttpClient:
+    """Same get/post surface as the Flask test client, over real HTTP."""
+
+    def __init__(self, base_url: str):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.http = requests.Session()
+
+    def get(self, path: str):
+        return self.http.get(self.base_url + path, allow_redirects=False, timeout=30)
+
+    def post(self, path: str, data: dict | None = None):
+        return self.http.post(self.base_url + path, data=data, allow_redirects=False, timeout=30)
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _route_worker(make_client, machine_ids: list[str], cycles: int, timings: dict, errors: list, lock) -> None:
+    client = make_client()
+    local = {}
+
+    def timed(route: str, call, expected: int):
+        t0 = time.perf_counter()
+        resp = call()
+        local.setdefault(route, []).append(time.perf_counter() - t0)
+        if resp.status_code != expected:
+            errors.append(f"{route}: HTTP {resp.status_code}")
+        return resp
+
+    for i in range(cycles):
+        machine_id = machine_ids[i % len(machine_ids)]
+        resp = timed("start_load", lambda: client.post(f"/machine/{machine_id}/start", data={
+            "first_name": "Bench",
+            "last_name": "Student",
+            "phone_number": "5550001111",
+        }), 302)
+        location = resp.headers.get("Location", "")
+        if "/session/" not in location:
+            continue
+        session_id = location.rstrip("/").split("/")[-1]
+
+        timed("session_page", lambda: client.get(f"/session/{session_id}"), 200)
+        timed("confirm_pickup", lambda: client.get(f"/session/{session_id}/confirm-pickup"), 200)
+        timed("pickup", lambda: client.post(f"/session/{session_id}/pickup"), 302)
+        timed("machine_summary", lambda: client.get(f"/machine/{machine_id}/summary"), 200)
+
+    with lock:
+        for route, values in local.items():
+            timings.setdefault(route, []).extend(values)
+    db.close_connection()
+
+
+def _route_report(timings: dict, elapsed: float, errors: list, config: dict, threads: int) -> dict:
+    routes = {}
+    for route in sorted(timings):
+        values = sorted(timings[route])
+        # Every cycle calls each route once, so count / elapsed would be the same
+        # for all of them; use the time the `threads` clients spent in this route.
+        busy = sum(values) / threads
+        routes[route] = {
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 50) * 1000, 3),
+            "p95_ms": round(_percentile(values, 95) * 1000, 3),
+            "p99_ms": round(_percentile(values, 99) * 1000, 3),
+            "rps": round(len(values) / busy, 1) if busy else 0.0,
+        }
+    total = sum(r["count"] for r in routes.values())
+    return {
+        "config": config,
+        "total_requests": total,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "errors": len(errors),
+        "routes": routes,
+    }
+
+
+def bench_routes(sessions: int, threads: int, cycles: int, url: str | None = None) -> dict:
+    """
+    Drives the five main routes from `threads` concurrent clients, each
+    running `cycles` start -> view -> confirm -> pickup -> summary loops on
+    its own machines. Returns the report dict (see _route_report).
+    """
+    config = {"mode": "http" if url else "test_client", "sessions": sessions,
+              "threads": threads, "cycles": cycles}
+    groups = [[m for j, m in enumerate(MACHINE_IDS) if j % threads == t] or MACHINE_IDS
+              for t in range(threads)]
+    timings, errors, lock = {}, [], threading.Lock()
+
+    def run(make_client) -> float:
+        workers = [
+            threading.Thread(target=_route_worker,
+                             args=(make_client, groups[t], cycles, timings, errors, lock))
+            for t in range(threads)
+        ]
+        t0 = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return time.perf_counter() - t0
+
+    if url:
+        elapsed = run(lambda: _HttpClient(url))
+        return _route_report(timings, elapsed, errors, config, threads)
+
+    from app import app
+
+    sms_service._default_client = StubSmsClient()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _fresh_database(tmp, "routes.sqlite3")
+            seed_history(sessions)
+            elapsed = run(app.test_client)
+            db.close_connection()
+    finally:
+        sms_service._default_client = None
+
+    return _route_report(timings, elapsed, errors, config, threads)
+
+
+def _attacker(app, client_ip: str, machine_id: str, guesses: int, statuses: dict, lock) -> None:
+    client = app.test_client()
+    client.environ_base["REMOTE_ADDR"] = client_ip
+    local = {}
+    for i in range(guesses):
+        resp = client.post(f"/machine/{machine_id}/start", data={"code": f"{i:06d}"})
+        local[resp.status_code] = local.get(resp.status_code, 0) + 1
+    with lock:
+        for status, n in local.items():
+            statuses[status] = statuses.get(status, 0) + n
+    db.close_connection()
+
+
+def bench_ratelimit(attackers: int, guesses: int, threads: int, cycles: int, checks: int = 20_000) -> dict:
+    """
+    Brute-force stress test. `attackers` clients each post `guesses` wrong
+    verification codes for one occupied machine while `threads` students
+    run normal start -> pickup cycles on the other machines, with the
+    limiter off, in memory and in the shared SQLite mode. Reports the
+    attackers' HTTP statuses and db.py connection checkouts, lockouts, the
+    students' route latency and raw limiter checks/second.
+    """
+    import app as app_module
+
+    import ratelimit
+
+    results = {}
+    real_get_connection = db.get_connection
+    target = MACHINE_IDS[-1]
+    groups = [[m for j, m in enumerate(MACHINE_IDS[:-1]) if j % threads == t] for t in range(threads)]
+
+    sms_service._default_client = StubSmsClient()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend in ("off", "memory", "sqlite"):
+                _fresh_database(tmp, f"ratelimit-{backend}.sqlite3")
+                limiter = ratelimit.from_env(backend, os.path.join(tmp, f"buckets-{backend}.sqlite3"))
+                app_module.code_attempts = limiter
+
+                owner = app_module.app.test_client()
+                owner.environ_base["REMOTE_ADDR"] = "192.168.0.1"
+                owner.post(f"/machine/{target}/start", data={
+                    "first_name": "Bench", "last_name": "Student", "phone_number": "5550001111",
+                })
+
+                attack_checkouts = itertools.count()
+
+                def counting_connection():
+                    if threading.current_thread().name.startswith("attacker"):
+                        next(attack_checkouts)
+                    return real_get_connection()
+
+                ips = itertools.count(1)
+
+                def student_client():
+                    client = app_module.app.test_client()
+                    client.environ_base["REMOTE_ADDR"] = f"192.168.1.{next(ips)}"
+                    return client
+
+                statuses, timings, errors, lock = {}, {}, [], threading.Lock()
+                workers = [
+                    threading.Thread(target=_attacker, name=f"attacker-{a}",
+                                     args=(app_module.app, f"10.0.{a}.1", target, guesses, statuses, lock))
+                    for a in range(attackers)
+                ] + [
+                    threading.Thread(target=_route_worker,
+                                     args=(student_client, groups[t], cycles, timings, errors, lock))
+                    for t in range(threads)
+                ]
+
+                db.get_connection = counting_connection  # db.py helpers resolve this name at call time.
+                try:
+                    t0 = time.perf_counter()
+                    for w in workers:
+                        w.start()
+                    for w in workers:
+                        w.join()
+                    elapsed = time.perf_counter() - t0
+                finally:
+                    db.get_connection = real_get_connection
+
+                report = _route_report(timings, elapsed, errors, {"backend": backend}, threads)
+                report["attack"] = {
+                    "requests": attackers * guesses,
+                    "statuses": {str(k): v for k, v in sorted(statuses.items())},
+                    "db_checkouts": next(attack_checkouts),
+                }
+                if limiter is not None:
+                    report["attack"].update(allowed=limiter.allowed, rejected=limiter.rejected,
+                                            failures=limiter.failures, lockouts=limiter.lockouts,
+                                            errors=limiter.errors)
+                    limiter.clear()
+                    t0 = time.perf_counter()
+                    for i in range(checks):
+                        limiter.check("bench", f"10.1.{i % 250}.{i // 250 % 250}", MACHINE_IDS[i % len(MACHINE_IDS)])
+                    report["checks_per_s"] = round(checks / (time.perf_counter() - t0), 1)
+                results[backend] = report
+                db.close_connection()
+    finally:
+        app_module.code_attempts = ratelimit.from_env()
+        sms_service._default_client = None
+
+    return results
+
+
+def _fresh_repository(strategy: str, path: str, pool_size: int = storage.DB_POOL_SIZE):
+    # An empty, migrated database behind a new repository using the given connection strategy.
+    db.DB_PATH = path
+    if strategy == "pooled":
+        repo = storage.PooledRepository(storage.ConnectionPool(storage.sqlite_connector(path), pool_size))
+    else:
+        repo = storage.from_env(strategy, path)
+    with open("schema.sql", "r", encoding="utf-8") as f:
+        schema = f.read()
+    with repo.connection() as conn:
+        conn.executescript(schema)
+    repo.migrate_db()
+    return repo
+
+
+def _storage_targets(tmp: str, name: str) -> list[tuple[str, str, str]]:
+    # (label, strategy, path): per-thread connections, the pool on a file, and
+    # the pool on an in-memory SQLite database (memdb).
+    return [
+        ("sqlite", "sqlite", os.path.join(tmp, f"{name}-sqlite.sqlite3")),
+        ("pooled", "pooled", os.path.join(tmp, f"{name}-pooled.sqlite3")),
+        ("pooled-memdb", "pooled", f"file:/dlms-{name}-{os.getpid()}?vfs=memdb"),
+    ]
+
+
+def _storage_worker(repo, machine_ids: list[str], cycles: int, errors: list) -> None:
+    stamp = datetime.now().strftime(helpers.TIME_FORMAT)
+    for i in range(cycles):
+        machine_id = machine_ids[i % len(machine_ids)]
+        try:
+            started = repo.start_session(machine_id, "Bench", "Student", "5550001111", stamp, stamp, "123456")
+            session_id = started["session"]["SESSIONID"]
+            repo.get_session_by_id(session_id)
+            repo.get_machines_snapshot()
+            repo.mark_picked_up(session_id, stamp, 0)
+        except sqlite3.Error as e:
+            errors.append(f"{type(e).__name__}: {e}")
+    db.close_connection()
+
+
+def bench_storage(threads: int, cycles: int, pool_size: int) -> dict:
+    """
+    Operations/second for start, read, snapshot and pickup cycles called
+    straight on each storage setup from `threads` threads.
+    """
+    results = {}
+    groups = [[m for j, m in enumerate(MACHINE_IDS) if j % threads == t] or MACHINE_IDS for t in range(threads)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, strategy, path in _storage_targets(tmp, "storage"):
+            repo = _fresh_repository(strategy, path, pool_size)
+            repo.provision_machines()
+            errors = []
+            workers = [threading.Thread(target=_storage_worker, args=(repo, groups[t], cycles, errors))
+                       for t in range(threads)]
+            started = time.perf_counter()
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+            elapsed = time.perf_counter() - started
+
+            ops = threads * cycles * 4
+            pool = getattr(repo, "pool", None)
+            results[label] = {
+                "ops": ops,
+                "seconds": round(elapsed, 3),
+                "ops_per_s": round(ops / elapsed, 1),
+                "errors": len(errors),
+                "connections": pool.opened if pool is not None else threads,
+                "pool_timeouts": pool.timeouts if pool is not None else 0,
+            }
+            repo.close()
+            db.close_connection()
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(url: str, proc: subprocess.Popen, timeout: float = 20.0) -> None:
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            requests.get(url + "/board", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not start")
+
+
+def _board_viewer(url: str, stop: threading.Event, frames: list) -> None:
+    import requests
+    try:
+        with requests.get(url + "/board/stream", stream=True, timeout=(5, 30)) as resp:
+            for line in resp.iter_lines():
+                if line.startswith(b"data:"):
+                    frames.append(1)
+                if stop.is_set():
+                    break
+    except requests.RequestException:
+        pass
+
+
+def bench_servers(sessions: int, threads: int, cycles: int, viewers: int, workers: int) -> dict:
+    """
+    Runs bench_routes over HTTP against the threaded WSGI server and the
+    ASGI server, both on copies of the same seeded database.
+    """
+    commands = {
+        "sync_wsgi": [sys.executable, "-m", "flask", "--app", "app", "run", "--with-threads", "--port", "{port}"],
+        "asgi": [sys.executable, "-m", "uvicorn", "asgi:application", "--workers", str(workers),
+                 "--port", "{port}", "--log-level", "warning"],
+    }
+    reports = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = _fresh_database(tmp, "template.sqlite3")
+        seed_history(sessions)
+        db.close_connection()
+
+        for mode, command in commands.items():
+            path = os.path.join(tmp, f"{mode}.sqlite3")
+            with sqlite3.connect(template) as src, sqlite3.connect(path) as dst:
+                src.backup(dst)
+
+            port = _free_port()
+            url = f"http://127.0.0.1:{port}"
+            env = dict(os.environ, DLMS_DB_PATH=path, TWILIO_ACCOUNT_SID="", TWILIO_AUTH_TOKEN="")
+            proc = subprocess.Popen([c.format(port=port) for c in command], env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            stop, frames = threading.Event(), []
+            viewer_threads = [threading.Thread(target=_board_viewer, args=(url, stop, frames), daemon=True)
+                              for _ in range(viewers)]
+            try:
+                _wait_for_server(url, proc)
+                for v in viewer_threads:
+                    v.start()
+                report = bench_routes(sessions, threads, cycles, url)
+                report["config"].update(mode=mode, viewers=viewers, board_frames=len(frames))
+                reports[mode] = report
+            finally:
+                stop.set()
+                proc.terminate()
+                try:
+                    proc.wait(10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    return reports
+
+
+def _print_route_report(report: dict) -> None:
+    print(f"{'route':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for route, r in report["routes"].items():
+        print(f"{route:<16}{r['count']:>7}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['rps']:>10}")
+    print(f"total: {report['total_requests']} requests, {report['rps']} req/s, {report['errors']} errors")
+
+
+def _write_json(path: str, report: dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="DLMS benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_pool = sub.add_parser("pool", help="connection pool before/after")
+    p_pool.add_argument("--threads", type=int, default=8)
+    p_pool.add_argument("--requests", type=int, default=400)
+
+    p_scan = sub.add_parser("scan", help="scan page render cache and 304s")
+    p_scan.add_argument("--requests", type=int, default=2000)
+
+    p_catalog = sub.add_parser("catalog", help="machine catalog lookups vs string parsing")
+    p_catalog.add_argument("--iterations", type=int, default=200_000)
+
+    p_seed = sub.add_parser("seed", help="append historical sessions to a database")
+    p_seed.add_argument("--db", required=True)
+    p_seed.add_argument("--sessions", type=int, default=10_000)
+
+    p_routes = sub.add_parser("routes", help="per-route latency and throughput")
+    p_routes.add_argument("--sessions", type=int, default=10_000)
+    p_routes.add_argument("--threads", type=int, default=8)
+    p_routes.add_argument("--cycles", type=int, default=50)
+    p_routes.add_argument("--url", default=None)
+    p_routes.add_argument("--json", dest="json_path", default=None)
+
+    p_servers = sub.add_parser("servers", help="sync WSGI vs ASGI server under load")
+    p_servers.add_argument("--sessions", type=int, default=10_000)
+    p_servers.add_argument("--threads", type=int, default=32)
+    p_servers.add_argument("--cycles", type=int, default=20)
+    p_servers.add_argument("--viewers", type=int, default=50)
+    p_servers.add_argument("--workers", type=int, default=2)
+    p_servers.add_argument("--json", dest="json_path", default=None)
+
+    p_storage = sub.add_parser("storage", help="throughput of per-thread vs pooled connections")
+    p_storage.add_argument("--threads", type=int, default=16)
+    p_storage.add_argument("--cycles", type=int, default=50)
+    p_storage.add_argument("--pool-size", type=int, default=4)
+    p_storage.add_argument("--json", dest="json_path", default=None)
+
+    p_ratelimit = sub.add_parser("ratelimit", help="brute-force stress test of the attempt limiter")
+    p_ratelimit.add_argument("--attackers", type=int, default=8)
+    p_ratelimit.add_argument("--guesses", type=int, default=200)
+    p_ratelimit.add_argument("--threads", type=int, default=4)
+    p_ratelimit.add_argument("--cycles", type=int, default=20)
+    p_ratelimit.add_argument("--json", dest="json_path", default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "pool":
+        results = bench_pool(args.threads, args.requests)
+        for label, r in results.items():
+            print(f"{label:>9}: {r['rps']:>8} req/s  ({r['requests']} requests in {r['seconds']}s, {r['errors']} errors)")
+
+    elif args.command == "scan":
+        results = bench_scan(args.requests)
+        for label, r in results.items():
+            print(f"{label:>9}: {r['rps']:>8} req/s  ({r['requests']} requests in {r['seconds']}s, {r['errors']} errors)")
+
+    elif args.command == "catalog":
+        for name, r in bench_catalog(args.iterations).items():
+            print(f"{name:>9}: {r['before_ns']:>8} ns -> {r['after_ns']:>8} ns  ({r['speedup']}x)")
+
+    elif args.command == "seed":
+        db.DB_PATH = args.db
+        db.migrate_db()
+        seed_history(args.sessions)
+        print(f"Seeded {args.sessions} sessions into {args.db}.")
+
+    elif args.command == "routes":
+        report = bench_routes(args.sessions, args.threads, args.cycles, args.url)
+        _print_route_report(report)
+        if args.json_path:
+            _write_json(args.json_path, report)
+
+    elif args.command == "servers":
+        reports = bench_servers(args.sessions, args.threads, args.cycles, args.viewers, args.workers)
+        for mode, report in reports.items():
+            print(f"== {mode} ({report['config']['viewers']} board viewers)")
+            _print_route_report(report)
+        if args.json_path:
+            _write_json(args.json_path, reports)
+
+    elif args.command == "storage":
+        results = bench_storage(args.threads, args.cycles, args.pool_size)
+        for label, r in results.items():
+            print(f"{label:>12}: {r['ops_per_s']:>8} ops/s  ({r['ops']} ops in {r['seconds']}s, {r['errors']} errors, "
+                  f"{r['connections']} connections, {r['pool_timeouts']} pool timeouts)")
+        if args.json_path:
+            _write_json(args.json_path, results)
+
+    elif args.command == "ratelimit":
+        reports = bench_ratelimit(args.attackers, args.guesses, args.threads, args.cycles)
+        for backend, report in reports.items():
+            attack = report["attack"]
+            print(f"== limiter {backend}: attack {attack['requests']} requests -> {attack['statuses']}, "
+                  f"{attack['db_checkouts']} db checkouts, {attack.get('lockouts', 0)} lockouts"
+                  + (f", {report['checks_per_s']} checks/s" if "checks_per_s" in report else ""))
+            _print_route_report(report)
+        if args.json_path:
+            _write_json(args.json_path, reports)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Live dorm-wide availability board (SC2/SC5).
+
+One BoardBroadcaster per process computes the board state once per change
+and fans the same JSON payload out to every connected SSE viewer, so N
+viewers cost one db.get_board_state() call, not N polls.
+
+Changes made through db.py in this process signal the broadcaster
+directly (db.add_machine_listener). Changes from other worker processes
+are picked up by re-reading the machines version counter every
+`poll_interval` seconds: one small query per process, not per viewer.
+Under asgi.py, viewers use astream() and wait on the event loop.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+
+import db
+
+log = logging.getLogger(__name__)
+
+
+def _offer(q, payload: str) -> None:
+    # Works for queue.Queue and asyncio.Queue alike.
+    try:
+        q.put_nowait(payload)
+    except (queue.Full, asyncio.QueueFull):
+        # Slow viewer: drop its oldest update, keep the newest.
+        try:
+            q.get_nowait()
+        except (queue.Empty, asyncio.QueueEmpty):
+            pass
+        try:
+            q.put_nowait(payload)
+        except (queue.Full, asyncio.QueueFull):
+            pass
+
+
+class BoardBroadcaster:
+    def __init__(self, poll_interval: float = 2.0, heartbeat_interval: float = 15.0, max_backlog: int = 8):
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_backlog = max_backlog
+
+        self._subscribers: set[queue.Queue] = set()
+        self._async_subscribers: dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._latest_version = None
+
+    # -----------------------------
+    # State
+    # -----------------------------
+
+    def notify(self, machine_id: str | None = None, versions: tuple[int, int] | None = None) -> None:
+        """Marks the board dirty; the broadcaster thread recomputes it."""
+        self._changed.set()
+
+    def _compute(self) -> str:
+        state = db.get_board_state()
+        state["generated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        payload = json.dumps(state, separators=(",", ":"))
+        with self._lock:
+            self._latest_version = state["version"]
+        return payload
+
+    def _publish(self) -> None:
+        payload = self._compute()
+        with self._lock:
+            subscribers = list(self._subscribers)
+            async_subscribers = list(self._async_subscribers.items())
+        for q in subscribers:
+            _offer(q, payload)
+        for q, loop in async_subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, q, payload)
+            except RuntimeError:
+                pass  # loop already closed; astream() cleanup will drop it.
+
+    # -----------------------------
+    # Subscribers
+    # -----------------------------
+
+    def subscribe(self) -> queue.Queue:
+        self.start()
+        q = queue.Queue(maxsize=self.max_backlog)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def viewer_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers) + len(self._async_subscribers)
+
+    def stream(self):
+        """
+        Yields SSE frames: the current state first, then one frame per change,
+        with comment heartbeats so proxies keep the connection open.
+        """
+        q = self.subscribe()
+        try:
+            yield f"data: {self._compute()}\n\n"
+            while True:
+                try:
+                    payload = q.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {payload}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+    async def astream(self):
+        """
+        Async variant of stream() for the ASGI server: a viewer waits on the
+        event loop instead of holding a worker thread.
+        """
+        self.start()
+        q = asyncio.Queue(maxsize=self.max_backlog)
+        with self._lock:
+            self._async_subscribers[q] = asyncio.get_running_loop()
+        try:
+            yield f"data: {await asyncio.to_thread(self._compute)}\n\n"
+            while True:
+                try:
+                    payload = await asyncio.wait_for(q.get(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {payload}\n\n"
+        finally:
+            with self._lock:
+                self._async_subscribers.pop(q, None)
+
+    # -----------------------------
+    # Background thread
+    # -----------------------------
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            changed = self._changed.wait(self.poll_interval)
+            self._changed.clear()
+            if self._stop.is_set():
+                break
+            if not self.viewer_count():
+                continue
+
+            try:
+                if not changed and db.get_machines_version() == self._latest_version:
+                    continue
+                self._publish()
+            except Exception:
+                log.exception("board publish failed")
+
+        db.close_connection()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="board-broadcaster", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
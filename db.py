@@ -1,18 +1,162 @@
+import hashlib
+import os
+import secrets
 import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from typing import Callable, Iterator
 
-DB_PATH = "dlms.sqlite3"
+import metrics
+from helpers import PICKUPDELAYMINUTES
+from machine_catalog import ALL_MACHINE_IDS
 
+DB_PATH = os.getenv("DLMS_DB_PATH", "dlms.sqlite3")
+MIGRATIONS_DIR = "migrations"
 
-def get_connection() -> sqlite3.Connection:
+# Applied once when a pooled connection is opened, not on every checkout.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+)
+
+# One long-lived connection per worker thread (and per process after fork).
+_pool = threading.local()
+
+# Set by connection_source(): routes get_connection() to another provider
+# for the current thread or task, e.g. storage.PooledRepository's pool.
+_connection_source: ContextVar[Callable[[], sqlite3.Connection] | None] = ContextVar(
+    "dlms_connection_source", default=None
+)
+
+
+def open_connection(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
     """
-    Returns a new SQLite connection.
+    Opens a connection with CONNECTION_PRAGMAS applied. "file:" paths are
+    URIs, e.g. file:/dlms?vfs=memdb for an in-memory database shared by
+    every connection in the process.
     """
-    conn = sqlite3.connect(DB_PATH)
+    factory = metrics.InstrumentedConnection if metrics.ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(db_path, timeout=5.0, factory=factory,
+                           uri=db_path.startswith("file:"), check_same_thread=check_same_thread)
+    if metrics.ENABLED:
+        metrics.record_connection_opened()
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns this thread's pooled SQLite connection, opening it on first use.
+    The connection is reused across calls, so callers must not close it;
+    `with get_connection() as conn:` still commits/rolls back as before.
+    """
+    source = _connection_source.get()
+    if source is not None:
+        return source()
+
+    key = (os.getpid(), DB_PATH)
+    conn = getattr(_pool, "conn", None)
+    if conn is not None and getattr(_pool, "key", None) == key:
+        return conn
+
+    if conn is not None and getattr(_pool, "key", (None,))[0] == key[0]:
+        conn.close()  # DB_PATH changed: drop the stale connection.
+
+    conn = open_connection(DB_PATH)
+    _pool.conn = conn
+    _pool.key = key
+    return conn
+
+
+def close_connection() -> None:
+    """
+    Closes this thread's pooled connection (e.g. when a worker thread exits).
+    """
+    conn = getattr(_pool, "conn", None)
+    if conn is not None and getattr(_pool, "key", (None,))[0] == os.getpid():
+        conn.close()
+    _pool.conn = None
+    _pool.key = None
+
+
+@contextmanager
+def connection_source(source: Callable[[], sqlite3.Connection]) -> Iterator[None]:
+    """
+    Makes get_connection() return source() inside the block, for this thread
+    or asyncio task only. source is called on every get_connection(), so it
+    should hand out the same connection until the block ends.
+    """
+    token = _connection_source.set(source)
+    try:
+        yield
+    finally:
+        _connection_source.reset(token)
+
+
+@contextmanager
+def immediate_transaction() -> Iterator[sqlite3.Connection]:
+    """
+    Runs the block in one BEGIN IMMEDIATE transaction on the pooled connection.
+    The write lock is taken up front, so read-then-write sequences inside the
+    block cannot interleave with another writer. Commits once on success.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# -----------------------------
+# Schema migrations: migrations/NNN_name.sql applied in order, tracked in PRAGMA user_version.
+# -----------------------------
+
+def _list_migrations() -> list[tuple[int, str]]:
+    migrations = []
+    for name in sorted(os.listdir(MIGRATIONS_DIR)):
+        if name.endswith(".sql") and name[:3].isdigit():
+            migrations.append((int(name[:3]), os.path.join(MIGRATIONS_DIR, name)))
+    return migrations
+
+
+def migrate_db() -> list[str]:
+    """
+    Applies pending migrations without dropping any data.
+    Each migration runs in its own transaction together with the
+    user_version bump. Returns the file names that were applied.
+    """
+    applied = []
+    conn = get_connection()
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, path in _list_migrations():
+        if version <= current:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            sql = f.read()
+        try:
+            conn.executescript(f"BEGIN;\n{sql}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append(os.path.basename(path))
+
+    # Schema resets (/init-db) restart the machines version counter.
+    reset_machine_cache()
+    return applied
+
+
 # -----------------------------
 # Sessions (SC1-SC6): session records, verification, and timestamps.
 # -----------------------------
@@ -37,15 +181,91 @@ def insert_session(
         )
         VALUES (?, ?, ?, ?, ?, ?, ?)
     """
-    with get_connection() as conn:
+    with immediate_transaction() as conn:
         cur = conn.execute(
             sql,
             (machine_id, first_name, last_name, phone_number, time_in, expected_end, status)
         )
-        conn.commit()
+        _stats_session_added(conn, machine_id)
         return int(cur.lastrowid)
 
 
+def start_session(
+    machine_id: str,
+    first_name: str,
+    last_name: str,
+    phone_number: str,
+    time_in: str,
+    expected_end: str,   # SC2/SC6: expected end time stored with the session.
+    verification_code: str
+) -> dict:
+    """
+    Starts a load atomically in a single BEGIN IMMEDIATE transaction:
+    ensures the machine row (SC5), refuses broken machines and machines that
+    already have an active session (SC4), inserts the session with its
+    verification code (SC4/SC6) and marks the machine occupied (SC5).
+
+    Returns { "outcome": "started" | "active" | "broken",
+              "session": <session row or None>, "machine": <machine row> }
+    where "session" is the new session, or the existing active one.
+    """
+    with immediate_transaction() as conn:
+        since = _machines_version(conn)
+        conn.execute("""
+            INSERT OR IGNORE INTO machines (MACHINEID, OCCUPANCY_STATUS, CONDITION_STATUS)
+            VALUES (?, 'vacant', 'normal')
+        """, (machine_id,))
+
+        active = conn.execute("""
+            SELECT
+                SESSIONID, MACHINEID, FIRSTNAME, LASTNAME, PHONENUMBER,
+                TIMEIN, EXPECTED_END, STATUS,
+                FINISH_SMS_STATUS, FINISH_SMS_SENT_AT,
+                VERIFICATION_CODE, TIMEOUT, DELAY_MIN
+            FROM sessions
+            WHERE MACHINEID = ? AND STATUS = 'active'
+            ORDER BY SESSIONID DESC
+            LIMIT 1
+        """, (machine_id,)).fetchone()
+
+        if active is not None:
+            result = {"outcome": "active", "session": active}
+        elif conn.execute(
+            "SELECT CONDITION_STATUS FROM machines WHERE MACHINEID = ?", (machine_id,)
+        ).fetchone()[0] == "broken":
+            result = {"outcome": "broken", "session": None}
+        else:
+            cur = conn.execute("""
+                INSERT INTO sessions (
+                    MACHINEID, FIRSTNAME, LASTNAME, PHONENUMBER,
+                    TIMEIN, EXPECTED_END, STATUS, VERIFICATION_CODE
+                )
+                VALUES (?, ?, ?, ?, ?, ?, 'active', ?)
+            """, (machine_id, first_name, last_name, phone_number, time_in, expected_end, verification_code))
+            session_id = int(cur.lastrowid)
+            _stats_session_added(conn, machine_id)
+
+            conn.execute("UPDATE machines SET OCCUPANCY_STATUS = 'occupied' WHERE MACHINEID = ?", (machine_id,))
+
+            session = conn.execute("""
+                SELECT
+                    SESSIONID, MACHINEID, FIRSTNAME, LASTNAME, PHONENUMBER,
+                    TIMEIN, EXPECTED_END, STATUS,
+                    FINISH_SMS_STATUS, FINISH_SMS_SENT_AT,
+                    VERIFICATION_CODE, TIMEOUT, DELAY_MIN
+                FROM sessions
+                WHERE SESSIONID = ?
+            """, (session_id,)).fetchone()
+            result = {"outcome": "started", "session": session}
+
+        machine, _, version = _machine_snapshot(conn, machine_id, since)
+
+    # SC5: write-through to the machine registry once committed.
+    _store_machine(machine, since, version)
+    result["machine"] = dict(machine)
+    return result
+
+
 def get_session_by_id(session_id: int) -> sqlite3.Row | None:
     """
     Returns one session row or None if not found.
@@ -112,74 +332,818 @@ def set_verification_code(session_id: int, code: str) -> None:
         conn.commit()
 
 
-def mark_picked_up(session_id: int, time_out: str, delay_min: int) -> None:
+def mark_picked_up(session_id: int, time_out: str, delay_min: int) -> bool:
+    """
+    Marks an active session as picked up and records TIMEOUT (SC4)
+    + DELAY_MIN (SC6). Folds the delay into machine_stats and marks the
+    machine vacant (SC5) unless another session is active on it, all in
+    one transaction. A session that is no longer active is left untouched,
+    so retried or concurrent pickups neither overwrite TIMEOUT/DELAY_MIN
+    nor vacate a machine someone else is now using.
+    Returns True if this call picked the session up.
+    """
+    with immediate_transaction() as conn:
+        cur = conn.execute("""
+            UPDATE sessions
+            SET STATUS = 'picked_up',
+                TIMEOUT = ?,
+                DELAY_MIN = ?
+            WHERE SESSIONID = ? AND STATUS = 'active'
+            RETURNING MACHINEID
+        """, (time_out, delay_min, session_id))
+        row = cur.fetchone()
+        if row is None:
+            return False
+
+        machine_id = row["MACHINEID"]
+        since = _machines_version(conn)
+        # Active sessions always have DELAY_MIN 0 (sessions default).
+        _stats_delay_changed(conn, machine_id, 0, delay_min)
+        conn.execute("""
+            UPDATE machines SET OCCUPANCY_STATUS = 'vacant'
+            WHERE MACHINEID = ?
+              AND NOT EXISTS (SELECT 1 FROM sessions WHERE MACHINEID = ? AND STATUS = 'active')
+        """, (machine_id, machine_id))
+        snapshot = _machine_snapshot(conn, machine_id, since)
+
+    _store_machine(*snapshot)
+    return True
+
+
+def close_stale_sessions(expected_before: str, time_out: str, limit: int = 500) -> list[int]:
+    """
+    Auto-closes up to `limit` active sessions whose EXPECTED_END is before
+    `expected_before` (SC4/SC6): stamps TIMEOUT = time_out and DELAY_MIN by
+    the same grace rule as a pickup, folds the delays into machine_stats and
+    marks their machines vacant unless another session is active on them.
+    All in one transaction; a session picked up or closed by another worker
+    meanwhile is skipped. Returns the closed SESSIONIDs.
+    """
+    with immediate_transaction() as conn:
+        rows = conn.execute("""
+            SELECT SESSIONID, MACHINEID, EXPECTED_END, DELAY_MIN FROM sessions
+            WHERE STATUS = 'active' AND EXPECTED_END < ?
+            ORDER BY EXPECTED_END
+            LIMIT ?
+        """, (expected_before, limit)).fetchall()
+        if not rows:
+            return []
+
+        delays = [PICKUPDELAYMINUTES(r["EXPECTED_END"], time_out) for r in rows]
+        conn.executemany("""
+            UPDATE sessions
+            SET STATUS = 'picked_up',
+                TIMEOUT = ?,
+                DELAY_MIN = ?
+            WHERE SESSIONID = ? AND STATUS = 'active'
+        """, [(time_out, delay, r["SESSIONID"]) for r, delay in zip(rows, delays)])
+        for r, delay in zip(rows, delays):
+            _stats_delay_changed(conn, r["MACHINEID"], r["DELAY_MIN"], delay)
+
+        machine_ids = sorted({r["MACHINEID"] for r in rows})
+        since = _machines_version(conn)
+        conn.execute(f"""
+            UPDATE machines SET OCCUPANCY_STATUS = 'vacant'
+            WHERE MACHINEID IN ({','.join('?' * len(machine_ids))})
+              AND OCCUPANCY_STATUS <> 'vacant'
+              AND NOT EXISTS (
+                  SELECT 1 FROM sessions s
+                  WHERE s.MACHINEID = machines.MACHINEID AND s.STATUS = 'active'
+              )
+        """, machine_ids)
+        snapshots = [_machine_snapshot(conn, machine_id, since) for machine_id in machine_ids]
+
+    for snapshot in snapshots:
+        _store_machine(*snapshot)
+    return [r["SESSIONID"] for r in rows]
+
+
+# -----------------------------
+# Idempotency keys: replayable responses for retried POSTs.
+# -----------------------------
+
+_IDEMPOTENCY_COLUMNS = "IDEMPOTENCY_KEY, REQUEST_PATH, CREATED_AT, STATUS_CODE, CONTENT_TYPE, LOCATION, BODY"
+
+
+def reserve_idempotency_key(key: str, request_path: str, now: str) -> sqlite3.Row | None:
+    """
+    Claims `key` for a request to `request_path`; keys are scoped to the
+    path, so the same key sent to another path is a different key.
+    Returns None if this call claimed it (run the request, then
+    store_idempotent_response), else the existing row: a stored response
+    to replay, or STATUS_CODE NULL while the first request is still running.
+    """
+    sql = f"SELECT {_IDEMPOTENCY_COLUMNS} FROM idempotency_keys WHERE REQUEST_PATH = ? AND IDEMPOTENCY_KEY = ?"
+    with get_connection() as conn:
+        row = conn.execute(sql, (request_path, key)).fetchone()
+    if row is not None:
+        return row  # replays need no write lock
+
+    with immediate_transaction() as conn:
+        cur = conn.execute("""
+            INSERT INTO idempotency_keys (REQUEST_PATH, IDEMPOTENCY_KEY, CREATED_AT)
+            VALUES (?, ?, ?)
+            ON CONFLICT (REQUEST_PATH, IDEMPOTENCY_KEY) DO NOTHING
+        """, (request_path, key, now))
+        if cur.rowcount == 1:
+            return None
+        return conn.execute(sql, (request_path, key)).fetchone()
+
+
+def store_idempotent_response(key: str, request_path: str, status_code: int, content_type: str | None,
+                              location: str | None, body: bytes) -> None:
+    with get_connection() as conn:
+        conn.execute("""
+            UPDATE idempotency_keys
+            SET STATUS_CODE = ?, CONTENT_TYPE = ?, LOCATION = ?, BODY = ?
+            WHERE REQUEST_PATH = ? AND IDEMPOTENCY_KEY = ?
+        """, (status_code, content_type, location, body, request_path, key))
+        conn.commit()
+
+
+def release_idempotency_key(key: str, request_path: str) -> None:
+    """Forgets a claimed key whose request failed, so the client can retry it."""
+    with get_connection() as conn:
+        conn.execute("""
+            DELETE FROM idempotency_keys
+            WHERE REQUEST_PATH = ? AND IDEMPOTENCY_KEY = ? AND STATUS_CODE IS NULL
+        """, (request_path, key))
+        conn.commit()
+
+
+def purge_idempotency_keys(created_before: str) -> int:
+    with get_connection() as conn:
+        cur = conn.execute("DELETE FROM idempotency_keys WHERE CREATED_AT < ?", (created_before,))
+        conn.commit()
+        return cur.rowcount
+
+
+# -----------------------------
+# Session history (SC6): keyset-paginated reads for audits and export.
+# -----------------------------
+
+# PHONENUMBER and VERIFICATION_CODE are left out of history on purpose.
+HISTORY_COLUMNS = (
+    "SESSIONID", "MACHINEID", "FIRSTNAME", "LASTNAME",
+    "TIMEIN", "EXPECTED_END", "TIMEOUT", "DELAY_MIN", "STATUS",
+    "FINISH_SMS_STATUS", "FINISH_SMS_SENT_AT",
+)
+
+
+def get_session_history(
+    before_id: int | None = None,
+    limit: int = 100,
+    machine_id: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    status: str | None = None,
+    include_archive: bool = True,
+) -> list[dict]:
+    """
+    One page of sessions, newest first, including sessions_archive unless
+    include_archive is False. Pass the last SESSIONID of a page as
+    before_id to get the next one: a keyset seek on the primary key (or on
+    the MACHINEID, SESSIONID indexes when filtering by machine), so page N
+    costs the same as page 1. since/until bound TIMEIN as [since, until).
+    """
+    where, params = [], []
+    if before_id is not None:
+        where.append("SESSIONID < ?")
+        params.append(before_id)
+    if machine_id is not None:
+        where.append("MACHINEID = ?")
+        params.append(machine_id)
+    if since is not None:
+        where.append("TIMEIN >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("TIMEIN < ?")
+        params.append(until)
+    if status is not None:
+        where.append("STATUS = ?")
+        params.append(status)
+
+    columns = ", ".join(HISTORY_COLUMNS)
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    sql = f"SELECT {columns} FROM sessions{where_sql}"
+    if include_archive:
+        # Both sides come out of their indexes in SESSIONID order; SQLite merges them.
+        sql += f" UNION ALL SELECT {columns} FROM sessions_archive{where_sql}"
+        params = params + params
+    sql += " ORDER BY SESSIONID DESC LIMIT ?"
+    params.append(limit)
+
+    conn = get_connection()
+    return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+
+def iter_session_history(chunk_size: int = 1000, **filters) -> Iterator[dict]:
     """
-    Marks a session as picked up and records TIMEOUT (SC4)
-    + DELAY_MIN (SC6).
+    Every session matching the filters, newest first, fetched one keyset
+    page at a time. Memory stays at one chunk, and no read transaction is
+    held open between chunks, so a long export does not pin the WAL.
+    """
+    before_id = None
+    while True:
+        page = get_session_history(before_id=before_id, limit=chunk_size, **filters)
+        yield from page
+        if len(page) < chunk_size:
+            return
+        before_id = page[-1]["SESSIONID"]
+
+
+# -----------------------------
+# Archival (SC6): old picked-up sessions move to sessions_archive.
+# -----------------------------
+
+_SESSION_COLUMNS = """
+    SESSIONID, MACHINEID, FIRSTNAME, LASTNAME, PHONENUMBER,
+    TIMEIN, EXPECTED_END, STATUS, FINISH_SMS_STATUS, FINISH_SMS_SENT_AT,
+    VERIFICATION_CODE, TIMEOUT, DELAY_MIN
+"""
+
+
+def archive_sessions(picked_up_before: str, now: str, batch_size: int = 5000) -> int:
+    """
+    Moves picked_up sessions with TIMEOUT < picked_up_before into
+    sessions_archive, batch_size rows per BEGIN IMMEDIATE transaction so
+    request writers only wait for one batch. Their totals are already in
+    machine_stats; only ARCHIVED_COUNT changes. Returns rows moved.
+
+    The session with the highest SESSIONID is never moved: sessions has no
+    AUTOINCREMENT, so deleting it would let SQLite hand its ID out again.
+    """
+    moved = 0
+    while True:
+        with immediate_transaction() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (SESSIONID INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM temp.archive_batch")
+            count = conn.execute("""
+                INSERT INTO temp.archive_batch (SESSIONID)
+                SELECT SESSIONID FROM sessions
+                WHERE STATUS = 'picked_up'
+                  AND TIMEOUT < ?
+                  AND SESSIONID < (SELECT MAX(SESSIONID) FROM sessions)
+                ORDER BY SESSIONID
+                LIMIT ?
+            """, (picked_up_before, batch_size)).rowcount
+            if count == 0:
+                return moved
+
+            batch = "SELECT SESSIONID FROM temp.archive_batch"
+            conn.execute(f"""
+                INSERT INTO sessions_archive ({_SESSION_COLUMNS}, ARCHIVED_AT)
+                SELECT {_SESSION_COLUMNS}, ? FROM sessions
+                WHERE SESSIONID IN ({batch})
+            """, (now,))
+            conn.execute(f"""
+                INSERT INTO machine_stats (MACHINEID, ARCHIVED_COUNT)
+                SELECT MACHINEID, COUNT(*) FROM sessions
+                WHERE SESSIONID IN ({batch})
+                GROUP BY MACHINEID
+                ON CONFLICT (MACHINEID) DO UPDATE SET
+                    ARCHIVED_COUNT = ARCHIVED_COUNT + excluded.ARCHIVED_COUNT
+            """)
+            conn.execute(f"DELETE FROM sms_outbox WHERE SESSIONID IN ({batch})")
+            conn.execute(f"DELETE FROM sessions WHERE SESSIONID IN ({batch})")
+            conn.execute("DELETE FROM temp.archive_batch")
+        moved += count
+
+
+# -----------------------------
+# SMS outbox (SC3): finish messages queued for the background sender.
+# -----------------------------
+
+def enqueue_finish_sms(session_id: int, now: str, only_active: bool = False) -> bool:
+    """
+    Queues the SC3 finish SMS for a session and sets FINISH_SMS_STATUS to
+    'QUEUED'. Compare-and-set: only sessions with no status yet, or whose
+    last attempt FAILED, are queued, so concurrent callers enqueue once.
+    With only_active, sessions already picked up are skipped.
+    Returns True if this call queued the message.
+    """
+    with immediate_transaction() as conn:
+        cur = conn.execute(f"""
+            UPDATE sessions
+            SET FINISH_SMS_STATUS = 'QUEUED'
+            WHERE SESSIONID = ?
+              AND (FINISH_SMS_STATUS IS NULL OR FINISH_SMS_STATUS LIKE 'FAILED:%')
+              {"AND STATUS = 'active'" if only_active else ""}
+        """, (session_id,))
+        if cur.rowcount == 0:
+            return False
+
+        conn.execute("""
+            INSERT INTO sms_outbox (SESSIONID, STATUS, ATTEMPTS, NEXT_ATTEMPT_AT, CREATED_AT)
+            VALUES (?, 'pending', 0, ?, ?)
+            ON CONFLICT (SESSIONID) DO UPDATE SET
+                STATUS = 'pending',
+                ATTEMPTS = 0,
+                NEXT_ATTEMPT_AT = excluded.NEXT_ATTEMPT_AT,
+                LAST_ERROR = NULL,
+                UPDATED_AT = excluded.CREATED_AT
+        """, (session_id, now, now))
+        return True
+
+
+def get_sessions_awaiting_finish_sms() -> list[sqlite3.Row]:
+    """
+    Returns SESSIONID and EXPECTED_END of active sessions whose finish SMS
+    has not been queued yet, earliest first (SC2/SC3 scheduler rebuild).
     """
     sql = """
-        UPDATE sessions
-        SET STATUS = 'picked_up',
-            TIMEOUT = ?,
-            DELAY_MIN = ?
-        WHERE SESSIONID = ?
+        SELECT SESSIONID, EXPECTED_END
+        FROM sessions
+        WHERE STATUS = 'active' AND FINISH_SMS_STATUS IS NULL
+        ORDER BY EXPECTED_END
+    """
+    with get_connection() as conn:
+        return conn.execute(sql).fetchall()
+
+
+def claim_due_sms(now: str, lease_until: str, limit: int) -> list[dict]:
+    """
+    Claims up to `limit` due outbox messages for sending: pending rows whose
+    NEXT_ATTEMPT_AT has passed, or 'sending' rows whose lease expired.
+    Claimed rows move to 'sending' with NEXT_ATTEMPT_AT = lease_until and a
+    fresh CLAIM_TOKEN. Returns OUTBOXID, SESSIONID, ATTEMPTS, CLAIM_TOKEN
+    plus the session's PHONENUMBER, MACHINEID and FIRSTNAME.
+    """
+    claim_token = secrets.token_hex(8)
+    with immediate_transaction() as conn:
+        # A worker that died after recording SENT never closed its outbox row.
+        conn.execute("""
+            UPDATE sms_outbox
+            SET STATUS = 'sent', UPDATED_AT = ?
+            WHERE STATUS = 'sending'
+              AND NEXT_ATTEMPT_AT <= ?
+              AND SESSIONID IN (
+                  SELECT SESSIONID FROM sessions WHERE FINISH_SMS_STATUS LIKE 'SENT%'
+              )
+        """, (now, now))
+
+        rows = conn.execute("""
+            SELECT
+                o.OUTBOXID, o.SESSIONID, o.ATTEMPTS,
+                s.PHONENUMBER, s.MACHINEID, s.FIRSTNAME
+            FROM sms_outbox o
+            JOIN sessions s ON s.SESSIONID = o.SESSIONID
+            WHERE o.STATUS IN ('pending', 'sending')
+              AND o.NEXT_ATTEMPT_AT <= ?
+            ORDER BY o.NEXT_ATTEMPT_AT
+            LIMIT ?
+        """, (now, limit)).fetchall()
+
+        conn.executemany("""
+            UPDATE sms_outbox
+            SET STATUS = 'sending', ATTEMPTS = ATTEMPTS + 1, NEXT_ATTEMPT_AT = ?, CLAIM_TOKEN = ?, UPDATED_AT = ?
+            WHERE OUTBOXID = ?
+        """, [(lease_until, claim_token, now, r["OUTBOXID"]) for r in rows])
+
+    return [dict(r, CLAIM_TOKEN=claim_token) for r in rows]
+
+
+def retry_sms_later(outbox_id: int, claim_token: str, next_attempt_at: str, error: str, now: str) -> bool:
+    """
+    Puts a claimed message back to 'pending' after a retryable failure.
+    Returns False, changing nothing, if the claim expired and was taken over.
+    """
+    sql = """
+        UPDATE sms_outbox
+        SET STATUS = 'pending', NEXT_ATTEMPT_AT = ?, LAST_ERROR = ?, UPDATED_AT = ?
+        WHERE OUTBOXID = ? AND CLAIM_TOKEN = ? AND STATUS = 'sending'
     """
     with get_connection() as conn:
-        conn.execute(sql, (time_out, delay_min, session_id))
+        cur = conn.execute(sql, (next_attempt_at, error, now, outbox_id, claim_token))
         conn.commit()
+        return cur.rowcount == 1
+
+
+def complete_sms(outbox_id: int, claim_token: str, sent: bool, error: str | None, now: str) -> bool:
+    """
+    Closes a claimed outbox message as 'sent' or permanently 'failed'.
+    Returns False, changing nothing, if the claim expired and was taken over.
+    The session's FINISH_SMS_STATUS is written separately via update_finish_sms.
+    """
+    sql = """
+        UPDATE sms_outbox
+        SET STATUS = ?, LAST_ERROR = ?, UPDATED_AT = ?
+        WHERE OUTBOXID = ? AND CLAIM_TOKEN = ? AND STATUS = 'sending'
+    """
+    with get_connection() as conn:
+        cur = conn.execute(sql, ("sent" if sent else "failed", error, now, outbox_id, claim_token))
+        conn.commit()
+        return cur.rowcount == 1
+
+
+# -----------------------------
+# Machine stats rollup (SC6): running totals kept in step with sessions writes.
+# -----------------------------
+
+def _stats_session_added(conn: sqlite3.Connection, machine_id: str) -> None:
+    conn.execute("""
+        INSERT INTO machine_stats (MACHINEID, SESSION_COUNT)
+        VALUES (?, 1)
+        ON CONFLICT (MACHINEID) DO UPDATE SET SESSION_COUNT = SESSION_COUNT + 1
+    """, (machine_id,))
+
+
+def _stats_delay_changed(conn: sqlite3.Connection, machine_id: str, old_delay: int, new_delay: int) -> None:
+    if old_delay == new_delay:
+        return
+
+    late_delta = int(new_delay > 0) - int(old_delay > 0)
+    conn.execute("""
+        INSERT INTO machine_stats (MACHINEID, LATE_COUNT, DELAY_SUM, DELAY_MAX)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (MACHINEID) DO UPDATE SET
+            LATE_COUNT = LATE_COUNT + excluded.LATE_COUNT,
+            DELAY_SUM = DELAY_SUM + excluded.DELAY_SUM,
+            DELAY_MAX = MAX(DELAY_MAX, excluded.DELAY_MAX)
+    """, (machine_id, late_delta, new_delay - old_delay, new_delay))
+
+    # A lowered delay may have been the maximum; re-read it from the index.
+    if new_delay < old_delay:
+        conn.execute("""
+            UPDATE machine_stats
+            SET DELAY_MAX = MAX(
+                (SELECT IFNULL(MAX(DELAY_MIN), 0) FROM sessions WHERE MACHINEID = ?),
+                (SELECT IFNULL(MAX(DELAY_MIN), 0) FROM sessions_archive WHERE MACHINEID = ?)
+            )
+            WHERE MACHINEID = ? AND DELAY_MAX <= ?
+        """, (machine_id, machine_id, machine_id, old_delay))
+
+
+# Recomputes the rollup columns from sessions and sessions_archive (used by rebuild and check).
+_STATS_FROM_SESSIONS = """
+    SELECT
+        MACHINEID,
+        COUNT(*) AS SESSION_COUNT,
+        COUNT(CASE WHEN DELAY_MIN > 0 THEN 1 END) AS LATE_COUNT,
+        TOTAL(DELAY_MIN) AS DELAY_SUM,
+        MAX(DELAY_MIN) AS DELAY_MAX,
+        TOTAL(ARCHIVED) AS ARCHIVED_COUNT
+    FROM (
+        SELECT MACHINEID, DELAY_MIN, 0 AS ARCHIVED FROM sessions
+        UNION ALL
+        SELECT MACHINEID, DELAY_MIN, 1 AS ARCHIVED FROM sessions_archive
+    )
+    GROUP BY MACHINEID
+"""
+
+_STATS_COLUMNS = ("SESSION_COUNT", "LATE_COUNT", "DELAY_SUM", "DELAY_MAX", "ARCHIVED_COUNT")
+
+# Recomputes the reliability columns from the machine_incidents log.
+_STATS_FROM_INCIDENTS = """
+    SELECT
+        i.MACHINEID,
+        COUNT(CASE WHEN i.EVENT = 'reported' THEN 1 END) AS INCIDENT_COUNT,
+        COUNT(CASE WHEN i.EVENT = 'resolved' THEN 1 END) AS RESOLVED_COUNT,
+        TOTAL(i.REPAIR_MIN) AS DOWNTIME_MIN,
+        TOTAL(i.UPTIME_MIN) AS UPTIME_MIN,
+        COUNT(i.UPTIME_MIN) AS UPTIME_COUNT,
+        (SELECT l.REPAIR_MIN FROM machine_incidents l
+         WHERE l.MACHINEID = i.MACHINEID AND l.EVENT = 'resolved'
+         ORDER BY l.INCIDENTID DESC LIMIT 1) AS LAST_REPAIR_MIN,
+        (SELECT CASE WHEN l.EVENT = 'reported' THEN l.OCCURRED_AT END FROM machine_incidents l
+         WHERE l.MACHINEID = i.MACHINEID
+         ORDER BY l.INCIDENTID DESC LIMIT 1) AS OPEN_SINCE,
+        (SELECT l.OCCURRED_AT FROM machine_incidents l
+         WHERE l.MACHINEID = i.MACHINEID AND l.EVENT = 'resolved'
+         ORDER BY l.INCIDENTID DESC LIMIT 1) AS LAST_RESOLVED_AT
+    FROM machine_incidents i
+    GROUP BY i.MACHINEID
+"""
+
+_INCIDENT_COLUMNS = (
+    "INCIDENT_COUNT", "RESOLVED_COUNT", "DOWNTIME_MIN", "UPTIME_MIN", "UPTIME_COUNT",
+    "LAST_REPAIR_MIN", "OPEN_SINCE", "LAST_RESOLVED_AT",
+)
+
+# machine_stats columns that default to NULL rather than 0.
+_NULLABLE_STATS = ("LAST_REPAIR_MIN", "OPEN_SINCE", "LAST_RESOLVED_AT")
+
+
+def rebuild_machine_stats() -> int:
+    """
+    Recomputes machine_stats from sessions, sessions_archive and
+    machine_incidents in one transaction.
+    Returns the number of machines with stats.
+    """
+    with immediate_transaction() as conn:
+        conn.execute("DELETE FROM machine_stats")
+        conn.execute(f"""
+            INSERT INTO machine_stats (MACHINEID, {", ".join(_STATS_COLUMNS)})
+            SELECT MACHINEID, {", ".join(_STATS_COLUMNS)}
+            FROM ({_STATS_FROM_SESSIONS})
+        """)
+        conn.execute(f"""
+            INSERT INTO machine_stats (MACHINEID, {", ".join(_INCIDENT_COLUMNS)})
+            SELECT MACHINEID, {", ".join(_INCIDENT_COLUMNS)}
+            FROM ({_STATS_FROM_INCIDENTS})
+            WHERE true
+            ON CONFLICT (MACHINEID) DO UPDATE SET
+                {", ".join(f"{c} = excluded.{c}" for c in _INCIDENT_COLUMNS)}
+        """)
+        return conn.execute("SELECT COUNT(*) FROM machine_stats").fetchone()[0]
+
+
+def _stat_value(row: sqlite3.Row | None, column: str):
+    if row is None:
+        return None if column in _NULLABLE_STATS else 0
+    value = row[column]
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else round(value, 3)
+    return value
+
+
+def check_machine_stats() -> list[dict]:
+    """
+    Compares machine_stats with a fresh aggregate over sessions, the archive
+    and the incident log.
+    Returns one { "machine_id", "column", "expected", "actual" } entry per
+    mismatch; an empty list means the rollup is consistent.
+    """
+    with get_connection() as conn:
+        from_sessions = {r["MACHINEID"]: r for r in conn.execute(_STATS_FROM_SESSIONS)}
+        from_incidents = {r["MACHINEID"]: r for r in conn.execute(_STATS_FROM_INCIDENTS)}
+        actual = {r["MACHINEID"]: r for r in conn.execute(
+            f"SELECT MACHINEID, {', '.join(_STATS_COLUMNS + _INCIDENT_COLUMNS)} FROM machine_stats"
+        )}
+
+    mismatches = []
+    for machine_id in sorted(set(from_sessions) | set(from_incidents) | set(actual)):
+        act = actual.get(machine_id)
+        for expected, columns in ((from_sessions, _STATS_COLUMNS), (from_incidents, _INCIDENT_COLUMNS)):
+            exp = expected.get(machine_id)
+            for column in columns:
+                exp_value = _stat_value(exp, column)
+                act_value = _stat_value(act, column)
+                if exp_value != act_value:
+                    mismatches.append({
+                        "machine_id": machine_id,
+                        "column": column,
+                        "expected": exp_value,
+                        "actual": act_value,
+                    })
+    return mismatches
 
 
 # -----------------------------
 # Machines (SC5-SC6): occupancy/condition state and problem timestamps.
 # -----------------------------
 
+_MACHINE_COLUMNS = """
+    MACHINEID,
+    OCCUPANCY_STATUS,
+    CONDITION_STATUS,
+    LAST_CONDITION_UPDATE,
+    LAST_CONDITION_REASON,
+    PROBLEM_REPORTED_AT,
+    PROBLEM_RESOLVED_AT
+"""
+
+# In-process machine registry (SC5): every machine row, keyed by MACHINEID.
+# Writes through db.py update it directly; writes from other connections or
+# processes are detected with PRAGMA data_version (no disk read) and then
+# cache_versions.VERSION, which triggers bump on every machines write.
+_registry_lock = threading.Lock()
+_registry: dict[str, dict] = {}
+_registry_version = -1
+
+# Callbacks run with the MACHINEID after each write-through (e.g. the live board).
+_machine_listeners: list = []
+
+
+def add_machine_listener(callback) -> None:
+    """
+    Registers callback(machine_id, versions) to run after a machine write
+    through db.py. versions is (since, version): the machines version the
+    write transaction started from and the one it committed. Writers hold
+    the write lock, so every bump in between came from that transaction.
+    Callbacks run on the writer's thread and should only signal, not do I/O.
+    """
+    _machine_listeners.append(callback)
+
+
+def _machines_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT VERSION FROM cache_versions WHERE NAME = 'machines'").fetchone()
+    return row[0] if row is not None else 0
+
+
+def _reload_registry(conn: sqlite3.Connection) -> None:
+    global _registry, _registry_version
+    version = _machines_version(conn)
+    rows = conn.execute(f"SELECT {_MACHINE_COLUMNS} FROM machines").fetchall()
+    with _registry_lock:
+        if version >= _registry_version:
+            _registry = {r["MACHINEID"]: dict(r) for r in rows}
+            _registry_version = version
+
+
+def _refresh_registry(conn: sqlite3.Connection) -> None:
+    # Cheap check first: data_version only moves when another connection commits.
+    # data_version is per connection, and a thread may use several (storage.py pools).
+    data_version = (id(conn), conn.execute("PRAGMA data_version").fetchone()[0])
+    if data_version == getattr(_pool, "data_version", None) and _registry_version >= 0:
+        return
+    _pool.data_version = data_version
+
+    if _registry_version < 0 or _machines_version(conn) != _registry_version:
+        _reload_registry(conn)
+
+
+def _machine_snapshot(conn: sqlite3.Connection, machine_id: str, since: int) -> tuple:
+    # Called inside a write transaction that began at machines version `since`;
+    # stored with _store_machine after commit.
+    row = conn.execute(f"SELECT {_MACHINE_COLUMNS} FROM machines WHERE MACHINEID = ?", (machine_id,)).fetchone()
+    return row, since, _machines_version(conn)
+
+
+def _store_machine(row: sqlite3.Row | None, since: int, version: int) -> None:
+    global _registry_version
+    if row is None:
+        return
+    with _registry_lock:
+        if version >= _registry_version and _registry_version >= 0:
+            _registry[row["MACHINEID"]] = dict(row)
+            _registry_version = version
+        elif version < _registry_version:
+            # Committed before a write that was stored first: this row must not
+            # overwrite the newer one, but dropping it would leave the registry
+            # at the current version without it. Make the next read reload.
+            _registry_version = -1
+
+    for callback in _machine_listeners:
+        callback(row["MACHINEID"], (since, version))
+
+
+def _write_machine(machine_id: str, sql: str, params: tuple) -> None:
+    with immediate_transaction() as conn:
+        since = _machines_version(conn)
+        conn.execute(sql, params)
+        snapshot = _machine_snapshot(conn, machine_id, since)
+    _store_machine(*snapshot)
+
+
+def get_machines_version() -> int:
+    """
+    Returns cache_versions.VERSION for machines; changes on every machines write.
+    """
+    with get_connection() as conn:
+        return _machines_version(conn)
+
+
+def get_board_state() -> dict:
+    """
+    Occupancy, condition and active EXPECTED_END for every machine (SC2/SC5).
+    Machine rows come from the registry; active sessions from one indexed query.
+    Returns { "version": <machines version>, "machines": [ {...}, ... ] }.
+    """
+    conn = get_connection()
+    _refresh_registry(conn)
+    active = {
+        r["MACHINEID"]: r["EXPECTED_END"]
+        for r in conn.execute("""
+            SELECT MACHINEID, EXPECTED_END
+            FROM sessions
+            WHERE STATUS = 'active'
+        """)
+    }
+
+    with _registry_lock:
+        machines = sorted(_registry.values(), key=lambda m: m["MACHINEID"])
+        version = _registry_version
+
+    return {
+        "version": version,
+        "machines": [
+            {
+                "machine_id": m["MACHINEID"],
+                "occupancy": m["OCCUPANCY_STATUS"],
+                "condition": m["CONDITION_STATUS"],
+                "expected_end": active.get(m["MACHINEID"]),
+            }
+            for m in machines
+        ],
+    }
+
+
+# Active-session fields in the public /machines snapshot. No SESSIONID: it
+# opens /session/<id>, which shows the verification code and phone number.
+_SNAPSHOT_SESSION_COLUMNS = ("TIMEIN", "EXPECTED_END", "STATUS")
+
+
+def get_machines_snapshot() -> tuple[list[dict], str]:
+    """
+    Every machine row with its active session (or None), from one joined
+    query, plus a content hash for ETags. The query only reruns when this
+    thread's connection sees a commit since its last snapshot: PRAGMA
+    data_version for other connections, total_changes for its own.
+    """
+    conn = get_connection()
+    state = (id(conn), conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    cached = getattr(_pool, "machines_snapshot", None)
+    if cached is not None and cached[0] == state:
+        return cached[1], cached[2]
+
+    machine_columns = ", ".join("m." + c.strip() for c in _MACHINE_COLUMNS.split(","))
+    session_columns = ", ".join("s." + c for c in _SNAPSHOT_SESSION_COLUMNS)
+    rows = conn.execute(f"""
+        SELECT {machine_columns}, {session_columns}
+        FROM machines m
+        LEFT JOIN sessions s ON s.MACHINEID = m.MACHINEID AND s.STATUS = 'active'
+        ORDER BY m.MACHINEID, s.SESSIONID
+    """).fetchall()
+
+    machines: dict[str, dict] = {}
+    for r in rows:
+        machine = {k: r[k] for k in r.keys() if k not in _SNAPSHOT_SESSION_COLUMNS}
+        has_session = r["STATUS"] is not None
+        machine["ACTIVE_SESSION"] = {c: r[c] for c in _SNAPSHOT_SESSION_COLUMNS} if has_session else None
+        machines[r["MACHINEID"]] = machine  # the newest active session wins
+
+    result = list(machines.values())
+    tag = hashlib.sha1(repr(result).encode("utf-8")).hexdigest()[:20]
+    _pool.machines_snapshot = (state, result, tag)
+    return result, tag
+
+
+def provision_machines(machine_ids=ALL_MACHINE_IDS) -> int:
+    """
+    Creates the missing machine rows (vacant + normal) for `machine_ids`,
+    by default every ID in machine_catalog, in one transaction. Returns how
+    many were added.
+    """
+    with immediate_transaction() as conn:
+        cur = conn.executemany("""
+            INSERT OR IGNORE INTO machines (MACHINEID, OCCUPANCY_STATUS, CONDITION_STATUS)
+            VALUES (?, 'vacant', 'normal')
+        """, [(machine_id,) for machine_id in machine_ids])
+        added = cur.rowcount
+    if added:
+        _reload_registry(get_connection())
+    return added
+
+
+def reset_machine_cache() -> None:
+    """
+    Empties the registry; the next read reloads it from the database.
+    """
+    global _registry, _registry_version
+    with _registry_lock:
+        _registry = {}
+        _registry_version = -1
+
+
+def warm_machine_cache() -> int:
+    """
+    Loads every machine row into the registry. Returns the number of machines.
+    """
+    _reload_registry(get_connection())
+    return len(_registry)
+
+
 def ensure_machine_exists(machine_id: str) -> None:
     """
     Creates a machine row if it doesn't exist yet.
-    Default: vacant + normal.
+    Default: vacant + normal. No-op for machines already in the registry.
     """
+    conn = get_connection()
+    _refresh_registry(conn)
+    if machine_id in _registry:
+        return
+
     sql = """
         INSERT OR IGNORE INTO machines (MACHINEID, OCCUPANCY_STATUS, CONDITION_STATUS)
         VALUES (?, 'vacant', 'normal')
     """
-    with get_connection() as conn:
-        conn.execute(sql, (machine_id,))
-        conn.commit()
+    _write_machine(machine_id, sql, (machine_id,))
 
 
-def get_machine_by_id(machine_id: str) -> sqlite3.Row | None:
+def get_machine_by_id(machine_id: str) -> dict | None:
     """
-    Returns one machine row or None.
+    Returns one machine row (as a dict) or None, served from the registry.
     Includes SC6: PROBLEM_REPORTED_AT and PROBLEM_RESOLVED_AT.
     """
-    sql = """
-        SELECT
-            MACHINEID,
-            OCCUPANCY_STATUS,
-            CONDITION_STATUS,
-            LAST_CONDITION_UPDATE,
-            LAST_CONDITION_REASON,
-            PROBLEM_REPORTED_AT,
-            PROBLEM_RESOLVED_AT
-        FROM machines
-        WHERE MACHINEID = ?
-    """
-    with get_connection() as conn:
-        return conn.execute(sql, (machine_id,)).fetchone()
+    _refresh_registry(get_connection())
+    row = _registry.get(machine_id)
+    return dict(row) if row is not None else None
 
 
 def set_machine_occupied(machine_id: str) -> None:
     sql = "UPDATE machines SET OCCUPANCY_STATUS = 'occupied' WHERE MACHINEID = ?"
-    with get_connection() as conn:
-        conn.execute(sql, (machine_id,))
-        conn.commit()
+    _write_machine(machine_id, sql, (machine_id,))
 
 
 def set_machine_vacant(machine_id: str) -> None:
     sql = "UPDATE machines SET OCCUPANCY_STATUS = 'vacant' WHERE MACHINEID = ?"
-    with get_connection() as conn:
-        conn.execute(sql, (machine_id,))
-        conn.commit()
+    _write_machine(machine_id, sql, (machine_id,))
+
+
+def _minutes_between(start: str, end: str) -> float:
+    fmt = "%Y-%m-%d %H:%M:%S"
+    return (datetime.strptime(end, fmt) - datetime.strptime(start, fmt)).total_seconds() / 60
 
 
 def update_machine_condition(machine_id: str, new_condition: str, reason: str | None) -> None:
@@ -187,99 +1151,331 @@ def update_machine_condition(machine_id: str, new_condition: str, reason: str |
     Updates machine condition (SC5) and stamps problem timestamps (SC6).
     - If set to broken: PROBLEM_REPORTED_AT is set and PROBLEM_RESOLVED_AT cleared
     - If set to normal: PROBLEM_RESOLVED_AT is set (reported time remains)
+    Opening or closing an incident also appends to machine_incidents and
+    updates the machine_stats reliability totals in the same transaction.
+    Reporting a machine that is already broken keeps the open incident.
     """
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    if new_condition == "broken":
-        sql = """
-            UPDATE machines
-            SET CONDITION_STATUS = ?,
-                LAST_CONDITION_UPDATE = ?,
-                LAST_CONDITION_REASON = ?,
-                PROBLEM_REPORTED_AT = ?,
-                PROBLEM_RESOLVED_AT = NULL
-            WHERE MACHINEID = ?
-        """
-        params = (new_condition, now, reason, now, machine_id)
-    else:
-        sql = """
-            UPDATE machines
-            SET CONDITION_STATUS = ?,
-                LAST_CONDITION_UPDATE = ?,
-                LAST_CONDITION_REASON = ?,
-                PROBLEM_RESOLVED_AT = ?
-            WHERE MACHINEID = ?
-        """
-        params = (new_condition, now, reason, now, machine_id)
+    with immediate_transaction() as conn:
+        since = _machines_version(conn)
+        stats = conn.execute(
+            "SELECT OPEN_SINCE, LAST_RESOLVED_AT FROM machine_stats WHERE MACHINEID = ?", (machine_id,)
+        ).fetchone()
+        open_since = stats["OPEN_SINCE"] if stats is not None else None
+        last_resolved = stats["LAST_RESOLVED_AT"] if stats is not None else None
 
+        if new_condition == "broken" and open_since is not None:
+            conn.execute("""
+                UPDATE machines
+                SET CONDITION_STATUS = ?,
+                    LAST_CONDITION_UPDATE = ?,
+                    LAST_CONDITION_REASON = ?
+                WHERE MACHINEID = ?
+            """, (new_condition, now, reason, machine_id))
+
+        elif new_condition == "broken":
+            uptime = _minutes_between(last_resolved, now) if last_resolved else None
+            conn.execute("""
+                UPDATE machines
+                SET CONDITION_STATUS = ?,
+                    LAST_CONDITION_UPDATE = ?,
+                    LAST_CONDITION_REASON = ?,
+                    PROBLEM_REPORTED_AT = ?,
+                    PROBLEM_RESOLVED_AT = NULL
+                WHERE MACHINEID = ?
+            """, (new_condition, now, reason, now, machine_id))
+            conn.execute("""
+                INSERT INTO machine_incidents (MACHINEID, EVENT, OCCURRED_AT, REASON, UPTIME_MIN)
+                VALUES (?, 'reported', ?, ?, ?)
+            """, (machine_id, now, reason, uptime))
+            conn.execute("""
+                INSERT INTO machine_stats (MACHINEID, INCIDENT_COUNT, UPTIME_MIN, UPTIME_COUNT, OPEN_SINCE)
+                VALUES (?, 1, ?, ?, ?)
+                ON CONFLICT (MACHINEID) DO UPDATE SET
+                    INCIDENT_COUNT = INCIDENT_COUNT + 1,
+                    UPTIME_MIN = UPTIME_MIN + excluded.UPTIME_MIN,
+                    UPTIME_COUNT = UPTIME_COUNT + excluded.UPTIME_COUNT,
+                    OPEN_SINCE = excluded.OPEN_SINCE
+            """, (machine_id, uptime or 0, int(uptime is not None), now))
+
+        else:
+            conn.execute("""
+                UPDATE machines
+                SET CONDITION_STATUS = ?,
+                    LAST_CONDITION_UPDATE = ?,
+                    LAST_CONDITION_REASON = ?,
+                    PROBLEM_RESOLVED_AT = ?
+                WHERE MACHINEID = ?
+            """, (new_condition, now, reason, now, machine_id))
+
+            if open_since is not None:
+                repair = _minutes_between(open_since, now)
+                conn.execute("""
+                    INSERT INTO machine_incidents (MACHINEID, EVENT, OCCURRED_AT, REASON, REPAIR_MIN)
+                    VALUES (?, 'resolved', ?, ?, ?)
+                """, (machine_id, now, reason, repair))
+                conn.execute("""
+                    UPDATE machine_stats
+                    SET RESOLVED_COUNT = RESOLVED_COUNT + 1,
+                        DOWNTIME_MIN = DOWNTIME_MIN + ?,
+                        LAST_REPAIR_MIN = ?,
+                        OPEN_SINCE = NULL,
+                        LAST_RESOLVED_AT = ?
+                    WHERE MACHINEID = ?
+                """, (repair, repair, now, machine_id))
+
+        snapshot = _machine_snapshot(conn, machine_id, since)
+    _store_machine(*snapshot)
+
+
+# -----------------------------
+# Hallway queue (SC2/SC5): waiting lists and inputs for predicted wait times.
+# -----------------------------
+
+def get_queue_inputs(machine_ids=None) -> list[sqlite3.Row]:
+    """
+    Per machine: occupancy, condition, the active session's EXPECTED_END and
+    the machine_stats delay totals the wait prediction is based on. All
+    machines, or only `machine_ids`.
+    """
+    sql = """
+        SELECT
+            m.MACHINEID, m.OCCUPANCY_STATUS, m.CONDITION_STATUS,
+            (SELECT s.EXPECTED_END FROM sessions s
+             WHERE s.MACHINEID = m.MACHINEID AND s.STATUS = 'active'
+             ORDER BY s.SESSIONID DESC LIMIT 1) AS EXPECTED_END,
+            IFNULL(st.SESSION_COUNT, 0) AS SESSION_COUNT,
+            IFNULL(st.LATE_COUNT, 0) AS LATE_COUNT,
+            IFNULL(st.DELAY_SUM, 0) AS DELAY_SUM
+        FROM machines m
+        LEFT JOIN machine_stats st ON st.MACHINEID = m.MACHINEID
+    """
+    params: tuple = ()
+    if machine_ids is not None:
+        machine_ids = tuple(machine_ids)
+        sql += f" WHERE m.MACHINEID IN ({','.join('?' * len(machine_ids))})"
+        params = machine_ids
     with get_connection() as conn:
-        conn.execute(sql, params)
-        conn.commit()
+        return conn.execute(sql, params).fetchall()
+
+
+_QUEUE_ENTRY_COLUMNS = "ENTRYID, HALLWAY, MACHINE_TYPE, FIRSTNAME, JOINED_AT, STATUS, CLOSED_AT, MACHINEID, TOKEN"
+
+
+def _queue_position(conn: sqlite3.Connection, entry: sqlite3.Row, joined_after: str) -> int:
+    # Waiting entries ahead of this one; answered from idx_queue_entries_waiting.
+    return conn.execute("""
+        SELECT COUNT(*) FROM queue_entries
+        WHERE STATUS = 'waiting' AND HALLWAY = ? AND MACHINE_TYPE = ?
+          AND ENTRYID < ? AND JOINED_AT >= ?
+    """, (entry["HALLWAY"], entry["MACHINE_TYPE"], entry["ENTRYID"], joined_after)).fetchone()[0]
+
+
+def count_queue_waiting(hallway: str, machine_type: str, joined_after: str) -> int:
+    with get_connection() as conn:
+        return conn.execute("""
+            SELECT COUNT(*) FROM queue_entries
+            WHERE STATUS = 'waiting' AND HALLWAY = ? AND MACHINE_TYPE = ? AND JOINED_AT >= ?
+        """, (hallway, machine_type, joined_after)).fetchone()[0]
+
+
+def join_queue(hallway: str, machine_type: str, first_name: str | None, token: str,
+               joined_at: str, joined_after: str) -> dict:
+    """
+    Adds a waiting entry holding `token` and returns it with its position
+    (0 = next in line). Entries that joined before `joined_after` are
+    expired in the same transaction.
+    """
+    with immediate_transaction() as conn:
+        conn.execute("""
+            UPDATE queue_entries SET STATUS = 'expired', CLOSED_AT = ?
+            WHERE STATUS = 'waiting' AND JOINED_AT < ?
+        """, (joined_at, joined_after))
+        cur = conn.execute("""
+            INSERT INTO queue_entries (HALLWAY, MACHINE_TYPE, FIRSTNAME, JOINED_AT, TOKEN)
+            VALUES (?, ?, ?, ?, ?)
+        """, (hallway, machine_type, first_name, joined_at, token))
+        entry = conn.execute(
+            f"SELECT {_QUEUE_ENTRY_COLUMNS} FROM queue_entries WHERE ENTRYID = ?", (cur.lastrowid,)
+        ).fetchone()
+        return dict(entry, POSITION=_queue_position(conn, entry, joined_after))
+
+
+def get_queue_entry(entry_id: int, joined_after: str) -> dict | None:
+    """
+    Returns a queue entry with its current POSITION (None unless waiting);
+    a waiting entry older than `joined_after` is reported as expired.
+    Callers check TOKEN before acting on the entry.
+    """
+    with get_connection() as conn:
+        entry = conn.execute(
+            f"SELECT {_QUEUE_ENTRY_COLUMNS} FROM queue_entries WHERE ENTRYID = ?", (entry_id,)
+        ).fetchone()
+        if entry is None:
+            return None
+        if entry["STATUS"] != "waiting":
+            return dict(entry, POSITION=None)
+        if entry["JOINED_AT"] < joined_after:
+            return dict(entry, STATUS="expired", POSITION=None)
+        return dict(entry, POSITION=_queue_position(conn, entry, joined_after))
+
+
+def close_queue_entry(entry_id: int, status: str, closed_at: str, machine_id: str | None = None) -> bool:
+    """
+    Moves a waiting entry to 'served' (on `machine_id`) or 'left'.
+    Returns False if it was not waiting.
+    """
+    with immediate_transaction() as conn:
+        cur = conn.execute("""
+            UPDATE queue_entries SET STATUS = ?, CLOSED_AT = ?, MACHINEID = ?
+            WHERE ENTRYID = ? AND STATUS = 'waiting'
+        """, (status, closed_at, machine_id, entry_id))
+        return cur.rowcount == 1
 
 
 # -----------------------------
 # Summary stats (SC6): aggregates for delays and repair time.
 # -----------------------------
 
-def get_machine_summary_stats(machine_id: str) -> dict:
-    with get_connection() as conn:
-        total_sessions = conn.execute("""
-            SELECT COUNT(*) AS c
-            FROM sessions
-            WHERE MACHINEID = ?
-        """, (machine_id,)).fetchone()["c"]
+# SC6: counts and delays read from the machine_stats rollup (O(1) per machine).
+_ROLLUP_AGGREGATES = """
+    ms.SESSION_COUNT AS total_sessions,
+    ms.LATE_COUNT AS late_count,
+    CASE WHEN ms.SESSION_COUNT > 0 THEN CAST(ms.DELAY_SUM AS REAL) / ms.SESSION_COUNT END AS avgd,
+    ms.DELAY_MAX AS maxd,
+    ms.ARCHIVED_COUNT AS archived_count
+"""
 
-        late_count = conn.execute("""
-            SELECT COUNT(*) AS c
-            FROM sessions
-            WHERE MACHINEID = ?
-              AND DELAY_MIN > 0
-        """, (machine_id,)).fetchone()["c"]
+# SC5/SC6: reliability totals from the machine_stats incident columns.
+_RELIABILITY_AGGREGATES = """
+    CASE WHEN ms.OPEN_SINCE IS NULL THEN ms.LAST_REPAIR_MIN END AS repair_min,
+    ms.INCIDENT_COUNT AS incident_count,
+    ms.DOWNTIME_MIN AS downtime_min,
+    CASE WHEN ms.RESOLVED_COUNT > 0 THEN ms.DOWNTIME_MIN / ms.RESOLVED_COUNT END AS mttr_min,
+    CASE WHEN ms.UPTIME_COUNT > 0 THEN ms.UPTIME_MIN / ms.UPTIME_COUNT END AS mtbf_min
+"""
 
-        row = conn.execute("""
-            SELECT AVG(DELAY_MIN) AS avgd, MAX(DELAY_MIN) AS maxd
-            FROM sessions
-            WHERE MACHINEID = ?
-        """, (machine_id,)).fetchone()
-        avg_delay = row["avgd"] or 0
-        max_delay = row["maxd"] or 0
+_RECENT_SESSION_COLUMNS = """
+    s.SESSIONID, s.MACHINEID, s.FIRSTNAME, s.LASTNAME,
+    s.TIMEIN, s.EXPECTED_END, s.TIMEOUT, s.DELAY_MIN, s.STATUS
+"""
 
-        # SC5/SC6: check whether this machine has an open problem report.
-        m = conn.execute("""
-            SELECT PROBLEM_REPORTED_AT, PROBLEM_RESOLVED_AT
-            FROM machines
-            WHERE MACHINEID = ?
-        """, (machine_id,)).fetchone()
 
-        # SC6: compute repair time for this machine if resolved.
-        repair_min = 0
-        if m and m["PROBLEM_REPORTED_AT"] and m["PROBLEM_RESOLVED_AT"]:
-            rep = conn.execute("""
-                SELECT ((julianday(PROBLEM_RESOLVED_AT) - julianday(PROBLEM_REPORTED_AT)) * 24 * 60) AS rep
-                FROM machines
-                WHERE MACHINEID = ?
-            """, (machine_id,)).fetchone()["rep"]
-            repair_min = rep or 0
-
-        recent_sessions = conn.execute("""
-                                       SELECT SESSIONID,
-                                              FIRSTNAME,
-                                              LASTNAME,
-                                              TIMEIN,
-                                              EXPECTED_END,
-                                              TIMEOUT,
-                                              DELAY_MIN,
-                                              STATUS
-                                       FROM sessions
-                                       WHERE MACHINEID = ?
-                                       ORDER BY SESSIONID DESC LIMIT 10
-                                       """, (machine_id,)).fetchall()
+def _summary_from_row(row: sqlite3.Row | None, recent_sessions: list) -> dict:
+    if row is None:
+        total_sessions = late_count = avg_delay = max_delay = repair_min = archived_count = 0
+        incident_count = downtime_min = mttr_min = mtbf_min = 0
+    else:
+        total_sessions = row["total_sessions"] or 0
+        late_count = row["late_count"] or 0
+        avg_delay = row["avgd"] or 0
+        max_delay = row["maxd"] or 0
+        repair_min = row["repair_min"] or 0
+        archived_count = row["archived_count"] or 0
+        incident_count = row["incident_count"] or 0
+        downtime_min = row["downtime_min"] or 0
+        mttr_min = row["mttr_min"] or 0
+        mtbf_min = row["mtbf_min"] or 0
 
     return {
         "total_sessions": int(total_sessions),
         "late_count": int(late_count),
         "avg_delay": round(float(avg_delay), 2),
-        "max_delay": int(max_delay) if max_delay is not None else 0,
+        "max_delay": int(max_delay),
         "repair_min": round(float(repair_min), 2),
+        "archived_count": int(archived_count),
+        "incident_count": int(incident_count),
+        "downtime_min": round(float(downtime_min), 2),
+        "mttr_min": round(float(mttr_min), 2),
+        "mtbf_min": round(float(mtbf_min), 2),
         "recent_sessions": recent_sessions,
-    }
\ No newline at end of file
+    }
+
+
+def get_machine_summary_stats(machine_id: str) -> dict:
+    """
+    SC6 statistics for one machine: session/late counts, average/max delay,
+    latest repair time, incident count, downtime, MTTR/MTBF and the 10 most
+    recent sessions.
+    Two statements: a primary-key lookup of the machine row and its
+    machine_stats rollup, and one indexed lookup for the recent sessions.
+    """
+    with get_connection() as conn:
+        row = conn.execute(f"""
+            SELECT
+                {_ROLLUP_AGGREGATES},
+                {_RELIABILITY_AGGREGATES}
+            FROM machines m
+            LEFT JOIN machine_stats ms ON ms.MACHINEID = m.MACHINEID
+            WHERE m.MACHINEID = ?
+        """, (machine_id,)).fetchone()
+
+        recent_sessions = conn.execute(f"""
+            SELECT {_RECENT_SESSION_COLUMNS}
+            FROM sessions s
+            WHERE s.MACHINEID = ?
+            ORDER BY s.SESSIONID DESC
+            LIMIT 10
+        """, (machine_id,)).fetchall()
+
+    return _summary_from_row(row, recent_sessions)
+
+
+def get_machine_summary_stats_many(
+    machine_ids: list[str] | None = None,
+    include_recent: bool = False
+) -> dict[str, dict]:
+    """
+    Batch variant of get_machine_summary_stats.
+    Returns { machine_id: stats } for the given IDs, or for every machine
+    row when machine_ids is None. Totals for all machines come from a
+    single join against the machine_stats rollup; with include_recent, the
+    last 10 sessions per machine come from one more query.
+    """
+    if machine_ids is None:
+        id_filter, params = "", ()
+    else:
+        machine_ids = list(dict.fromkeys(machine_ids))
+        if not machine_ids:
+            return {}
+        id_filter = "WHERE m.MACHINEID IN (%s)" % ",".join("?" * len(machine_ids))
+        params = tuple(machine_ids)
+
+    with get_connection() as conn:
+        rows = conn.execute(f"""
+            SELECT
+                m.MACHINEID,
+                {_ROLLUP_AGGREGATES},
+                {_RELIABILITY_AGGREGATES}
+            FROM machines m
+            LEFT JOIN machine_stats ms ON ms.MACHINEID = m.MACHINEID
+            {id_filter}
+            ORDER BY m.MACHINEID
+        """, params).fetchall()
+
+        recent = {}
+        if include_recent:
+            # Correlated LIMIT 10 per machine: an index probe per machine, not a history scan.
+            for r in conn.execute(f"""
+                SELECT {_RECENT_SESSION_COLUMNS}
+                FROM machines m
+                JOIN sessions s ON s.MACHINEID = m.MACHINEID
+                WHERE s.SESSIONID IN (
+                    SELECT r.SESSIONID FROM sessions r
+                    WHERE r.MACHINEID = m.MACHINEID
+                    ORDER BY r.SESSIONID DESC
+                    LIMIT 10
+                )
+                {id_filter.replace("WHERE", "AND")}
+                ORDER BY s.MACHINEID, s.SESSIONID DESC
+            """, params):
+                recent.setdefault(r["MACHINEID"], []).append(r)
+
+    stats = {r["MACHINEID"]: _summary_from_row(r, recent.get(r["MACHINEID"], [])) for r in rows}
+
+    # Requested IDs without a machine row yet report empty stats.
+    for machine_id in machine_ids or []:
+        stats.setdefault(machine_id, _summary_from_row(None, []))
+
+    return stats
@@ -0,0 +1,148 @@
+"""
+Server-side scheduler for SC3 finish notifications.
+
+Keeps a min-heap of (EXPECTED_END, SESSIONID) for active sessions and
+queues each finish SMS into the outbox when its cycle ends, so delivery no
+longer depends on the student's browser staying on the session page.
+The heap is rebuilt from the database on start and re-synced periodically
+to pick up sessions started by other worker processes.
+
+The scheduler thread only runs where start_background_workers() is
+called: `python app.py`, `flask run-workers` or the ASGI lifespan
+(asgi.py). Under `flask run` or gunicorn, run one `flask run-workers`
+process next to the web workers, or finish SMS are never sent. Web
+processes without a running scheduler skip schedule(); the worker
+process finds their sessions on its next resync.
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+
+import db
+from helpers import TIME_FORMAT
+
+log = logging.getLogger(__name__)
+
+
+def _epoch(expected_end: str) -> float:
+    return datetime.strptime(expected_end, TIME_FORMAT).timestamp()
+
+
+class FinishScheduler:
+    def __init__(self, on_queued=None, resync_interval: float = 60.0):
+        # on_queued() is called after messages were queued (e.g. to wake the SMS worker).
+        self.on_queued = on_queued
+        self.resync_interval = resync_interval
+
+        self._heap: list[tuple[float, int]] = []
+        self._scheduled: set[int] = set()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._next_resync = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop
+
+    def schedule(self, session_id: int, expected_end: str) -> bool:
+        """
+        Adds a session's finish time; duplicates are ignored. Returns False,
+        adding nothing, when the scheduler thread is not running here.
+        """
+        with self._cond:
+            if not self.running:
+                return False
+            if session_id in self._scheduled:
+                return True
+            self._scheduled.add(session_id)
+            heapq.heappush(self._heap, (_epoch(expected_end), session_id))
+            self._cond.notify()
+            return True
+
+    def resync(self) -> int:
+        """Loads unnotified active sessions from the database. Returns how many were new."""
+        rows = db.get_sessions_awaiting_finish_sms()
+        added = 0
+        with self._cond:
+            for row in rows:
+                if row["SESSIONID"] not in self._scheduled:
+                    self._scheduled.add(row["SESSIONID"])
+                    self._heap.append((_epoch(row["EXPECTED_END"]), row["SESSIONID"]))
+                    added += 1
+            if added:
+                heapq.heapify(self._heap)
+                self._cond.notify()
+        return added
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def _pop_due(self) -> list[int]:
+        # Called with the condition held; waits until something is due or it is time to resync.
+        while not self._stop:
+            now = time.time()
+            if self._heap and self._heap[0][0] <= now:
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, session_id = heapq.heappop(self._heap)
+                    self._scheduled.discard(session_id)
+                    due.append(session_id)
+                return due
+            if now >= self._next_resync:
+                return []
+
+            wait = self._next_resync - now
+            if self._heap:
+                wait = min(wait, self._heap[0][0] - now)
+            self._cond.wait(wait)
+        return []
+
+    def run_due(self, session_ids: list[int]) -> int:
+        """Queues finish SMS for the given sessions. Returns how many were queued."""
+        now = datetime.now().strftime(TIME_FORMAT)
+        queued = sum(1 for session_id in session_ids
+                     if db.enqueue_finish_sms(session_id, now, only_active=True))
+        if queued and self.on_queued is not None:
+            self.on_queued()
+        return queued
+
+    def _loop(self) -> None:
+        while True:
+            if time.time() >= self._next_resync:
+                try:
+                    self.resync()
+                except Exception:
+                    log.exception("finish scheduler resync failed")
+                self._next_resync = time.time() + self.resync_interval
+
+            with self._cond:
+                due = self._pop_due()
+                if self._stop:
+                    break
+
+            if due:
+                try:
+                    self.run_due(due)
+                except Exception:
+                    log.exception("queueing due finish SMS failed")
+
+        db.close_connection()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._next_resync = 0.0
+        self._thread = threading.Thread(target=self._loop, name="finish-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
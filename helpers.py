@@ -1,10 +1,20 @@
-import re
-MACHINEID_PATTERN = r"^[MF][A-D][1-8]$"
+from datetime import datetime
+
+from machine_catalog import CATALOG
+
+MACHINEID_PATTERN = r"^[MF][A-D][1-8]$"  # the IDs CATALOG holds
+
+GRACE_MINUTES = 6  # SC6: grace period used when calculating pickup delay.
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 def ISVALIDMACHINEID(MACHINEID: str) -> bool:
+    """
+    True if MACHINEID is one of the 64 IDs in machine_catalog (^[MF][A-D][1-8]$).
+    """
     if MACHINEID is None:
         return False
-    return re.fullmatch(MACHINEID_PATTERN, str(MACHINEID)) is not None
+    return str(MACHINEID) in CATALOG
 
 def KEEPDIGITSONLY(TEXT: str) -> str:
     """
@@ -13,9 +23,17 @@ def KEEPDIGITSONLY(TEXT: str) -> str:
     if TEXT is None:
         return ""
 
-    DIGITS = ""
-    for CH in str(TEXT):
-        if CH.isdigit():
-            DIGITS = DIGITS + CH
+    return "".join(filter(str.isdigit, str(TEXT)))
 
-    return DIGITS
+def LATEBYMINUTES(EXPECTED_END: str, TIMEOUT: str) -> int:
+    """
+    Whole minutes between EXPECTED_END and TIMEOUT, 0 if picked up on time.
+    """
+    late = datetime.strptime(TIMEOUT, TIME_FORMAT) - datetime.strptime(EXPECTED_END, TIME_FORMAT)
+    return max(0, int(late.total_seconds() // 60))
+
+def PICKUPDELAYMINUTES(EXPECTED_END: str, TIMEOUT: str) -> int:
+    """
+    SC6: DELAY_MIN recorded for a pickup at TIMEOUT, after the GRACE_MINUTES grace.
+    """
+    return max(0, LATEBYMINUTES(EXPECTED_END, TIMEOUT) - GRACE_MINUTES)
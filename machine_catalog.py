@@ -0,0 +1,59 @@
+"""
+Static table of every valid machine ID (SC1/SC3).
+
+The dorm has a fixed layout: floor M (boys, third floor) or F (girls,
+second floor), hallways A-D, machines 1-8 per hallway where 1-4 are washers
+and 5-8 dryers. Everything derivable from an ID is computed once here at
+import; validation, SMS wording and the summary pages look it up instead of
+re-parsing the string per request.
+"""
+from types import MappingProxyType
+from typing import NamedTuple
+
+
+class MachineInfo(NamedTuple):
+    machine_id: str
+    floor_code: str    # "M" or "F"
+    floor: str         # e.g. "third floor (Boys)"
+    hallway: str       # "A".."D"
+    number: int        # 1..8
+    machine_type: str  # "washing machine" or "drying machine"
+    location: str      # SC3 wording used in the finish SMS
+
+
+FLOORS = {"M": "third floor (Boys)", "F": "second floor (Girls)"}
+HALLWAYS = "ABCD"
+NUMBERS = range(1, 9)
+
+
+def _build() -> dict[str, MachineInfo]:
+    table = {}
+    for floor_code, floor in FLOORS.items():
+        for hallway in HALLWAYS:
+            for number in NUMBERS:
+                machine_id = f"{floor_code}{hallway}{number}"
+                machine_type = "washing machine" if number <= 4 else "drying machine"
+                table[machine_id] = MachineInfo(
+                    machine_id=machine_id,
+                    floor_code=floor_code,
+                    floor=floor,
+                    hallway=hallway,
+                    number=number,
+                    machine_type=machine_type,
+                    location=f"{machine_type} {number} in hallway {hallway}, {floor}",
+                )
+    return table
+
+
+# Read-only after import; safe to share between threads.
+CATALOG: MappingProxyType = MappingProxyType(_build())
+
+# In floor/hallway/number order.
+ALL_MACHINE_IDS = tuple(CATALOG)
+
+
+def lookup(machine_id) -> MachineInfo | None:
+    try:
+        return CATALOG.get(machine_id)
+    except TypeError:  # unhashable input
+        return None
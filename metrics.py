@@ -0,0 +1,238 @@
+"""
+Opt-in request and database instrumentation (DLMS_METRICS=1).
+
+Records per-route wall time, Jinja render time, SQLite connections opened,
+queries/commits executed through db.py, time spent in sms_service HTTP
+calls and ratelimit.py rejections/lockouts. Totals are served at /metrics
+in Prometheus text format; each response also gets a Server-Timing header
+with that request's breakdown.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+ENABLED = os.getenv("DLMS_METRICS", "0") == "1"
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 15.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, Histogram] = {}
+
+# Per-request breakdown for the Server-Timing header (one request per thread).
+_request = threading.local()
+
+
+def _inc(name: str, labels: tuple = (), value: float = 1) -> None:
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + value
+
+
+def _observe(name: str, labels: tuple, value: float) -> None:
+    with _lock:
+        hist = _histograms.get((name, labels))
+        if hist is None:
+            hist = _histograms[(name, labels)] = Histogram()
+        hist.observe(value)
+
+
+def _add_to_request(field: str, seconds: float) -> None:
+    timings = getattr(_request, "timings", None)
+    if timings is not None:
+        timings[field] = timings.get(field, 0.0) + seconds
+        counts = _request.counts
+        counts[field] = counts.get(field, 0) + 1
+
+
+# -----------------------------
+# Hooks called from db.py, sms_service.py and ratelimit.py
+# -----------------------------
+
+def record_connection_opened() -> None:
+    _inc("dlms_db_connections_opened_total")
+    _add_to_request("db_connect", 0.0)
+
+
+_DB_TOTALS = {"query": "dlms_db_queries_total", "commit": "dlms_db_commits_total"}
+
+
+def record_db(kind: str, seconds: float) -> None:
+    # kind: "query" or "commit" (commits are where SQLite fsyncs).
+    _inc(_DB_TOTALS[kind])
+    _observe(f"dlms_db_{kind}_duration_seconds", (), seconds)
+    _add_to_request("db", seconds)
+
+
+def record_sms_call(seconds: float, success: bool) -> None:
+    _inc("dlms_sms_http_calls_total", (("outcome", "success" if success else "failure"),))
+    _observe("dlms_sms_http_duration_seconds", (), seconds)
+    _add_to_request("sms", seconds)
+
+
+def record_rate_limit(scope: str, allowed: bool, lockout: bool) -> None:
+    _inc("dlms_rate_limit_checks_total", (("scope", scope), ("outcome", "allowed" if allowed else "rejected")))
+    if lockout:
+        _inc("dlms_rate_limit_lockouts_total", (("scope", scope),))
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3.Connection that times execute*/commit calls."""
+
+    def execute(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            record_db("query", time.perf_counter() - t0)
+
+    def executemany(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            record_db("query", time.perf_counter() - t0)
+
+    def executescript(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().executescript(*args, **kwargs)
+        finally:
+            record_db("query", time.perf_counter() - t0)
+
+    def commit(self):
+        t0 = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_db("commit", time.perf_counter() - t0)
+
+    def __exit__(self, exc_type, exc, tb):
+        # The context manager commits without going through commit().
+        committing = exc_type is None and self.in_transaction
+        t0 = time.perf_counter()
+        try:
+            return super().__exit__(exc_type, exc, tb)
+        finally:
+            if committing:
+                record_db("commit", time.perf_counter() - t0)
+
+
+# -----------------------------
+# Prometheus exposition
+# -----------------------------
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: (list(h.counts), h.total, h.count, h.buckets) for k, h in _histograms.items()}
+
+    lines = []
+    seen_types = set()
+
+    for (name, labels), value in sorted(counters.items()):
+        if name not in seen_types:
+            lines.append(f"# TYPE {name} counter")
+            seen_types.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+        if name not in seen_types:
+            lines.append(f"# TYPE {name} histogram")
+            seen_types.add(name)
+        for bound, c in zip(buckets, counts):
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {c}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# Flask integration
+# -----------------------------
+
+def init_app(app) -> None:
+    """
+    Registers request timing hooks, template render timing and /metrics.
+    """
+    from flask import Response, request
+    from flask.signals import before_render_template, template_rendered
+
+    @app.before_request
+    def _start_request_timer():
+        _request.start = time.perf_counter()
+        _request.timings = {}
+        _request.counts = {}
+
+    def _render_started(sender, template, context, **extra):
+        _request.render_start = time.perf_counter()
+
+    def _render_finished(sender, template, context, **extra):
+        start = getattr(_request, "render_start", None)
+        if start is not None:
+            _add_to_request("render", time.perf_counter() - start)
+            _request.render_start = None
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
+
+    @app.after_request
+    def _finish_request_timer(response):
+        start = getattr(_request, "start", None)
+        timings = getattr(_request, "timings", None)
+        if start is None or timings is None:
+            return response
+
+        elapsed = time.perf_counter() - start
+        route = request.endpoint or "unmatched"
+        labels = (("route", route), ("method", request.method))
+
+        _inc("dlms_http_requests_total", labels + (("status", str(response.status_code)),))
+        _observe("dlms_http_request_duration_seconds", labels, elapsed)
+        if "render" in timings:
+            _observe("dlms_template_render_duration_seconds", (("route", route),), timings["render"])
+
+        counts = _request.counts
+        parts = [f"app;dur={elapsed * 1000:.2f}"]
+        if "db" in timings:
+            parts.append(f'db;dur={timings["db"] * 1000:.2f};desc="{counts["db"]} statements"')
+        if "db_connect" in counts:
+            parts.append(f'db-connect;desc="{counts["db_connect"]} opened"')
+        if "render" in timings:
+            parts.append(f"render;dur={timings['render'] * 1000:.2f}")
+        if "sms" in timings:
+            parts.append(f'sms;dur={timings["sms"] * 1000:.2f};desc="{counts["sms"]} calls"')
+        response.headers["Server-Timing"] = ", ".join(parts)
+
+        _request.start = None
+        _request.timings = None
+        return response
+
+    @app.route("/metrics")
+    def metrics_endpoint():
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
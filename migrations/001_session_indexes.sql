@@ -0,0 +1,12 @@
+-- SC4/SC6: per-machine history lookups (summary stats, recent sessions).
+CREATE INDEX IF NOT EXISTS idx_sessions_machine
+    ON sessions (MACHINEID, SESSIONID);
+
+-- SC6: per-machine delay aggregates are answered from the index alone.
+CREATE INDEX IF NOT EXISTS idx_sessions_machine_delay
+    ON sessions (MACHINEID, DELAY_MIN);
+
+-- SC4: active session per machine; stays tiny because it only holds active rows.
+CREATE INDEX IF NOT EXISTS idx_sessions_active
+    ON sessions (MACHINEID, SESSIONID)
+    WHERE STATUS = 'active';
@@ -0,0 +1,23 @@
+-- SC6: running per-machine totals so summaries do not rescan sessions.
+-- Maintained by db.py in the same transaction as insert/pickup writes;
+-- AVG(DELAY_MIN) = DELAY_SUM / SESSION_COUNT.
+CREATE TABLE IF NOT EXISTS machine_stats (
+    MACHINEID TEXT PRIMARY KEY,
+    SESSION_COUNT INTEGER NOT NULL DEFAULT 0,
+    LATE_COUNT INTEGER NOT NULL DEFAULT 0,
+    DELAY_SUM INTEGER NOT NULL DEFAULT 0,
+    DELAY_MAX INTEGER NOT NULL DEFAULT 0,
+
+    FOREIGN KEY (MACHINEID) REFERENCES machines(MACHINEID)
+);
+
+-- Backfill from existing history.
+INSERT OR REPLACE INTO machine_stats (MACHINEID, SESSION_COUNT, LATE_COUNT, DELAY_SUM, DELAY_MAX)
+SELECT
+    MACHINEID,
+    COUNT(*),
+    COUNT(CASE WHEN DELAY_MIN > 0 THEN 1 END),
+    TOTAL(DELAY_MIN),
+    MAX(DELAY_MIN)
+FROM sessions
+GROUP BY MACHINEID;
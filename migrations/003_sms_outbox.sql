@@ -0,0 +1,19 @@
+-- SC3: persistent outbox for finish SMS; drained by sms_worker.SmsOutboxWorker.
+-- STATUS 'sending' rows hold a lease until NEXT_ATTEMPT_AT, so a crashed
+-- worker's claims become due again.
+CREATE TABLE IF NOT EXISTS sms_outbox (
+    OUTBOXID INTEGER PRIMARY KEY,
+    SESSIONID INTEGER NOT NULL UNIQUE,
+    STATUS TEXT NOT NULL CHECK (STATUS IN ('pending', 'sending', 'sent', 'failed')),
+    ATTEMPTS INTEGER NOT NULL DEFAULT 0,
+    NEXT_ATTEMPT_AT TEXT NOT NULL,
+    LAST_ERROR TEXT,
+    CREATED_AT TEXT NOT NULL,
+    UPDATED_AT TEXT,
+
+    FOREIGN KEY (SESSIONID) REFERENCES sessions(SESSIONID)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_due
+    ON sms_outbox (NEXT_ATTEMPT_AT)
+    WHERE STATUS IN ('pending', 'sending');
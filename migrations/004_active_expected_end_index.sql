@@ -0,0 +1,4 @@
+-- SC2/SC3: active sessions ordered by expected end (finish scheduler rebuild).
+CREATE INDEX IF NOT EXISTS idx_sessions_active_end
+    ON sessions (EXPECTED_END)
+    WHERE STATUS = 'active';
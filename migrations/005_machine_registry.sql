@@ -0,0 +1,32 @@
+-- SC5: provision every machine ID allowed by helpers.MACHINEID_PATTERN (^[MF][A-D][1-8]$).
+WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 8)
+INSERT OR IGNORE INTO machines (MACHINEID, OCCUPANCY_STATUS, CONDITION_STATUS)
+SELECT f.code || h.code || n.x, 'vacant', 'normal'
+FROM (SELECT 'M' AS code UNION ALL SELECT 'F') f
+CROSS JOIN (SELECT 'A' AS code UNION ALL SELECT 'B' UNION ALL SELECT 'C' UNION ALL SELECT 'D') h
+CROSS JOIN n;
+
+-- SC5: version counter for the in-process machine registry (db.py).
+-- Bumped by triggers on every machines write, so workers in other processes
+-- notice changes after PRAGMA data_version moves.
+CREATE TABLE IF NOT EXISTS cache_versions (
+    NAME TEXT PRIMARY KEY,
+    VERSION INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO cache_versions (NAME, VERSION) VALUES ('machines', 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_machines_version_insert AFTER INSERT ON machines
+BEGIN
+    UPDATE cache_versions SET VERSION = VERSION + 1 WHERE NAME = 'machines';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_machines_version_update AFTER UPDATE ON machines
+BEGIN
+    UPDATE cache_versions SET VERSION = VERSION + 1 WHERE NAME = 'machines';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_machines_version_delete AFTER DELETE ON machines
+BEGIN
+    UPDATE cache_versions SET VERSION = VERSION + 1 WHERE NAME = 'machines';
+END;
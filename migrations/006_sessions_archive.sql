@@ -0,0 +1,28 @@
+-- SC6: picked-up sessions older than the retention window, moved out of
+-- the hot sessions table by db.archive_sessions(). Rows keep their
+-- SESSIONID. Totals stay in machine_stats; ARCHIVED_COUNT says how many
+-- of them now live here.
+CREATE TABLE IF NOT EXISTS sessions_archive (
+    SESSIONID INTEGER PRIMARY KEY,
+    MACHINEID TEXT NOT NULL,
+    FIRSTNAME TEXT NOT NULL,
+    LASTNAME TEXT NOT NULL,
+    PHONENUMBER TEXT NOT NULL,
+    TIMEIN TEXT NOT NULL,
+    EXPECTED_END TEXT NOT NULL,
+    STATUS TEXT NOT NULL,
+    FINISH_SMS_STATUS TEXT,
+    FINISH_SMS_SENT_AT TEXT,
+    VERIFICATION_CODE TEXT,
+    TIMEOUT TEXT,
+    DELAY_MIN INTEGER NOT NULL DEFAULT 0,
+    ARCHIVED_AT TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_sessions_archive_machine
+    ON sessions_archive (MACHINEID, SESSIONID);
+
+CREATE INDEX IF NOT EXISTS idx_sessions_archive_machine_delay
+    ON sessions_archive (MACHINEID, DELAY_MIN);
+
+ALTER TABLE machine_stats ADD COLUMN ARCHIVED_COUNT INTEGER NOT NULL DEFAULT 0;
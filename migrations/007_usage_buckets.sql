@@ -0,0 +1,35 @@
+-- SC6: pre-aggregated usage buckets for analytics.py.
+-- Filled incrementally from sessions as they are picked up; ANALYTICS_WATERMARK
+-- is the TIMEOUT up to which closed sessions have been folded in.
+CREATE TABLE IF NOT EXISTS usage_hourly (
+    MACHINEID TEXT NOT NULL,
+    HOUR TEXT NOT NULL,                        -- 'YYYY-MM-DD HH:00:00'
+    HOUR_OF_WEEK INTEGER NOT NULL,             -- 0 = Monday 00:00 .. 167 = Sunday 23:00
+    STARTS INTEGER NOT NULL DEFAULT 0,         -- sessions with TIMEIN in this hour
+    BUSY_MINUTES REAL NOT NULL DEFAULT 0,      -- TIMEIN..TIMEOUT minutes inside this hour
+    PRIMARY KEY (MACHINEID, HOUR)
+) WITHOUT ROWID;
+
+-- Covering index for date-range reports over all machines.
+CREATE INDEX IF NOT EXISTS idx_usage_hourly_hour
+    ON usage_hourly (HOUR, MACHINEID, HOUR_OF_WEEK, BUSY_MINUTES, STARTS);
+
+CREATE TABLE IF NOT EXISTS usage_delays (
+    MACHINEID TEXT NOT NULL,
+    DAY TEXT NOT NULL,                         -- date(TIMEIN)
+    BUCKET INTEGER NOT NULL,                   -- index into analytics.DELAY_BUCKETS
+    COUNT INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (MACHINEID, DAY, BUCKET)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS analytics_state (
+    NAME TEXT PRIMARY KEY,
+    VALUE TEXT
+);
+
+-- Closed sessions in pickup order, for the incremental refresh.
+CREATE INDEX IF NOT EXISTS idx_sessions_picked_up_timeout
+    ON sessions (TIMEOUT)
+    WHERE STATUS = 'picked_up';
+
+CREATE INDEX IF NOT EXISTS idx_usage_delays_day ON usage_delays (DAY, BUCKET, MACHINEID, COUNT);
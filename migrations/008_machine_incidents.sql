@@ -0,0 +1,73 @@
+-- SC5/SC6: append-only log of condition changes that open or close an
+-- incident. 'reported' rows carry the uptime since the previous repair,
+-- 'resolved' rows the repair time, so the machine_stats reliability
+-- columns below can be rebuilt from this table alone.
+CREATE TABLE IF NOT EXISTS machine_incidents (
+    INCIDENTID INTEGER PRIMARY KEY,
+    MACHINEID TEXT NOT NULL,
+    EVENT TEXT NOT NULL CHECK (EVENT IN ('reported', 'resolved')),
+    OCCURRED_AT TEXT NOT NULL,
+    REASON TEXT,
+    UPTIME_MIN REAL,   -- reported: minutes since the previous resolution (NULL for the first)
+    REPAIR_MIN REAL,   -- resolved: minutes since the matching report
+
+    FOREIGN KEY (MACHINEID) REFERENCES machines(MACHINEID)
+);
+
+CREATE INDEX IF NOT EXISTS idx_machine_incidents_machine
+    ON machine_incidents (MACHINEID, INCIDENTID);
+
+-- Running reliability totals, updated in the same transaction as each
+-- condition change. MTTR = DOWNTIME_MIN / RESOLVED_COUNT,
+-- MTBF = UPTIME_MIN / UPTIME_COUNT.
+ALTER TABLE machine_stats ADD COLUMN INCIDENT_COUNT INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE machine_stats ADD COLUMN RESOLVED_COUNT INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE machine_stats ADD COLUMN DOWNTIME_MIN REAL NOT NULL DEFAULT 0;
+ALTER TABLE machine_stats ADD COLUMN UPTIME_MIN REAL NOT NULL DEFAULT 0;
+ALTER TABLE machine_stats ADD COLUMN UPTIME_COUNT INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE machine_stats ADD COLUMN LAST_REPAIR_MIN REAL;
+ALTER TABLE machine_stats ADD COLUMN OPEN_SINCE TEXT;
+ALTER TABLE machine_stats ADD COLUMN LAST_RESOLVED_AT TEXT;
+
+-- Backfill: the machines row holds at most the latest incident.
+INSERT INTO machine_incidents (MACHINEID, EVENT, OCCURRED_AT, REASON)
+SELECT MACHINEID, 'reported', PROBLEM_REPORTED_AT, NULL
+FROM machines
+WHERE PROBLEM_REPORTED_AT IS NOT NULL
+ORDER BY MACHINEID;
+
+INSERT INTO machine_incidents (MACHINEID, EVENT, OCCURRED_AT, REASON, REPAIR_MIN)
+SELECT
+    MACHINEID, 'resolved', PROBLEM_RESOLVED_AT, LAST_CONDITION_REASON,
+    ROUND((julianday(PROBLEM_RESOLVED_AT) - julianday(PROBLEM_REPORTED_AT)) * 24 * 60, 3)
+FROM machines
+WHERE PROBLEM_REPORTED_AT IS NOT NULL AND PROBLEM_RESOLVED_AT >= PROBLEM_REPORTED_AT
+ORDER BY MACHINEID;
+
+INSERT INTO machine_stats (
+    MACHINEID, INCIDENT_COUNT, RESOLVED_COUNT, DOWNTIME_MIN, LAST_REPAIR_MIN, OPEN_SINCE, LAST_RESOLVED_AT
+)
+SELECT
+    MACHINEID,
+    1,
+    CASE WHEN resolved THEN 1 ELSE 0 END,
+    CASE WHEN resolved THEN repair ELSE 0 END,
+    CASE WHEN resolved THEN repair END,
+    CASE WHEN resolved THEN NULL ELSE PROBLEM_REPORTED_AT END,
+    CASE WHEN resolved THEN PROBLEM_RESOLVED_AT END
+FROM (
+    SELECT
+        MACHINEID, PROBLEM_REPORTED_AT, PROBLEM_RESOLVED_AT,
+        IFNULL(PROBLEM_RESOLVED_AT >= PROBLEM_REPORTED_AT, 0) AS resolved,
+        ROUND((julianday(PROBLEM_RESOLVED_AT) - julianday(PROBLEM_REPORTED_AT)) * 24 * 60, 3) AS repair
+    FROM machines
+    WHERE PROBLEM_REPORTED_AT IS NOT NULL
+)
+WHERE true
+ON CONFLICT (MACHINEID) DO UPDATE SET
+    INCIDENT_COUNT = excluded.INCIDENT_COUNT,
+    RESOLVED_COUNT = excluded.RESOLVED_COUNT,
+    DOWNTIME_MIN = excluded.DOWNTIME_MIN,
+    LAST_REPAIR_MIN = excluded.LAST_REPAIR_MIN,
+    OPEN_SINCE = excluded.OPEN_SINCE,
+    LAST_RESOLVED_AT = excluded.LAST_RESOLVED_AT;
@@ -0,0 +1,19 @@
+-- SC2/SC5: students waiting for a washer or dryer in one hallway.
+-- HALLWAY is floor code + hallway letter ('MA'), MACHINE_TYPE as in
+-- machine_catalog. A 'waiting' entry is served when its student starts a
+-- load from the queue link, or expires after QUEUE_ENTRY_TTL_MINUTES.
+CREATE TABLE IF NOT EXISTS queue_entries (
+    ENTRYID INTEGER PRIMARY KEY,
+    HALLWAY TEXT NOT NULL,
+    MACHINE_TYPE TEXT NOT NULL CHECK (MACHINE_TYPE IN ('washing machine', 'drying machine')),
+    FIRSTNAME TEXT,
+    JOINED_AT TEXT NOT NULL,
+    STATUS TEXT NOT NULL DEFAULT 'waiting' CHECK (STATUS IN ('waiting', 'served', 'left', 'expired')),
+    CLOSED_AT TEXT,
+    MACHINEID TEXT                             -- machine the entry was served on
+);
+
+-- Queue position = waiting entries ahead in the same hallway and type.
+CREATE INDEX IF NOT EXISTS idx_queue_entries_waiting
+    ON queue_entries (HALLWAY, MACHINE_TYPE, ENTRYID, JOINED_AT)
+    WHERE STATUS = 'waiting';
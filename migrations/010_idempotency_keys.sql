@@ -0,0 +1,17 @@
+-- Responses to POSTs sent with an Idempotency-Key header (pickup, finish
+-- SMS). A retry with the same key gets the stored response replayed
+-- instead of running the request again; STATUS_CODE is NULL while the
+-- first request is still in flight. Rows older than IDEMPOTENCY_TTL_HOURS
+-- are purged by sweeper.IdempotencyKeyPurger.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    IDEMPOTENCY_KEY TEXT PRIMARY KEY,
+    REQUEST_PATH TEXT NOT NULL,
+    CREATED_AT TEXT NOT NULL,
+    STATUS_CODE INTEGER,
+    CONTENT_TYPE TEXT,
+    LOCATION TEXT,
+    BODY BLOB
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+    ON idempotency_keys (CREATED_AT);
@@ -0,0 +1,5 @@
+-- SC3: each claim_due_sms stamps its rows with a CLAIM_TOKEN; complete_sms
+-- and retry_sms_later only touch a 'sending' row that still carries the
+-- caller's token, so a worker whose lease expired cannot overwrite the
+-- outcome recorded by the worker that took the message over.
+ALTER TABLE sms_outbox ADD COLUMN CLAIM_TOKEN TEXT;
@@ -0,0 +1,9 @@
+-- SC2: each queue entry gets an unguessable TOKEN at join time, returned
+-- only to the student who joined. Reading, leaving and claiming an entry
+-- (the start link) require it, so ENTRYIDs, which are sequential, cannot
+-- be used to cancel or take someone else's place in line.
+ALTER TABLE queue_entries ADD COLUMN TOKEN TEXT;
+
+-- Entries from before this migration get a token nobody holds; they can
+-- no longer be claimed and expire after QUEUE_ENTRY_TTL_MINUTES.
+UPDATE queue_entries SET TOKEN = lower(hex(randomblob(16))) WHERE TOKEN IS NULL;
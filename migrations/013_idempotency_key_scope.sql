@@ -0,0 +1,27 @@
+-- Idempotency keys are scoped to the request path they were sent with:
+-- two clients that pick the same key for different sessions no longer
+-- collide (the second used to get a 422). SQLite cannot change a primary
+-- key in place, so the table is rebuilt; existing rows keep their path.
+CREATE TABLE idempotency_keys_scoped (
+    REQUEST_PATH TEXT NOT NULL,
+    IDEMPOTENCY_KEY TEXT NOT NULL,
+    CREATED_AT TEXT NOT NULL,
+    STATUS_CODE INTEGER,
+    CONTENT_TYPE TEXT,
+    LOCATION TEXT,
+    BODY BLOB,
+
+    PRIMARY KEY (REQUEST_PATH, IDEMPOTENCY_KEY)
+);
+
+INSERT INTO idempotency_keys_scoped (
+    REQUEST_PATH, IDEMPOTENCY_KEY, CREATED_AT, STATUS_CODE, CONTENT_TYPE, LOCATION, BODY
+)
+SELECT REQUEST_PATH, IDEMPOTENCY_KEY, CREATED_AT, STATUS_CODE, CONTENT_TYPE, LOCATION, BODY
+FROM idempotency_keys;
+
+DROP TABLE idempotency_keys;
+ALTER TABLE idempotency_keys_scoped RENAME TO idempotency_keys;
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+    ON idempotency_keys (CREATED_AT);
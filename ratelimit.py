@@ -0,0 +1,255 @@
+"""
+Attempt limits for the code-checking routes (SC4/SC5).
+
+Verification and supervisor codes are 6 digits, so every wrong code is
+charged against two token buckets (AttemptLimiter.fail):
+
+    (scope, client, machine)  RATE_LIMIT_BURST attempts, then
+                              RATE_LIMIT_PER_MINUTE per minute
+    (scope, client)           RATE_LIMIT_CLIENT_BURST, then
+                              RATE_LIMIT_CLIENT_PER_MINUTE, across machines
+
+Correct codes and other POSTs (e.g. starting a load) are never charged.
+Before a code-checking view touches db.py, AttemptLimiter.check looks at
+both buckets without taking a token, and a client whose bucket is empty is
+answered 429 with Retry-After. The failure that empties a bucket counts as
+a lockout. Clients are keyed by request.remote_addr; behind a reverse
+proxy set TRUSTED_PROXY_COUNT so app.py takes it from X-Forwarded-For.
+
+RATE_LIMIT_BACKEND selects where buckets live:
+    memory  per process (default; fine for a single worker)
+    sqlite  a separate SQLite file, RATE_LIMIT_DB, shared by all workers on
+            the host; one UPSERT per check, kept apart from dlms.sqlite3 so
+            a flood of guesses never queues behind session writes
+    off     no limits
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "dlms-ratelimit.sqlite3")
+
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "2"))
+RATE_LIMIT_CLIENT_BURST = int(os.getenv("RATE_LIMIT_CLIENT_BURST", "30"))
+RATE_LIMIT_CLIENT_PER_MINUTE = float(os.getenv("RATE_LIMIT_CLIENT_PER_MINUTE", "10"))
+
+
+# -----------------------------
+# Token buckets
+# -----------------------------
+
+class MemoryBuckets:
+    """Token buckets in a dict; per process."""
+
+    def __init__(self, capacity: int, per_minute: float, max_keys: int = 100_000):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets: dict[str, list] = {}  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def peek(self, key: str, now: float | None = None) -> float:
+        """Seconds until `key` has a token again; 0.0 if it has one now. Takes nothing."""
+        now = time.time() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0.0
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, key: str, now: float | None = None) -> tuple[float, bool]:
+        """
+        Takes one token. Returns (retry_after, lockout): retry_after is 0.0 if
+        a token was taken, else seconds until the next one; lockout is True
+        when this took the bucket's last token.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+                self._buckets[key] = [self.capacity - 1.0, now]
+                return 0.0, self.capacity - 1 < 1
+
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= 1:
+                bucket[:] = [tokens - 1, now]
+                return 0.0, tokens - 1 < 1
+            return (1 - tokens) / self.rate, False
+
+    def _prune(self, now: float) -> None:
+        # Full buckets carry no state; drop them, and everything if that is not enough.
+        full = [k for k, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            self._buckets.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class SqliteBuckets:
+    """Token buckets in a SQLite file shared by every worker process."""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, capacity: int, per_minute: float, path: str = RATE_LIMIT_DB, table: str = "rate_buckets"):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: every check is a single statement.
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")  # losing a few buckets in a crash is harmless
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    KEY TEXT PRIMARY KEY,
+                    TOKENS REAL NOT NULL,
+                    UPDATED REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._local.conn = conn
+        return conn
+
+    def _retry_after(self, tokens: float, updated: float, now: float) -> float:
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def peek(self, key: str, now: float | None = None) -> float:
+        """Same contract as MemoryBuckets.peek."""
+        now = time.time() if now is None else now
+        row = self._connection().execute(
+            f"SELECT TOKENS, UPDATED FROM {self.table} WHERE KEY = ?", (key,)
+        ).fetchone()
+        return 0.0 if row is None else self._retry_after(row[0], row[1], now)
+
+    def take(self, key: str, now: float | None = None) -> tuple[float, bool]:
+        """Same contract as MemoryBuckets.take."""
+        now = time.time() if now is None else now
+        conn = self._connection()
+        params = {"key": key, "now": now, "cap": self.capacity, "rate": self.rate}
+
+        # Refill and take in one statement; the WHERE leaves an empty bucket untouched.
+        taken = conn.execute(f"""
+            INSERT INTO {self.table} (KEY, TOKENS, UPDATED) VALUES (:key, :cap - 1, :now)
+            ON CONFLICT (KEY) DO UPDATE SET
+                TOKENS = MIN(:cap, TOKENS + (:now - UPDATED) * :rate) - 1,
+                UPDATED = :now
+            WHERE MIN(:cap, TOKENS + (:now - UPDATED) * :rate) >= 1
+            RETURNING TOKENS
+        """, params).fetchone()
+
+        self._calls += 1
+        if self._calls % self.PRUNE_EVERY == 0:
+            conn.execute(f"DELETE FROM {self.table} WHERE TOKENS + (:now - UPDATED) * :rate >= :cap", params)
+
+        if taken is not None:
+            return 0.0, taken[0] < 1
+        return max(0.0, self.peek(key, now)), False
+
+    def clear(self) -> None:
+        self._connection().execute(f"DELETE FROM {self.table}")
+
+
+# -----------------------------
+# Per-route limiter
+# -----------------------------
+
+class AttemptLimiter:
+    def __init__(self, per_machine, per_client):
+        self.per_machine = per_machine
+        self.per_client = per_client
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.failures = 0
+        self.lockouts = 0
+        self.errors = 0
+
+    def _keys(self, scope: str, client: str | None, machine_id: str | None) -> tuple[str, str]:
+        client = client or "-"
+        return f"{scope}|{client}|{machine_id or '-'}", f"{scope}|{client}"
+
+    def check(self, scope: str, client: str | None, machine_id: str | None = None) -> float:
+        """
+        Returns 0.0 if the client may try a code now, else seconds to wait.
+        Charges nothing. Fails open if the bucket store is unavailable.
+        """
+        machine_key, client_key = self._keys(scope, client, machine_id)
+        try:
+            retry_after = max(self.per_machine.peek(machine_key), self.per_client.peek(client_key))
+        except sqlite3.Error:
+            log.exception("attempt limiter unavailable; allowing the request")
+            with self._lock:
+                self.errors += 1
+            return 0.0
+
+        with self._lock:
+            if retry_after:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        if metrics.ENABLED:
+            metrics.record_rate_limit(scope, not retry_after, False)
+        return retry_after
+
+    def fail(self, scope: str, client: str | None, machine_id: str | None = None) -> None:
+        """Charges one wrong code to the client's buckets."""
+        machine_key, client_key = self._keys(scope, client, machine_id)
+        try:
+            _, machine_lockout = self.per_machine.take(machine_key)
+            _, client_lockout = self.per_client.take(client_key)
+        except sqlite3.Error:
+            log.exception("attempt limiter unavailable; failed attempt not counted")
+            with self._lock:
+                self.errors += 1
+            return
+
+        lockout = machine_lockout or client_lockout
+        with self._lock:
+            self.failures += 1
+            self.lockouts += lockout
+        if metrics.ENABLED and lockout:
+            metrics.record_rate_limit(scope, True, True)
+
+    def clear(self) -> None:
+        self.per_machine.clear()
+        self.per_client.clear()
+        with self._lock:
+            self.allowed = self.rejected = self.failures = self.lockouts = self.errors = 0
+
+
+def from_env(backend: str = RATE_LIMIT_BACKEND, path: str = RATE_LIMIT_DB) -> AttemptLimiter | None:
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        return AttemptLimiter(
+            SqliteBuckets(RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE, path, table="machine_buckets"),
+            SqliteBuckets(RATE_LIMIT_CLIENT_BURST, RATE_LIMIT_CLIENT_PER_MINUTE, path, table="client_buckets"),
+        )
+    if backend == "memory":
+        return AttemptLimiter(
+            MemoryBuckets(RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE),
+            MemoryBuckets(RATE_LIMIT_CLIENT_BURST, RATE_LIMIT_CLIENT_PER_MINUTE),
+        )
+    raise ValueError(f"RATE_LIMIT_BACKEND must be memory, sqlite or off, not {backend!r}")
@@ -0,0 +1,69 @@
+"""
+Rendered-page cache for the machine scan pages (SC1/SC4).
+
+A GET of /machine/<id>/start without form input renders either
+machine_start.html or verify_code.html from nothing but the machine ID and
+its machines row. RenderCache keeps the finished HTML keyed on exactly
+those inputs, so a repeat scan skips Jinja entirely, and derives a stable
+ETag from the same key so a phone that already has the page gets a 304
+without the page being rendered or looked up at all.
+
+Any change to occupancy/condition changes the row and therefore the key;
+old entries simply age out of the LRU. The ETag also covers `version`
+(APP_VERSION, or a fingerprint of the template files), so a deploy that
+changes the markup does not keep answering 304 for the old page.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def template_fingerprint(folder: str) -> str:
+    """
+    Short hash of the name, size and mtime of every file under `folder`.
+    """
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            h.update(f"{os.path.relpath(path, folder)}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+class RenderCache:
+    def __init__(self, max_entries: int = 512, version: str = ""):
+        self.max_entries = max_entries
+        self.version = version
+        self._entries: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def etag(self, key: tuple) -> str:
+        return hashlib.sha1(repr((self.version, key)).encode("utf-8")).hexdigest()[:20]
+
+    def get(self, key: tuple) -> str | None:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: tuple, body: str) -> None:
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -1,6 +1,19 @@
+DROP TABLE IF EXISTS idempotency_keys;
+DROP TABLE IF EXISTS queue_entries;
+DROP TABLE IF EXISTS machine_incidents;
+DROP TABLE IF EXISTS analytics_state;
+DROP TABLE IF EXISTS usage_delays;
+DROP TABLE IF EXISTS usage_hourly;
+DROP TABLE IF EXISTS cache_versions;
+DROP TABLE IF EXISTS sessions_archive;
+DROP TABLE IF EXISTS sms_outbox;
+DROP TABLE IF EXISTS machine_stats;
 DROP TABLE IF EXISTS sessions;
 DROP TABLE IF EXISTS machines;
 
+-- Tables/indexes beyond this base schema come from migrations/ (db.migrate_db).
+PRAGMA user_version = 0;
+
 CREATE TABLE machines (
     MACHINEID TEXT PRIMARY KEY,
     OCCUPANCY_STATUS TEXT NOT NULL CHECK (OCCUPANCY_STATUS IN ('vacant', 'occupied')),
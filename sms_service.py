@@ -1,18 +1,24 @@
+import asyncio
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from machine_catalog import CATALOG
+
+# Per-request Twilio timeout (seconds); sms_worker sizes its claim lease from it.
+SEND_TIMEOUT = 15.0
 
 def to_e164_us(phone10: str) -> str:
     return "+1" + phone10
 
 def format_machine_location(machine_id: str) -> str:
-    floor_code = machine_id[0]   # SC3: floor code (M/F) parsed from machine ID.
-    hall = machine_id[1]         # SC3: hallway letter parsed from machine ID.
-    num = int(machine_id[2])     # SC3: machine number parsed from machine ID.
-
-    floor_text = "third floor (Boys)" if floor_code == "M" else "second floor (Girls)"
-    machine_type = "washing machine" if 1 <= num <= 4 else "drying machine"
-
-    return f"{machine_type} {num} in hallway {hall}, {floor_text}"
+    # SC3: floor, hallway, number and type come from the precomputed catalog.
+    return CATALOG[machine_id].location
 
 def build_finish_message(machine_id: str, first_name: str | None = None) -> str:
     location = format_machine_location(machine_id)
@@ -29,57 +35,230 @@ def build_finish_message(machine_id: str, first_name: str | None = None) -> str:
     )
 
 
-def send_finish_sms(phone10: str, machine_id: str, first_name: str | None = None) -> dict:
+def _missing_config_result() -> dict:
+    return {
+        "success": False,
+        "error_type": "MISSING_CONFIG",
+        "details": "Missing TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN / TWILIO_FROM_NUMBER"
+    }
+
+
+def _result_from_response(resp) -> dict:
+    # Works for both requests and httpx responses.
+    if 200 <= resp.status_code < 300:
+        data = resp.json()
+        return {"success": True, "sid": data.get("sid", "SM_UNKNOWN")}
+
+    # SC3: Twilio errors usually return JSON with message/code.
+    try:
+        err = resp.json()
+        code = err.get("code")
+        msg = err.get("message")
+        return {"success": False, "error_type": f"TWILIO_{code or resp.status_code}", "details": msg or str(err)}
+    except Exception:
+        return {"success": False, "error_type": f"HTTP_{resp.status_code}", "details": resp.text}
+
+
+class SmsClient:
     """
-    Returns:
-      { "success": True, "sid": "SM..." }
-      { "success": False, "error_type": "...", "details": "..." }
+    Reusable Twilio client: configuration is read once and a keep-alive
+    requests.Session reuses TCP/TLS connections across messages.
+    All send methods return the same result dicts as send_finish_sms.
     """
-    account_sid = os.environ.get("TWILIO_ACCOUNT_SID", "").strip()
-    auth_token = os.environ.get("TWILIO_AUTH_TOKEN", "").strip()
-    from_number = os.environ.get("TWILIO_FROM_NUMBER", "").strip()
 
-    if not account_sid or not auth_token or not from_number:
+    def __init__(
+        self,
+        account_sid: str | None = None,
+        auth_token: str | None = None,
+        from_number: str | None = None,
+        api_base: str | None = None,
+        timeout: float = SEND_TIMEOUT,
+        pool_size: int = 10,
+        max_workers: int = 8
+    ):
+        self.account_sid = (account_sid if account_sid is not None else os.environ.get("TWILIO_ACCOUNT_SID", "")).strip()
+        self.auth_token = (auth_token if auth_token is not None else os.environ.get("TWILIO_AUTH_TOKEN", "")).strip()
+        self.from_number = (from_number if from_number is not None else os.environ.get("TWILIO_FROM_NUMBER", "")).strip()
+
+        # TWILIO_API_BASE lets tests point the sender at a local fake server.
+        if api_base is None:
+            api_base = os.environ.get("TWILIO_API_BASE", "https://api.twilio.com")
+        self.url = f"{api_base.strip().rstrip('/')}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+        self.http = requests.Session()
+        self.http.auth = (self.account_sid, self.auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.account_sid and self.auth_token and self.from_number)
+
+    def _form(self, phone10: str, machine_id: str, first_name: str | None) -> dict:
         return {
-            "success": False,
-            "error_type": "MISSING_CONFIG",
-            "details": "Missing TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN / TWILIO_FROM_NUMBER"
+            "From": self.from_number,
+            "To": to_e164_us(phone10),
+            "Body": build_finish_message(machine_id, first_name),
         }
 
-    to_number = to_e164_us(phone10)
-    location = format_machine_location(machine_id)
-    body = build_finish_message(machine_id, first_name)
+    def send_finish_sms(self, phone10: str, machine_id: str, first_name: str | None = None) -> dict:
+        """
+        Returns:
+          { "success": True, "sid": "SM..." }
+          { "success": False, "error_type": "...", "details": "..." }
+        """
+        if not self.configured:
+            return _missing_config_result()
 
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json"
+        t0 = time.perf_counter()
+        try:
+            resp = self.http.post(
+                self.url,
+                data=self._form(phone10, machine_id, first_name),
+                timeout=self.timeout
+            )
+            if metrics.ENABLED:
+                metrics.record_sms_call(time.perf_counter() - t0, 200 <= resp.status_code < 300)
 
-    try:
-        resp = requests.post(
-            url,
-            data={"From": from_number, "To": to_number, "Body": body},
-            auth=(account_sid, auth_token),
-            timeout=15
+            return _result_from_response(resp)
+
+        except requests.exceptions.Timeout:
+            if metrics.ENABLED:
+                metrics.record_sms_call(time.perf_counter() - t0, False)
+            return {"success": False, "error_type": "TIMEOUT", "details": "Twilio request timed out"}
+        except Exception as e:
+            if metrics.ENABLED:
+                metrics.record_sms_call(time.perf_counter() - t0, False)
+            return {
+                "success": False,
+                "error_type": f"UNKNOWN_{type(e).__name__}",
+                "details": repr(e)
+            }
+
+    def send_many(self, messages: list[tuple], max_workers: int | None = None) -> list[dict]:
+        """
+        Sends a batch of finish messages concurrently.
+        messages: (phone10, machine_id, first_name) tuples.
+        Returns one result dict per message, in the same order.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+
+        workers = min(max_workers or self.max_workers, len(messages))
+        if workers <= 1:
+            return [self.send_finish_sms(*m) for m in messages]
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sms-send") as executor:
+            return list(executor.map(lambda m: self.send_finish_sms(*m), messages))
+
+    def close(self) -> None:
+        self.http.close()
+
+
+class AsyncSmsClient(SmsClient):
+    """
+    asyncio variant of SmsClient for the ASGI deployment (asgi.py), using a
+    pooled httpx.AsyncClient. Requires `pip install httpx`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        import httpx
+
+        pool_size = kwargs.get("pool_size", 10)
+        super().__init__(*args, **kwargs)
+        self.http.close()  # the sync session from SmsClient is not used here
+
+        self._httpx = httpx
+        self.http = httpx.AsyncClient(
+            auth=(self.account_sid, self.auth_token),
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
         )
 
-        if 200 <= resp.status_code < 300:
-            data = resp.json()
-            return {"success": True, "sid": data.get("sid", "SM_UNKNOWN")}
-        else:
-            # SC3: Twilio errors usually return JSON with message/code.
-            try:
-                err = resp.json()
-                code = err.get("code")
-                msg = err.get("message")
-                return {"success": False, "error_type": f"TWILIO_{code or resp.status_code}", "details": msg or str(err)}
-            except Exception:
-                return {"success": False, "error_type": f"HTTP_{resp.status_code}", "details": resp.text}
-
-    except requests.exceptions.Timeout:
-        return {"success": False, "error_type": "TIMEOUT", "details": "Twilio request timed out"}
-    except Exception as e:
-        return {
-            "success": False,
-            "error_type": f"UNKNOWN_{type(e).__name__}",
-            "details": repr(e)
-        }
+    async def send_finish_sms(self, phone10: str, machine_id: str, first_name: str | None = None) -> dict:
+        if not self.configured:
+            return _missing_config_result()
+
+        t0 = time.perf_counter()
+        try:
+            resp = await self.http.post(self.url, data=self._form(phone10, machine_id, first_name))
+            if metrics.ENABLED:
+                metrics.record_sms_call(time.perf_counter() - t0, 200 <= resp.status_code < 300)
+            return _result_from_response(resp)
+
+        except self._httpx.TimeoutException:
+            if metrics.ENABLED:
+                metrics.record_sms_call(time.perf_counter() - t0, False)
+            return {"success": False, "error_type": "TIMEOUT", "details": "Twilio request timed out"}
+        except Exception as e:
+            if metrics.ENABLED:
+                metrics.record_sms_call(time.perf_counter() - t0, False)
+            return {
+                "success": False,
+                "error_type": f"UNKNOWN_{type(e).__name__}",
+                "details": repr(e)
+            }
+
+    async def send_many(self, messages: list[tuple], max_workers: int | None = None) -> list[dict]:
+        """
+        Sends a batch concurrently on the event loop, at most max_workers in flight.
+        """
+        limit = asyncio.Semaphore(max_workers or self.max_workers)
 
+        async def send(m):
+            async with limit:
+                return await self.send_finish_sms(*m)
+
+        return list(await asyncio.gather(*(send(m) for m in messages)))
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> SmsClient:
+    """
+    Returns the process-wide SmsClient, created from the environment on first use.
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = SmsClient()
+    return _default_client
 
+
+def reset_default_client() -> None:
+    """
+    Drops the cached client so the next send re-reads the environment.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is not None:
+            _default_client.close()
+        _default_client = None
+
+
+def send_finish_sms(phone10: str, machine_id: str, first_name: str | None = None) -> dict:
+    """
+    Sends one finish SMS through the shared pooled client.
+    Returns:
+      { "success": True, "sid": "SM..." }
+      { "success": False, "error_type": "...", "details": "..." }
+    """
+    return get_default_client().send_finish_sms(phone10, machine_id, first_name)
+
+
+def send_many(messages: list[tuple], max_workers: int | None = None) -> list[dict]:
+    """
+    Batch variant of send_finish_sms through the shared pooled client.
+    """
+    return get_default_client().send_many(messages, max_workers)
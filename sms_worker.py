@@ -0,0 +1,222 @@
+"""
+Background sender for the SC3 finish SMS outbox.
+
+Requests only enqueue messages (db.enqueue_finish_sms); this worker claims
+due rows, sends each batch with SmsClient.send_many (bounded concurrency
+over one keep-alive connection pool), retries
+transient failures with exponential backoff and writes the final status
+back with db.update_finish_sms.
+
+AsyncSmsOutboxWorker is the same loop as an asyncio task for the ASGI
+deployment (asgi.py): HTTP goes through AsyncSmsClient on the event loop
+and the short SQLite claim/record calls are offloaded to a thread.
+"""
+import asyncio
+import logging
+import math
+import threading
+from datetime import datetime, timedelta
+
+import db
+import sms_service
+from helpers import TIME_FORMAT
+
+log = logging.getLogger(__name__)
+
+# Errors worth retrying: timeouts, throttling, server-side and connection failures.
+RETRYABLE_PREFIXES = ("TIMEOUT", "HTTP_429", "TWILIO_429", "HTTP_5", "TWILIO_5", "UNKNOWN_")
+
+
+def is_retryable(result: dict) -> bool:
+    return str(result.get("error_type", "")).startswith(RETRYABLE_PREFIXES)
+
+
+def _messages(rows: list) -> list[tuple]:
+    return [(r["PHONENUMBER"], r["MACHINEID"], r["FIRSTNAME"]) for r in rows]
+
+
+def _send_error(e: Exception) -> dict:
+    return {"success": False, "error_type": f"UNKNOWN_{type(e).__name__}", "details": repr(e)}
+
+
+class SmsOutboxWorker:
+    def __init__(
+        self,
+        client=None,
+        max_concurrency: int = 4,
+        batch_size: int = 20,
+        poll_interval: float = 2.0,
+        max_attempts: int = 5,
+        base_backoff: float = 5.0,
+        max_backoff: float = 300.0,
+        lease_seconds: float | None = None,
+    ):
+        # Anything with SmsClient.send_many(); defaults to the shared pooled client.
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # A claim must outlive the slowest batch (every send hitting the timeout),
+        # or another worker process re-claims the rows and sends them twice.
+        if lease_seconds is None:
+            rounds = math.ceil(batch_size / max(1, max_concurrency))
+            lease_seconds = rounds * getattr(client, "timeout", sms_service.SEND_TIMEOUT) + 30
+        self.lease_seconds = lease_seconds
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def backoff_seconds(self, attempts: int) -> float:
+        return min(self.max_backoff, self.base_backoff * (2 ** max(0, attempts - 1)))
+
+    def _record(self, row, result: dict) -> None:
+        now_dt = datetime.now()
+        now = now_dt.strftime(TIME_FORMAT)
+        attempts = row["ATTEMPTS"] + 1  # claim_due_sms already counted this attempt.
+
+        token = row["CLAIM_TOKEN"]
+
+        if result["success"]:
+            # Recorded even if the claim was lost: the message did go out.
+            db.update_finish_sms(row["SESSIONID"], f"SENT:{result['sid']}", now)
+            db.complete_sms(row["OUTBOXID"], token, True, None, now)
+            return
+
+        # Failures only count while this worker still holds the claim.
+        error = result.get("error_type", "UNKNOWN")
+        if is_retryable(result) and attempts < self.max_attempts:
+            next_at = now_dt + timedelta(seconds=self.backoff_seconds(attempts))
+            db.retry_sms_later(row["OUTBOXID"], token, next_at.strftime(TIME_FORMAT), error, now)
+            return
+
+        if db.complete_sms(row["OUTBOXID"], token, False, error, now):
+            db.update_finish_sms(row["SESSIONID"], f"FAILED:{error}", now)
+
+    def _claim(self) -> list:
+        now_dt = datetime.now()
+        return db.claim_due_sms(
+            now_dt.strftime(TIME_FORMAT),
+            (now_dt + timedelta(seconds=self.lease_seconds)).strftime(TIME_FORMAT),
+            self.batch_size,
+        )
+
+    def _record_all(self, rows: list, results: list[dict]) -> int:
+        for row, result in zip(rows, results):
+            self._record(row, result)
+        return len(rows)
+
+    def run_once(self) -> int:
+        """
+        Claims and sends one batch of due messages. Returns how many were processed.
+        """
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        client = self.client or sms_service.get_default_client()
+        try:
+            results = client.send_many(_messages(rows), max_workers=self.max_concurrency)
+        except Exception as e:
+            results = [_send_error(e)] * len(rows)
+
+        return self._record_all(rows, results)
+
+    def wake(self) -> None:
+        """Signals that new messages were queued."""
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+            except Exception:
+                log.exception("SMS outbox batch failed")
+                processed = 0
+
+            if processed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+        db.close_connection()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sms-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+class AsyncSmsOutboxWorker(SmsOutboxWorker):
+    def __init__(self, client=None, **kwargs):
+        # client: anything with an async send_many(); defaults to an AsyncSmsClient.
+        super().__init__(client=client, **kwargs)
+        self._loop_ref = None
+        self._async_wake = None
+        self._task = None
+        self._client = client
+
+    async def run_once(self) -> int:
+        rows = await asyncio.to_thread(self._claim)
+        if not rows:
+            return 0
+
+        try:
+            results = await self._client.send_many(_messages(rows), max_workers=self.max_concurrency)
+        except Exception as e:
+            results = [_send_error(e)] * len(rows)
+
+        return await asyncio.to_thread(self._record_all, rows, results)
+
+    def wake(self) -> None:
+        """Thread-safe: request threads and the scheduler call this."""
+        if self._loop_ref is not None:
+            self._loop_ref.call_soon_threadsafe(self._async_wake.set)
+
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                processed = await self.run_once()
+            except Exception:
+                log.exception("SMS outbox batch failed")
+                processed = 0
+
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._async_wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._async_wake.clear()
+
+    def start(self) -> None:
+        """Must be called from the running event loop (e.g. ASGI lifespan startup)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._stop.clear()
+        self._loop_ref = asyncio.get_running_loop()
+        self._async_wake = asyncio.Event()
+        if self._client is None:
+            # httpx clients are bound to the loop that created them.
+            self._client = sms_service.AsyncSmsClient(max_workers=self.max_concurrency)
+        self._task = self._loop_ref.create_task(self._run(), name="sms-outbox")
+
+    async def aclose(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._async_wake.set()
+            await self._task
+            self._task = None
+        if self.client is None and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._loop_ref = None
@@ -0,0 +1,353 @@
+"""
+Connection-pool strategies for db.py (SC5/SC6).
+
+Repository lists every data operation db.py exports, with the same
+signatures and return types; app.py makes all its database calls through
+one. It is not a storage backend interface: both implementations run
+db.py's SQLite SQL against the same SQLite database and differ only in
+how connections are handed out:
+
+    sqlite  SqliteRepository (default): one long-lived connection per
+            thread, as db.get_connection() always did
+    pooled  PooledRepository: every operation, and every Flask request
+            (init_app), borrows a connection from a bounded ConnectionPool
+            shared by all threads, so a server that spawns a thread per
+            request opens at most DLMS_DB_POOL_SIZE connections
+
+DLMS_STORAGE selects the strategy. The pool connects with db.open_connection
+to DLMS_DB_PATH; a "file:/name?vfs=memdb" path gives an in-memory database
+shared by every pooled connection.
+
+Pooling bounds connections; it does not lift SQLite's one-writer-at-a-time
+limit, since writes still serialize on BEGIN IMMEDIATE. Another database
+cannot be plugged in here: the SQL lives in db.py and is SQLite-specific
+(PRAGMA, BEGIN IMMEDIATE, julianday, data_version), and analytics.py and
+the workers call db.py directly.
+
+A connection is only checked out the first time the operation or request
+calls db.get_connection() (see db.connection_source), so requests that
+never touch the database, such as /board/stream, do not hold one.
+Background workers (sms_worker, finish_scheduler, sweeper) are long-lived
+and keep their own per-thread connection in both modes.
+"""
+import functools
+import inspect
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import AbstractContextManager, ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Protocol
+
+import db
+from machine_catalog import ALL_MACHINE_IDS
+
+DLMS_STORAGE = os.getenv("DLMS_STORAGE", "sqlite")
+DB_POOL_SIZE = int(os.getenv("DLMS_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DLMS_DB_POOL_TIMEOUT", "5"))
+
+
+class Repository(Protocol):
+    """
+    Every data operation of db.py; see the function of the same name there
+    for its contract. Connection plumbing (get_connection,
+    immediate_transaction, ...) is replaced by connection() and close().
+    """
+
+    def connection(self) -> AbstractContextManager[sqlite3.Connection]: ...
+    def init_app(self, app) -> None: ...
+    def close(self) -> None: ...
+
+    def migrate_db(self) -> list[str]: ...
+
+    # -----------------------------
+    # Sessions
+    # -----------------------------
+
+    def insert_session(self, machine_id: str, first_name: str, last_name: str, phone_number: str,
+                       time_in: str, expected_end: str, status: str) -> int: ...
+    def start_session(self, machine_id: str, first_name: str, last_name: str, phone_number: str,
+                      time_in: str, expected_end: str, verification_code: str) -> dict: ...
+    def get_session_by_id(self, session_id: int) -> sqlite3.Row | None: ...
+    def update_finish_sms(self, session_id: int, status_text: str, sent_at: str) -> None: ...
+    def get_active_session_by_machine(self, machine_id: str) -> sqlite3.Row | None: ...
+    def set_verification_code(self, session_id: int, code: str) -> None: ...
+    def mark_picked_up(self, session_id: int, time_out: str, delay_min: int) -> bool: ...
+    def close_stale_sessions(self, expected_before: str, time_out: str, limit: int = 500) -> list[int]: ...
+
+    # -----------------------------
+    # Idempotency keys
+    # -----------------------------
+
+    def reserve_idempotency_key(self, key: str, request_path: str, now: str) -> sqlite3.Row | None: ...
+    def store_idempotent_response(self, key: str, request_path: str, status_code: int,
+                                  content_type: str | None, location: str | None, body: bytes) -> None: ...
+    def release_idempotency_key(self, key: str, request_path: str) -> None: ...
+    def purge_idempotency_keys(self, created_before: str) -> int: ...
+
+    # -----------------------------
+    # History and archive
+    # -----------------------------
+
+    def get_session_history(self, before_id: int | None = None, limit: int = 100, machine_id: str | None = None,
+                            since: str | None = None, until: str | None = None, status: str | None = None,
+                            include_archive: bool = True) -> list[dict]: ...
+    def iter_session_history(self, chunk_size: int = 1000, **filters) -> Iterator[dict]: ...
+    def archive_sessions(self, picked_up_before: str, now: str, batch_size: int = 5000) -> int: ...
+
+    # -----------------------------
+    # Finish SMS outbox
+    # -----------------------------
+
+    def enqueue_finish_sms(self, session_id: int, now: str, only_active: bool = False) -> bool: ...
+    def get_sessions_awaiting_finish_sms(self) -> list[sqlite3.Row]: ...
+    def claim_due_sms(self, now: str, lease_until: str, limit: int) -> list[dict]: ...
+    def retry_sms_later(self, outbox_id: int, claim_token: str, next_attempt_at: str, error: str, now: str) -> bool: ...
+    def complete_sms(self, outbox_id: int, claim_token: str, sent: bool, error: str | None, now: str) -> bool: ...
+
+    # -----------------------------
+    # Machine stats
+    # -----------------------------
+
+    def rebuild_machine_stats(self) -> int: ...
+    def check_machine_stats(self) -> list[dict]: ...
+
+    # -----------------------------
+    # Machines
+    # -----------------------------
+
+    def add_machine_listener(self, callback) -> None: ...
+    def get_machines_version(self) -> int: ...
+    def get_board_state(self) -> dict: ...
+    def get_machines_snapshot(self) -> tuple[list[dict], str]: ...
+    def provision_machines(self, machine_ids=ALL_MACHINE_IDS) -> int: ...
+    def reset_machine_cache(self) -> None: ...
+    def warm_machine_cache(self) -> int: ...
+    def ensure_machine_exists(self, machine_id: str) -> None: ...
+    def get_machine_by_id(self, machine_id: str) -> dict | None: ...
+    def set_machine_occupied(self, machine_id: str) -> None: ...
+    def set_machine_vacant(self, machine_id: str) -> None: ...
+    def update_machine_condition(self, machine_id: str, new_condition: str, reason: str | None) -> None: ...
+
+    # -----------------------------
+    # Hallway queues
+    # -----------------------------
+
+    def get_queue_inputs(self, machine_ids=None) -> list[sqlite3.Row]: ...
+    def count_queue_waiting(self, hallway: str, machine_type: str, joined_after: str) -> int: ...
+    def join_queue(self, hallway: str, machine_type: str, first_name: str | None, token: str,
+                   joined_at: str, joined_after: str) -> dict: ...
+    def get_queue_entry(self, entry_id: int, joined_after: str) -> dict | None: ...
+    def close_queue_entry(self, entry_id: int, status: str, closed_at: str, machine_id: str | None = None) -> bool: ...
+
+    # -----------------------------
+    # Summary stats
+    # -----------------------------
+
+    def get_machine_summary_stats(self, machine_id: str) -> dict: ...
+    def get_machine_summary_stats_many(self, machine_ids: list[str] | None = None,
+                                       include_recent: bool = False) -> dict[str, dict]: ...
+
+
+_PLUMBING = ("connection", "init_app", "close")
+
+# The db.py functions a Repository forwards to, in Protocol order.
+OPERATIONS = tuple(
+    name for name, member in vars(Repository).items()
+    if inspect.isfunction(member) and not name.startswith("_") and name not in _PLUMBING
+)
+
+
+def _operation(name: str):
+    func = getattr(db, name)
+
+    # Resolved at call time, so db.py functions swapped in later are used.
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def method(self, *args, **kwargs):
+            with self._scope():
+                yield from getattr(db, name)(*args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def method(self, *args, **kwargs):
+            with self._scope():
+                return getattr(db, name)(*args, **kwargs)
+    return method
+
+
+class _DbRepository:
+    """Implements every Repository operation by calling db.py inside _scope()."""
+
+    @contextmanager
+    def _scope(self) -> Iterator[None]:
+        yield
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """The connection operations in this block use, for ad-hoc SQL (analytics)."""
+        with self._scope():
+            yield db.get_connection()
+
+
+for _name in OPERATIONS:
+    setattr(_DbRepository, _name, _operation(_name))
+
+
+# -----------------------------
+# SQLite, one connection per thread (default)
+# -----------------------------
+
+class SqliteRepository(_DbRepository):
+    def init_app(self, app) -> None:
+        pass
+
+    def close(self) -> None:
+        """Closes the calling thread's connection."""
+        db.close_connection()
+
+
+# -----------------------------
+# Pooled connections
+# -----------------------------
+
+class ConnectionPool:
+    """
+    At most `size` connections from connect(), shared by all threads.
+    Idle connections are reused most-recently-returned first, so a quiet
+    server keeps its hot few connections warm. acquire() waits up to
+    `timeout` seconds for a free slot, then raises sqlite3.OperationalError
+    like an expired busy_timeout.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise sqlite3.OperationalError(f"no pooled connection free after {self.timeout}s (size {self.size})")
+        try:
+            if os.getpid() != self._pid:
+                # Forked: the parent's connections must not be used here.
+                self._idle = queue.LifoQueue()
+                self._pid = os.getpid()
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+                with self._lock:
+                    self.opened += 1
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.checkouts += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # never hand the next borrower an open transaction
+            self._idle.put(conn)
+        except sqlite3.Error:
+            conn.close()  # broken connection: drop it, the slot opens a new one
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Closes the idle connections; borrowed ones are closed as they come back."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _Lease:
+    """db.connection_source provider: checks out on first use, keeps that connection until released."""
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.conn = None
+
+    def __call__(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = self.pool.acquire()
+        return self.conn
+
+    def release(self) -> None:
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            self.pool.release(conn)
+
+
+# The lease db.get_connection() draws from in this thread or task, if any.
+_current_lease: ContextVar[_Lease | None] = ContextVar("dlms_storage_lease", default=None)
+
+
+class PooledRepository(_DbRepository):
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+
+    def _lease(self) -> ExitStack:
+        lease = _Lease(self.pool)
+        stack = ExitStack()
+        stack.callback(lease.release)
+        stack.enter_context(db.connection_source(lease))
+        stack.callback(_current_lease.reset, _current_lease.set(lease))
+        return stack
+
+    @contextmanager
+    def _scope(self) -> Iterator[None]:
+        # Nested operations (and operations inside a leased request) share the outer lease.
+        if _current_lease.get() is not None:
+            yield
+            return
+        with self._lease():
+            yield
+
+    def init_app(self, app) -> None:
+        """
+        Gives each request one lease, released in teardown. A streamed body
+        is iterated after teardown; build it from repository operations
+        (e.g. iter_session_history), which lease for as long as they run.
+        """
+        from flask import g
+
+        @app.before_request
+        def _lease_connection():
+            g.storage_lease = self._lease()
+
+        @app.teardown_request
+        def _release_connection(exc):
+            lease = g.pop("storage_lease", None)
+            if lease is not None:
+                lease.close()
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+def sqlite_connector(path: str) -> Callable[[], sqlite3.Connection]:
+    """connect() for ConnectionPool: db.py's pragmas, usable from any thread."""
+    return functools.partial(db.open_connection, path, check_same_thread=False)
+
+
+def from_env(strategy: str = DLMS_STORAGE, path: str | None = None) -> Repository:
+    if strategy == "sqlite":
+        return SqliteRepository()
+    if strategy == "pooled":
+        return PooledRepository(ConnectionPool(sqlite_connector(path or db.DB_PATH)))
+    raise ValueError(f"DLMS_STORAGE must be sqlite or pooled, not {strategy!r}")
@@ -0,0 +1,128 @@
+"""
+Periodic cleanup threads (SC4/SC6).
+
+StaleSessionSweeper: a session stays 'active' until pickup, so a load that
+is never collected keeps its machine occupied and every rescan on the
+verification page. The sweeper periodically closes sessions whose
+EXPECTED_END is more than STALE_SESSION_MINUTES ago, recording the delay as
+if they had been picked up at sweep time (db.close_stale_sessions). Each
+batch is one transaction that re-checks STATUS, so running a sweeper in
+every worker process is safe.
+
+IdempotencyKeyPurger: drops stored Idempotency-Key responses older than
+IDEMPOTENCY_TTL_HOURS on its own schedule, so it keeps running when the
+stale-session sweeper is disabled.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import db
+from helpers import TIME_FORMAT
+
+log = logging.getLogger(__name__)
+
+STALE_SESSION_MINUTES = int(os.getenv("STALE_SESSION_MINUTES", "240"))  # 0 disables the sweeper.
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL_SECONDS", "300"))
+SWEEP_BATCH_SIZE = 500
+
+# Stored responses for Idempotency-Key retries are dropped after this.
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "3600"))
+
+
+class _PeriodicThread:
+    """Runs run_once() every `interval` seconds on a daemon thread."""
+
+    name = "periodic"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    def run_once(self) -> None:
+        raise NotImplementedError
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("%s run failed", self.name)
+            self._stop.wait(self.interval)
+
+        db.close_connection()
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+class StaleSessionSweeper(_PeriodicThread):
+    name = "stale-session-sweeper"
+
+    def __init__(
+        self,
+        stale_after_minutes: int = STALE_SESSION_MINUTES,
+        interval: float = SWEEP_INTERVAL,
+        batch_size: int = SWEEP_BATCH_SIZE,
+    ):
+        super().__init__(interval)
+        self.stale_after_minutes = stale_after_minutes
+        self.batch_size = batch_size
+
+    @property
+    def enabled(self) -> bool:
+        return self.stale_after_minutes > 0
+
+    def sweep(self, now: datetime | None = None) -> int:
+        """Closes every stale session, one batch per transaction. Returns how many were closed."""
+        if not self.enabled:
+            return 0  # disabled, also for `flask sweep-sessions`
+        now = now or datetime.now()
+        cutoff = (now - timedelta(minutes=self.stale_after_minutes)).strftime(TIME_FORMAT)
+        time_out = now.strftime(TIME_FORMAT)
+
+        closed = 0
+        while True:
+            batch = db.close_stale_sessions(cutoff, time_out, self.batch_size)
+            closed += len(batch)
+            if len(batch) < self.batch_size:
+                return closed
+
+    def run_once(self) -> None:
+        closed = self.sweep()
+        if closed:
+            log.info("closed %d stale sessions", closed)
+
+
+class IdempotencyKeyPurger(_PeriodicThread):
+    name = "idempotency-key-purger"
+
+    def __init__(self, ttl_hours: float = IDEMPOTENCY_TTL_HOURS, interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+        super().__init__(interval)
+        self.ttl_hours = ttl_hours
+
+    def purge(self, now: datetime | None = None) -> int:
+        """Deletes keys created more than ttl_hours ago. Returns how many were deleted."""
+        now = now or datetime.now()
+        return db.purge_idempotency_keys((now - timedelta(hours=self.ttl_hours)).strftime(TIME_FORMAT))
+
+    def run_once(self) -> None:
+        self.purge()
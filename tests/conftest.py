@@ -0,0 +1,192 @@
+"""
+Shared fixtures: every test gets an empty, migrated SQLite database in its
+own temporary directory, and app.py is imported with the attempt limiter
+off (tests that exercise it install their own).
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix="dlms-tests-")
+os.environ["DLMS_DB_PATH"] = os.path.join(_scratch, "import.sqlite3")
+os.environ["RATE_LIMIT_BACKEND"] = "off"
+os.environ["RATE_LIMIT_DB"] = os.path.join(_scratch, "ratelimit.sqlite3")
+os.environ["DLMS_METRICS"] = "0"
+
+import pytest
+
+import db
+import sms_service
+
+
+def create_schema(conn) -> None:
+    with open(os.path.join(ROOT, "schema.sql"), "r", encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.commit()
+
+
+class StubSmsClient:
+    """Stands in for sms_service.SmsClient; never touches the network and counts sends."""
+
+    timeout = 1.0
+
+    def __init__(self):
+        self.sent = []
+
+    def send_finish_sms(self, phone10: str, machine_id: str, first_name: str | None = None) -> dict:
+        self.sent.append((phone10, machine_id))
+        return {"success": True, "sid": "SM_TEST"}
+
+    def send_many(self, messages: list[tuple], max_workers: int | None = None) -> list[dict]:
+        return [self.send_finish_sms(*m) for m in messages]
+
+    def close(self) -> None:
+        pass
+
+
+class FakeTwilio:
+    """
+    Local stand-in for the Twilio Messages API. Answers each POST with the
+    next scripted (status, body), or with respond(form) when given, after
+    `delay` seconds, and records (path, form) for every request.
+    """
+
+    def __init__(self, responses=(), respond=None, delay: float = 0.0):
+        self.responses = list(responses)
+        self.respond = respond
+        self.delay = delay
+        self.requests = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+                with fake._lock:
+                    fake.requests.append((self.path, form))
+                    if fake.respond is not None:
+                        status, body = fake.respond(form)
+                    else:
+                        status, body = fake.responses.pop(0) if fake.responses else (500, {})
+                time.sleep(fake.delay)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def twilio(monkeypatch):
+    """
+    twilio(*responses, respond=None, delay=0.0) starts a FakeTwilio and
+    returns an sms_service.SmsClient pointed at it through TWILIO_API_BASE
+    (the fake is on client.fake).
+    """
+    fakes, clients = [], []
+
+    def make(*responses, respond=None, delay: float = 0.0, **client_options) -> sms_service.SmsClient:
+        fake = FakeTwilio(responses, respond, delay)
+        fakes.append(fake)
+        monkeypatch.setenv("TWILIO_API_BASE", fake.url)
+        client = sms_service.SmsClient(account_sid="ACtest", auth_token="token",
+                                       from_number="+15550000000", timeout=2.0, **client_options)
+        client.fake = fake
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+    for fake in fakes:
+        fake.close()
+
+
+@pytest.fixture
+def fresh_db(tmp_path):
+    """Points db.py at an empty, migrated database for the duration of the test."""
+    previous = db.DB_PATH
+    db.DB_PATH = str(tmp_path / "dlms.sqlite3")
+    create_schema(db.get_connection())
+    db.migrate_db()
+    yield db.DB_PATH
+    db.close_connection()
+    db.DB_PATH = previous
+
+
+@pytest.fixture
+def sms_client():
+    client = StubSmsClient()
+    sms_service._default_client = client
+    yield client
+    sms_service._default_client = None
+
+
+@pytest.fixture
+def app_module(fresh_db, sms_client):
+    import app as app_module
+
+    app_module.scan_pages.clear()
+    app_module.hallway_queues.reset()
+    return app_module
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def parallel():
+    """
+    parallel(n, call) runs call(i) on n threads released together and
+    returns the results in order.
+    """
+    def run_parallel(n: int, call) -> list:
+        barrier = threading.Barrier(n)
+        results = [None] * n
+        errors = []
+
+        def run(i):
+            barrier.wait()
+            try:
+                results[i] = call(i)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.close_connection()
+
+        workers = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    return run_parallel
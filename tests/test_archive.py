@@ -0,0 +1,82 @@
+"""
+archive_sessions (SC6): old picked-up sessions move to sessions_archive in
+batches, stay in history, and take their outbox rows with them.
+"""
+import db
+
+
+def _session(machine_id: str, minute: int, picked_up: bool = True) -> int:
+    time_in = f"2026-01-01 10:{minute:02d}:00"
+    session_id = db.start_session(machine_id, "Test", "Student", "5550001111",
+                                  time_in, time_in, "123456")["session"]["SESSIONID"]
+    if picked_up:
+        assert db.mark_picked_up(session_id, f"2026-01-01 11:{minute:02d}:00", 0)
+    return session_id
+
+
+def _count(table: str) -> int:
+    return db.get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_moves_old_picked_up_sessions_in_batches(fresh_db):
+    db.provision_machines()
+    old = [_session("MA1", i) for i in range(7)]
+    active = _session("MA2", 20, picked_up=False)
+    recent = _session("MA3", 40)
+
+    assert db.archive_sessions("2026-01-01 11:30:00", "2026-02-01 00:00:00", batch_size=3) == 7
+
+    assert _count("sessions") == 2
+    assert db.get_session_by_id(active)["STATUS"] == "active"
+    assert db.get_session_by_id(recent) is not None
+    archived = db.get_connection().execute(
+        "SELECT SESSIONID, ARCHIVED_AT FROM sessions_archive ORDER BY SESSIONID"
+    ).fetchall()
+    assert [(r["SESSIONID"], r["ARCHIVED_AT"]) for r in archived] == [(i, "2026-02-01 00:00:00") for i in old]
+    assert db.archive_sessions("2026-01-01 11:30:00", "2026-02-01 00:00:00") == 0
+
+
+def test_newest_session_is_never_archived(fresh_db):
+    db.provision_machines()
+    first, newest = _session("MB1", 0), _session("MB1", 1)
+
+    assert db.archive_sessions("2027-01-01 00:00:00", "2027-01-01 00:00:00") == 1
+    assert db.get_session_by_id(first) is None
+    assert db.get_session_by_id(newest) is not None
+
+    # SESSIONIDs keep growing past the archived ones.
+    assert _session("MB1", 2) > newest
+
+
+def test_history_still_includes_the_archive(fresh_db):
+    db.provision_machines()
+    ids = [_session("MC1", i) for i in range(4)]
+    db.archive_sessions("2027-01-01 00:00:00", "2027-01-01 00:00:00")
+
+    assert [r["SESSIONID"] for r in db.get_session_history()] == ids[::-1]
+    assert [r["SESSIONID"] for r in db.get_session_history(include_archive=False)] == ids[-1:]
+    assert [r["SESSIONID"] for r in db.get_session_history(machine_id="MC1", before_id=ids[2])] == ids[1::-1]
+    assert db.get_machine_summary_stats("MC1")["total_sessions"] == 4
+
+
+def test_outbox_rows_go_with_the_session(fresh_db):
+    db.provision_machines()
+    ids = [_session(f"MD{i + 1}", i, picked_up=False) for i in range(3)]
+    for session_id in ids:
+        assert db.enqueue_finish_sms(session_id, "2026-01-01 10:30:00")
+        assert db.mark_picked_up(session_id, "2026-01-01 11:00:00", 0)
+
+    assert db.archive_sessions("2027-01-01 00:00:00", "2027-01-01 00:00:00") == 2
+    outbox = db.get_connection().execute("SELECT SESSIONID FROM sms_outbox").fetchall()
+    assert [r["SESSIONID"] for r in outbox] == ids[-1:]
+
+
+def test_cli_command(app_module):
+    db.provision_machines()
+    ids = [_session("FA1", i) for i in range(3)]
+
+    result = app_module.app.test_cli_runner().invoke(args=["archive-sessions", "--days", "0"])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("Archived 2 sessions picked up before ")
+    assert [r["SESSIONID"] for r in db.get_session_history(include_archive=False)] == ids[-1:]
@@ -0,0 +1,87 @@
+"""
+FinishScheduler: queues each finish SMS into the outbox when its cycle
+ends, only while its thread runs in this process.
+"""
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+from finish_scheduler import FinishScheduler
+from helpers import TIME_FORMAT
+
+
+def _start(machine_id: str, ends_in: float) -> tuple[int, str]:
+    now = datetime.now()
+    expected_end = (now + timedelta(seconds=ends_in)).strftime(TIME_FORMAT)
+    session = db.start_session(machine_id, "Test", "Student", "5550001111",
+                               now.strftime(TIME_FORMAT), expected_end, "123456")["session"]
+    return session["SESSIONID"], expected_end
+
+
+@pytest.fixture
+def scheduler(fresh_db):
+    queued = threading.Event()
+    scheduler = FinishScheduler(on_queued=queued.set, resync_interval=3600)
+    scheduler.queued = queued
+    yield scheduler
+    scheduler.stop(timeout=5)
+
+
+def _status(session_id: int) -> str | None:
+    return db.get_session_by_id(session_id)["FINISH_SMS_STATUS"]
+
+
+def test_schedule_is_skipped_when_not_running(scheduler):
+    session_id, expected_end = _start("MA1", -1)
+
+    assert not scheduler.running
+    assert scheduler.schedule(session_id, expected_end) is False
+    assert scheduler.pending() == 0
+
+
+def test_start_resyncs_sessions_from_the_database(scheduler):
+    session_id, _ = _start("MA1", -5)
+    picked_up, _ = _start("MA2", -5)
+    db.mark_picked_up(picked_up, datetime.now().strftime(TIME_FORMAT), 0)
+
+    scheduler.start()
+
+    assert scheduler.queued.wait(5)
+    assert _status(session_id) == "QUEUED"
+    assert _status(picked_up) is None
+
+
+def test_scheduled_session_is_queued_when_it_ends(scheduler):
+    scheduler.start()
+    scheduler.queued.wait(0.5)  # the initial resync finds nothing
+    session_id, expected_end = _start("MB1", 2)
+
+    assert scheduler.schedule(session_id, expected_end)
+    assert scheduler.schedule(session_id, expected_end)
+    assert scheduler.pending() == 1
+    assert _status(session_id) is None
+
+    assert scheduler.queued.wait(5)
+    assert _status(session_id) == "QUEUED"
+    assert scheduler.pending() == 0
+    count = db.get_connection().execute("SELECT COUNT(*) FROM sms_outbox WHERE SESSIONID = ?",
+                                        (session_id,)).fetchone()[0]
+    assert count == 1
+
+
+def test_session_picked_up_before_its_end_is_not_queued(scheduler):
+    session_id, _ = _start("MC1", -1)
+    db.mark_picked_up(session_id, datetime.now().strftime(TIME_FORMAT), 0)
+
+    assert scheduler.run_due([session_id]) == 0
+    assert _status(session_id) is None
+
+
+def test_start_load_without_workers_leaves_the_heap_empty(app_module, client):
+    assert not app_module.finish_scheduler.running
+    client.post("/machine/MD1/start", data={
+        "first_name": "Test", "last_name": "Student", "phone_number": "5550001111",
+    })
+    assert app_module.finish_scheduler.pending() == 0
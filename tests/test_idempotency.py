@@ -0,0 +1,125 @@
+"""
+Concurrency checks: parallel duplicate pickups, finish-SMS requests and
+Idempotency-Key retries through the Flask test client each take effect once.
+"""
+import time
+
+import db
+from conftest import create_schema
+from sms_worker import SmsOutboxWorker
+
+PARALLEL = 16
+
+
+def start(app, machine_id: str) -> int:
+    resp = app.test_client().post(f"/machine/{machine_id}/start", data={
+        "first_name": "Test", "last_name": "Student", "phone_number": "5550001111",
+    })
+    return int(resp.headers["Location"].rstrip("/").split("/")[-1])
+
+
+def test_parallel_pickups_transition_once(app_module, parallel):
+    app = app_module.app
+    session_id = start(app, "MA1")
+
+    statuses = parallel(PARALLEL, lambda i: app.test_client().post(f"/session/{session_id}/pickup").status_code)
+    first = db.get_session_by_id(session_id)
+    time.sleep(1.1)
+    parallel(PARALLEL, lambda i: app.test_client().post(f"/session/{session_id}/pickup").status_code)
+    again = db.get_session_by_id(session_id)
+
+    assert set(statuses) == {302}
+    assert first["STATUS"] == "picked_up"
+    assert (again["TIMEOUT"], again["DELAY_MIN"]) == (first["TIMEOUT"], first["DELAY_MIN"])
+
+
+def test_stale_pickup_retry_keeps_new_load(app_module, parallel):
+    app = app_module.app
+    old_id = start(app, "MA2")
+    app.test_client().post(f"/session/{old_id}/pickup")
+    new_id = start(app, "MA2")
+
+    parallel(PARALLEL, lambda i: app.test_client().post(f"/session/{old_id}/pickup"))
+
+    assert db.get_machine_by_id("MA2")["OCCUPANCY_STATUS"] == "occupied"
+    assert db.get_session_by_id(new_id)["STATUS"] == "active"
+    assert not db.check_machine_stats()
+
+
+def test_parallel_finish_sms_queued_and_sent_once(app_module, sms_client, parallel):
+    app = app_module.app
+    worker = SmsOutboxWorker(client=sms_client)
+    session_id = start(app, "MA3")
+
+    responses = parallel(PARALLEL, lambda i: app.test_client().post(f"/session/{session_id}/send-finish-sms"))
+    outbox = db.get_connection().execute(
+        "SELECT COUNT(*) FROM sms_outbox WHERE SESSIONID = ?", (session_id,)
+    ).fetchone()[0]
+    worker.run_once()
+    parallel(PARALLEL, lambda i: app.test_client().post(f"/session/{session_id}/send-finish-sms"))
+    worker.run_once()
+
+    bodies = [r.get_json() for r in responses]
+    assert sum(1 for b in bodies if b["queued"]) == 1
+    assert sorted(r.status_code for r in responses) == [200] * (PARALLEL - 1) + [202]
+    assert all(b["already_queued"] for b in bodies if not b["queued"])
+    assert outbox == 1
+    assert len(sms_client.sent) == 1
+
+
+def test_finish_sms_after_send_reports_already_sent(app_module, sms_client):
+    app = app_module.app
+    session_id = start(app, "MA5")
+    client = app.test_client()
+
+    first = client.post(f"/session/{session_id}/send-finish-sms")
+    SmsOutboxWorker(client=sms_client).run_once()
+    second = client.post(f"/session/{session_id}/send-finish-sms")
+
+    assert first.status_code == 202 and first.get_json()["queued"]
+    assert second.status_code == 200
+    assert second.get_json()["already_sent"] and not second.get_json()["queued"]
+
+
+def test_idempotency_key_runs_once_and_replays(app_module, parallel):
+    app = app_module.app
+    other_id = start(app, "MA1")
+    keyed_id = start(app, "MA4")
+    headers = {"Idempotency-Key": "test-pickup"}
+
+    statuses = parallel(PARALLEL, lambda i: app.test_client().post(
+        f"/session/{keyed_id}/pickup", headers=headers).status_code)
+    replay = app.test_client().post(f"/session/{keyed_id}/pickup", headers=headers)
+    reused = app.test_client().post(f"/session/{other_id}/pickup", headers=headers)
+
+    assert statuses.count(302) >= 1
+    assert set(statuses) <= {302, 409}
+    assert replay.headers.get("Idempotent-Replayed") == "true"
+
+    # Keys are scoped to the URL: the same key on another session is a new request.
+    assert reused.status_code == 302
+    assert "Idempotent-Replayed" not in reused.headers
+    assert db.get_session_by_id(other_id)["STATUS"] == "picked_up"
+
+
+def test_scoping_migration_keeps_stored_responses(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "before-013.sqlite3"))
+    conn = db.get_connection()
+    try:
+        create_schema(conn)
+        for version, path in db._list_migrations():
+            if version < 13:
+                with open(path, "r", encoding="utf-8") as f:
+                    conn.executescript(f"BEGIN;\n{f.read()}\nPRAGMA user_version = {version};\nCOMMIT;")
+        conn.execute("""
+            INSERT INTO idempotency_keys (IDEMPOTENCY_KEY, REQUEST_PATH, CREATED_AT, STATUS_CODE, BODY)
+            VALUES ('kept', '/session/1/pickup', '2026-01-01 10:00:00', 302, x'6f6b')
+        """)
+        conn.commit()
+
+        assert db.migrate_db() == ["013_idempotency_key_scope.sql"]
+        stored = db.reserve_idempotency_key("kept", "/session/1/pickup", "2026-01-01 11:00:00")
+        assert (stored["STATUS_CODE"], bytes(stored["BODY"])) == (302, b"ok")
+        assert db.reserve_idempotency_key("kept", "/session/2/pickup", "2026-01-01 11:00:00") is None
+    finally:
+        db.close_connection()
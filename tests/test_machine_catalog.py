@@ -0,0 +1,41 @@
+"""
+machine_catalog: the 64 valid IDs, what each one decodes to, and the
+helpers and SMS wording that read from it.
+"""
+import re
+
+import machine_catalog
+from helpers import ISVALIDMACHINEID, KEEPDIGITSONLY, MACHINEID_PATTERN, PICKUPDELAYMINUTES
+from sms_service import build_finish_message, format_machine_location
+
+
+def test_catalog_holds_every_id_the_pattern_allows():
+    ids = machine_catalog.ALL_MACHINE_IDS
+    assert len(ids) == len(set(ids)) == 64
+    assert all(re.match(MACHINEID_PATTERN, machine_id) for machine_id in ids)
+    assert ids[:3] == ("MA1", "MA2", "MA3") and ids[-1] == "FD8"
+
+
+def test_entries_decode_the_id():
+    washer, dryer = machine_catalog.CATALOG["MB3"], machine_catalog.CATALOG["FD5"]
+    assert (washer.floor_code, washer.hallway, washer.number, washer.machine_type) == \
+           ("M", "B", 3, "washing machine")
+    assert (dryer.floor, dryer.machine_type) == ("second floor (Girls)", "drying machine")
+    assert format_machine_location("FD5") == "drying machine 5 in hallway D, second floor (Girls)"
+    assert "washing machine 3 in hallway B, third floor (Boys)" in build_finish_message("MB3")
+
+
+def test_validation_uses_the_catalog():
+    assert ISVALIDMACHINEID("MA1") and ISVALIDMACHINEID("FD8")
+    for bad in ("MA9", "XA1", "ma1", "MA1 ", "", None, 12):
+        assert not ISVALIDMACHINEID(bad)
+    assert machine_catalog.lookup("MC7").number == 7
+    assert machine_catalog.lookup(["MC7"]) is None
+    assert machine_catalog.lookup("MC0") is None
+
+
+def test_string_helpers():
+    assert KEEPDIGITSONLY("(555) 000-1111") == "5550001111"
+    assert KEEPDIGITSONLY(None) == ""
+    assert PICKUPDELAYMINUTES("2026-01-01 10:00:00", "2026-01-01 10:05:59") == 0
+    assert PICKUPDELAYMINUTES("2026-01-01 10:00:00", "2026-01-01 10:10:00") == 4
@@ -0,0 +1,54 @@
+"""
+The in-process machine registry: write-through from db.py writers and
+invalidation of rows written by other threads.
+"""
+import threading
+
+import db
+
+
+def _start(machine_id: str) -> dict:
+    return db.start_session(machine_id, "Test", "Student", "5550001111",
+                            "2026-01-01 10:00:00", "2026-01-01 10:45:00", "123456")
+
+
+def test_out_of_order_write_through_is_not_lost(fresh_db, monkeypatch, parallel):
+    db.provision_machines()
+    db.warm_machine_cache()
+
+    first_committed, second_stored = threading.Event(), threading.Event()
+    real_store = db._store_machine
+
+    def store(row, since, version):
+        # The MA1 writer commits first but stores its snapshot after MA2's.
+        if row["MACHINEID"] == "MA1":
+            first_committed.set()
+            second_stored.wait(5)
+        real_store(row, since, version)
+        if row["MACHINEID"] == "MA2":
+            second_stored.set()
+
+    monkeypatch.setattr(db, "_store_machine", store)
+
+    def writer(i):
+        if i == 0:
+            _start("MA1")
+        else:
+            first_committed.wait(5)
+            db.update_machine_condition("MA2", "broken", "test")
+
+    parallel(2, writer)
+
+    # A third thread, with its own connection, reads both machines.
+    seen = parallel(1, lambda i: (db.get_machine_by_id("MA1"), db.get_machine_by_id("MA2")))[0]
+    assert seen[0]["OCCUPANCY_STATUS"] == "occupied"
+    assert seen[1]["CONDITION_STATUS"] == "broken"
+
+
+def test_writes_from_another_thread_are_seen(fresh_db, parallel):
+    db.provision_machines()
+    assert db.get_machine_by_id("MB2")["OCCUPANCY_STATUS"] == "vacant"
+
+    parallel(1, lambda i: _start("MB2"))
+
+    assert db.get_machine_by_id("MB2")["OCCUPANCY_STATUS"] == "occupied"
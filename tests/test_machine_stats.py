@@ -0,0 +1,69 @@
+"""
+The machine_stats rollup: kept up to date by every session write, checked
+against a fresh aggregate, and rebuilt from scratch.
+"""
+import db
+
+
+def _session(machine_id: str, minute: int) -> int:
+    time_in = f"2026-01-01 10:{minute:02d}:00"
+    return db.start_session(machine_id, "Test", "Student", "5550001111",
+                            time_in, time_in, "123456")["session"]["SESSIONID"]
+
+
+def _stats(machine_id: str) -> dict:
+    row = db.get_connection().execute("SELECT * FROM machine_stats WHERE MACHINEID = ?", (machine_id,)).fetchone()
+    return dict(row) if row is not None else {}
+
+
+def test_rollup_follows_session_writes(fresh_db):
+    db.provision_machines()
+    first, second = _session("MA1", 0), _session("MA2", 1)
+    assert _stats("MA1")["SESSION_COUNT"] == 1
+
+    db.mark_picked_up(first, "2026-01-01 11:00:00", 9)
+    db.mark_picked_up(second, "2026-01-01 11:00:00", 0)
+    third = _session("MA1", 2)
+    db.close_stale_sessions("2026-01-01 10:30:00", "2026-01-01 12:00:00")
+
+    ma1 = _stats("MA1")
+    assert (ma1["SESSION_COUNT"], ma1["LATE_COUNT"], ma1["DELAY_MAX"]) == (2, 2, db.get_session_by_id(third)["DELAY_MIN"])
+    assert ma1["DELAY_SUM"] == 9 + db.get_session_by_id(third)["DELAY_MIN"]
+    assert (_stats("MA2")["SESSION_COUNT"], _stats("MA2")["LATE_COUNT"]) == (1, 0)
+    assert db.check_machine_stats() == []
+
+
+def test_duplicate_pickup_is_counted_once(fresh_db):
+    db.provision_machines()
+    session_id = _session("MB1", 0)
+    assert db.mark_picked_up(session_id, "2026-01-01 11:00:00", 4)
+    assert not db.mark_picked_up(session_id, "2026-01-01 11:05:00", 9)
+
+    assert (_stats("MB1")["LATE_COUNT"], _stats("MB1")["DELAY_SUM"], _stats("MB1")["DELAY_MAX"]) == (1, 4, 4)
+    assert db.check_machine_stats() == []
+
+
+def test_archive_keeps_totals(fresh_db):
+    db.provision_machines()
+    for minute in range(3):
+        db.mark_picked_up(_session("MC2", minute), "2026-01-01 11:00:00", minute)
+    _session("MC3", 5)
+
+    assert db.archive_sessions("2026-01-02 00:00:00", "2026-01-02 00:00:00") == 3
+    assert (_stats("MC2")["SESSION_COUNT"], _stats("MC2")["ARCHIVED_COUNT"]) == (3, 3)
+    assert db.get_machine_summary_stats("MC2")["total_sessions"] == 3
+    assert db.check_machine_stats() == []
+
+
+def test_check_reports_drift_and_rebuild_repairs_it(fresh_db):
+    db.provision_machines()
+    db.mark_picked_up(_session("MD4", 0), "2026-01-01 11:00:00", 6)
+    with db.get_connection() as conn:
+        conn.execute("UPDATE machine_stats SET SESSION_COUNT = 40, DELAY_MAX = 1 WHERE MACHINEID = 'MD4'")
+
+    mismatches = {(m["machine_id"], m["column"]): (m["expected"], m["actual"]) for m in db.check_machine_stats()}
+    assert mismatches == {("MD4", "SESSION_COUNT"): (1, 40), ("MD4", "DELAY_MAX"): (6, 1)}
+
+    assert db.rebuild_machine_stats() == 1
+    assert db.check_machine_stats() == []
+    assert db.get_machine_summary_stats("MD4")["total_sessions"] == 1
@@ -0,0 +1,67 @@
+"""
+/machines (SC5): every machine with its active session, an ETag that
+follows the data, 304 for unchanged polls, and no session secrets.
+"""
+import db
+
+
+def _start(client, machine_id: str) -> None:
+    resp = client.post(f"/machine/{machine_id}/start", data={
+        "first_name": "Ann", "last_name": "Student", "phone_number": "5550001111",
+    })
+    assert resp.status_code == 302
+
+
+def test_snapshot_lists_machines_and_active_sessions(app_module, client):
+    db.provision_machines()
+    _start(client, "MA1")
+
+    resp = client.get("/machines")
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "no-cache"
+    machines = {m["MACHINEID"]: m for m in resp.get_json()["machines"]}
+    assert len(machines) == 64
+    assert machines["MA2"]["ACTIVE_SESSION"] is None
+    session = machines["MA1"]["ACTIVE_SESSION"]
+    assert machines["MA1"]["OCCUPANCY_STATUS"] == "occupied"
+    assert set(session) == {"TIMEIN", "EXPECTED_END", "STATUS"}
+
+    # No way from the public snapshot to /session/<id> or the student's details.
+    body = resp.get_data(as_text=True)
+    for secret in ("SESSIONID", "VERIFICATION_CODE", "PHONENUMBER", "5550001111", "Ann"):
+        assert secret not in body
+
+
+def test_unchanged_snapshot_answers_304(app_module, client):
+    db.provision_machines()
+    etag = client.get("/machines").headers["ETag"]
+
+    resp = client.get("/machines", headers={"If-None-Match": etag})
+    assert (resp.status_code, resp.get_data()) == (304, b"")
+    assert resp.headers["ETag"] == etag
+
+
+def test_etag_changes_with_machines_and_sessions(app_module, client):
+    db.provision_machines()
+    first = client.get("/machines").headers["ETag"]
+
+    _start(client, "MB3")
+    second = client.get("/machines").headers["ETag"]
+    assert second != first
+    assert client.get("/machines", headers={"If-None-Match": first}).status_code == 200
+
+    db.update_machine_condition("MC1", "broken", "leak")
+    third = client.get("/machines").headers["ETag"]
+    assert third not in (first, second)
+    assert client.get("/machines", headers={"If-None-Match": third}).status_code == 304
+
+
+def test_writes_from_another_connection_change_the_etag(app_module, client, parallel):
+    db.provision_machines()
+    etag = client.get("/machines").headers["ETag"]
+
+    parallel(1, lambda i: db.update_machine_condition("MD2", "broken", "leak"))
+
+    resp = client.get("/machines", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert {m["MACHINEID"]: m for m in resp.get_json()["machines"]}["MD2"]["CONDITION_STATUS"] == "broken"
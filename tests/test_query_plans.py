@@ -0,0 +1,45 @@
+"""
+Query plan regression checks: the SQL that the hot db.py helpers run must
+reach sessions through an index, never a full table scan.
+"""
+import pytest
+
+import db
+
+# sessions and the aliases db.py gives it in joins/subqueries.
+SESSION_TABLE_NAMES = ("sessions", "s", "r")
+
+# db.py helpers on the per-request path.
+HOT_PATH_CALLS = [
+    ("get_active_session_by_machine", lambda: db.get_active_session_by_machine("MA1")),
+    ("get_machine_summary_stats", lambda: db.get_machine_summary_stats("MA1")),
+    ("get_machine_summary_stats_many", lambda: db.get_machine_summary_stats_many(["MA1", "MA2"], True)),
+    ("get_sessions_awaiting_finish_sms", db.get_sessions_awaiting_finish_sms),
+    ("get_board_state", db.get_board_state),
+    ("get_queue_inputs", db.get_queue_inputs),
+    ("get_machines_snapshot", db.get_machines_snapshot),
+    ("close_stale_sessions", lambda: db.close_stale_sessions("2000-01-01 00:00:00", "2000-01-01 00:00:00")),
+]
+
+
+@pytest.mark.parametrize("call", [c for _, c in HOT_PATH_CALLS], ids=[n for n, _ in HOT_PATH_CALLS])
+def test_sessions_lookups_use_an_index(fresh_db, call):
+    conn = db.get_connection()
+    traced = []
+    conn.set_trace_callback(traced.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+
+    full_scans = []
+    for sql in traced:
+        if "sessions" not in sql or not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+            words = row[3].split()
+            # Scanning the small machines table, or a partial index on sessions, is fine.
+            if words[0] == "SCAN" and words[1] in SESSION_TABLE_NAMES and "INDEX" not in row[3]:
+                full_scans.append(f"{row[3]}: {' '.join(sql.split())}")
+
+    assert not full_scans
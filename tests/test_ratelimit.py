@@ -0,0 +1,154 @@
+"""
+Attempt limiter: the token buckets on their own, and a brute-force stress
+test through the Flask test client with the limiter in memory and in SQLite.
+"""
+import itertools
+import threading
+
+import pytest
+
+import db
+import ratelimit
+
+BURST = 5
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def buckets(request, tmp_path):
+    if request.param == "memory":
+        return ratelimit.MemoryBuckets(BURST, 60)
+    return ratelimit.SqliteBuckets(BURST, 60, str(tmp_path / "buckets.sqlite3"))
+
+
+def test_bucket_empties_after_burst(buckets):
+    results = [buckets.take("k", now=1000.0) for _ in range(BURST)]
+    assert [r[0] for r in results] == [0.0] * BURST
+    assert [r[1] for r in results] == [False] * (BURST - 1) + [True]
+
+    retry_after, lockout = buckets.take("k", now=1000.0)
+    assert retry_after == pytest.approx(1.0) and not lockout
+    assert buckets.peek("k", now=1000.0) == pytest.approx(1.0)
+    assert buckets.peek("other", now=1000.0) == 0.0
+
+
+def test_bucket_refills(buckets):
+    for _ in range(BURST):
+        buckets.take("k", now=1000.0)
+    assert buckets.peek("k", now=1001.0) == 0.0
+    assert buckets.take("k", now=1001.0) == (0.0, True)
+
+
+def test_peek_takes_nothing(buckets):
+    for _ in range(10):
+        assert buckets.peek("k", now=1000.0) == 0.0
+    assert buckets.take("k", now=1000.0) == (0.0, False)
+
+
+def test_limiter_charges_only_failures():
+    limiter = ratelimit.AttemptLimiter(ratelimit.MemoryBuckets(BURST, 1), ratelimit.MemoryBuckets(100, 1))
+    for _ in range(20):
+        assert limiter.check("verify", "10.0.0.1", "MA1") == 0.0
+    for _ in range(BURST):
+        limiter.fail("verify", "10.0.0.1", "MA1")
+
+    assert limiter.check("verify", "10.0.0.1", "MA1") > 0
+    assert limiter.check("verify", "10.0.0.1", "MA2") == 0.0
+    assert limiter.check("verify", "10.0.0.2", "MA1") == 0.0
+    assert (limiter.failures, limiter.lockouts, limiter.rejected) == (BURST, 1, 1)
+
+
+def test_limiter_fails_open(tmp_path):
+    broken = ratelimit.SqliteBuckets(BURST, 1, str(tmp_path / "missing" / "buckets.sqlite3"))
+    limiter = ratelimit.AttemptLimiter(broken, broken)
+
+    assert limiter.check("verify", "10.0.0.1", "MA1") == 0.0
+    limiter.fail("verify", "10.0.0.1", "MA1")
+    assert limiter.errors == 2
+
+
+def _attacker(app, client_ip: str, machine_id: str, guesses: int, statuses: list) -> None:
+    client = app.test_client()
+    client.environ_base["REMOTE_ADDR"] = client_ip
+    for i in range(guesses):
+        statuses.append(client.post(f"/machine/{machine_id}/start", data={"code": f"{i:06d}"}).status_code)
+    db.close_connection()
+
+
+def _student(app, client_ip: str, machine_ids: list[str], cycles: int, statuses: list) -> None:
+    client = app.test_client()
+    client.environ_base["REMOTE_ADDR"] = client_ip
+    for i in range(cycles):
+        machine_id = machine_ids[i % len(machine_ids)]
+        resp = client.post(f"/machine/{machine_id}/start", data={
+            "first_name": "Test", "last_name": "Student", "phone_number": "5550001111",
+        })
+        statuses.append(resp.status_code)
+        session_id = resp.headers["Location"].rstrip("/").split("/")[-1]
+        statuses.append(client.post(f"/session/{session_id}/pickup").status_code)
+    db.close_connection()
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_brute_force_is_stopped_before_db(app_module, monkeypatch, tmp_path, backend):
+    attackers, guesses = 4, 50
+    app = app_module.app
+    target = "FD8"
+    limiter = ratelimit.from_env(backend, str(tmp_path / "buckets.sqlite3"))
+    monkeypatch.setattr(app_module, "code_attempts", limiter)
+
+    owner = app.test_client()
+    owner.environ_base["REMOTE_ADDR"] = "192.168.0.1"
+    owner.post(f"/machine/{target}/start", data={
+        "first_name": "Test", "last_name": "Student", "phone_number": "5550001111",
+    })
+
+    checkouts = itertools.count()
+    real_get_connection = db.get_connection
+
+    def counting_connection():
+        if threading.current_thread().name.startswith("attacker"):
+            next(checkouts)
+        return real_get_connection()
+
+    monkeypatch.setattr(db, "get_connection", counting_connection)
+
+    attack, students = [], []
+    workers = [
+        threading.Thread(target=_attacker, name=f"attacker-{a}",
+                         args=(app, f"10.0.{a}.1", target, guesses, attack))
+        for a in range(attackers)
+    ] + [
+        threading.Thread(target=_student, args=(app, f"192.168.1.{t}", [f"MA{t + 1}", f"MB{t + 1}"], 10, students))
+        for t in range(2)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    # Each attacker gets BURST wrong codes checked, then only 429s.
+    assert attack.count(429) == attackers * (guesses - ratelimit.RATE_LIMIT_BURST)
+    assert limiter.failures == attackers * ratelimit.RATE_LIMIT_BURST
+    assert limiter.lockouts == attackers
+    assert next(checkouts) < attackers * guesses
+    assert set(students) == {302}
+
+
+def test_supervisor_apis_are_limited(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "code_attempts", ratelimit.from_env("memory"))
+    client = app_module.app.test_client()
+    code = app_module.SUPERVISOR_CODE
+
+    # The query string is not accepted, and a missing code is not a guess.
+    assert client.get(f"/api/analytics?supervisor_code={code}").status_code == 403
+    assert app_module.code_attempts.failures == 0
+
+    statuses = [client.get(path, headers={"X-Supervisor-Code": f"{i:06d}"}).status_code
+                for i, path in enumerate(["/api/sessions", "/api/sessions/export", "/api/analytics"] * 3)]
+    assert statuses[:ratelimit.RATE_LIMIT_BURST] == [403] * ratelimit.RATE_LIMIT_BURST
+    assert set(statuses[ratelimit.RATE_LIMIT_BURST:]) == {429}
+    assert client.get("/api/analytics", headers={"X-Supervisor-Code": code}).status_code == 429
+
+    other = app_module.app.test_client()
+    other.environ_base["REMOTE_ADDR"] = "10.9.9.9"
+    assert other.get("/api/analytics", headers={"X-Supervisor-Code": code}).status_code == 200
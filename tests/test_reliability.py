@@ -0,0 +1,85 @@
+"""
+Machine reliability (SC5/SC6): broken -> normal cycles logged in
+machine_incidents and summed into incident count, downtime, MTTR and MTBF.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """clock(minutes) sets db's datetime.now() to 2026-01-01 08:00 plus minutes."""
+    current = [datetime(2026, 1, 1, 8, 0, 0)]
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return current[0]
+
+    monkeypatch.setattr(db, "datetime", FrozenDatetime)
+
+    def set_clock(minutes: float) -> None:
+        current[0] = datetime(2026, 1, 1, 8, 0, 0) + timedelta(minutes=minutes)
+
+    return set_clock
+
+
+def _condition(clock, minutes: float, machine_id: str, condition: str) -> None:
+    clock(minutes)
+    db.update_machine_condition(machine_id, condition, f"{condition} at {minutes}")
+
+
+def _reliability(machine_id: str) -> tuple:
+    stats = db.get_machine_summary_stats(machine_id)
+    return tuple(stats[k] for k in ("incident_count", "downtime_min", "mttr_min", "mtbf_min", "repair_min"))
+
+
+def test_cycles_add_up_to_mttr_and_mtbf(fresh_db, clock):
+    db.provision_machines()
+    _condition(clock, 0, "MA1", "broken")
+    _condition(clock, 30, "MA1", "normal")
+    assert _reliability("MA1") == (1, 30.0, 30.0, 0.0, 30.0)
+
+    _condition(clock, 130, "MA1", "broken")
+    _condition(clock, 140, "MA1", "broken")  # still the same incident
+    _condition(clock, 150, "MA1", "normal")
+    assert _reliability("MA1") == (2, 50.0, 25.0, 100.0, 20.0)
+
+    _condition(clock, 450, "MA1", "broken")
+    # The open incident counts, but not its downtime; repair_min is blank while broken.
+    assert _reliability("MA1") == (3, 50.0, 25.0, 200.0, 0.0)
+
+    events = db.get_connection().execute(
+        "SELECT EVENT, UPTIME_MIN, REPAIR_MIN FROM machine_incidents WHERE MACHINEID = 'MA1' ORDER BY INCIDENTID"
+    ).fetchall()
+    assert [tuple(e) for e in events] == [
+        ("reported", None, None), ("resolved", None, 30.0),
+        ("reported", 100.0, None), ("resolved", None, 20.0),
+        ("reported", 300.0, None),
+    ]
+    assert db.check_machine_stats() == []
+
+
+def test_normal_without_an_incident_changes_nothing(fresh_db, clock):
+    db.provision_machines()
+    _condition(clock, 0, "MB2", "normal")
+    assert _reliability("MB2") == (0, 0.0, 0.0, 0.0, 0.0)
+    assert db.get_connection().execute("SELECT COUNT(*) FROM machine_incidents").fetchone()[0] == 0
+
+
+def test_rebuild_reproduces_the_running_totals(fresh_db, clock):
+    db.provision_machines()
+    for machine_id, offset in (("MC1", 0), ("FD7", 7)):
+        _condition(clock, offset, machine_id, "broken")
+        _condition(clock, offset + 45, machine_id, "normal")
+        _condition(clock, offset + 105, machine_id, "broken")
+    _condition(clock, 200, "MC1", "normal")
+    before = {m: _reliability(m) for m in ("MC1", "FD7")}
+
+    assert db.rebuild_machine_stats() == 2
+    assert {m: _reliability(m) for m in ("MC1", "FD7")} == before
+    assert before["MC1"] == (2, 140.0, 70.0, 60.0, 95.0)
+    assert db.get_machine_summary_stats_many(["MC1"])["MC1"]["mttr_min"] == 70.0
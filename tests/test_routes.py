@@ -0,0 +1,19 @@
+"""
+Route-level checks through the Flask test client.
+"""
+
+
+def test_analytics_requires_supervisor_code(app_module, client):
+    assert client.get("/api/analytics").status_code == 403
+    resp = client.get("/api/analytics", headers={"X-Supervisor-Code": app_module.SUPERVISOR_CODE})
+    assert resp.status_code == 200
+
+
+def test_scan_page_etag_follows_app_version(app_module, client, monkeypatch):
+    etag = client.get("/machine/MA1/start").headers["ETag"]
+    assert client.get("/machine/MA1/start", headers={"If-None-Match": etag}).status_code == 304
+
+    monkeypatch.setattr(app_module.scan_pages, "version", "next-release")
+    resp = client.get("/machine/MA1/start", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
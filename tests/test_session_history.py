@@ -0,0 +1,89 @@
+"""
+Session history (SC6): keyset pages from db.get_session_history, the
+/api/sessions JSON pages and the streamed CSV/NDJSON export.
+"""
+import csv
+import io
+import json
+
+import db
+
+
+def _session(machine_id: str, minute: int, delay_min: int | None = None) -> int:
+    time_in = f"2026-01-0{1 + minute // 60} 10:{minute % 60:02d}:00"
+    session_id = db.start_session(machine_id, "Test", "Student", "5550001111",
+                                  time_in, time_in, "123456")["session"]["SESSIONID"]
+    if delay_min is not None:
+        assert db.mark_picked_up(session_id, time_in, delay_min)
+    return session_id
+
+
+def _ids(rows) -> list[int]:
+    return [r["SESSIONID"] for r in rows]
+
+
+def test_keyset_pages_cover_every_session_once(fresh_db):
+    ids = [_session("MA1" if i % 2 else "MB2", i, delay_min=0) for i in range(7)]
+
+    pages, before_id = [], None
+    while True:
+        page = db.get_session_history(before_id=before_id, limit=3)
+        pages.append(_ids(page))
+        if len(page) < 3:
+            break
+        before_id = page[-1]["SESSIONID"]
+
+    assert pages == [ids[:3:-1], ids[3:0:-1], ids[:1]]
+    assert _ids(db.iter_session_history(chunk_size=2)) == ids[::-1]
+    assert "PHONENUMBER" not in db.get_session_history(limit=1)[0]
+
+
+def test_filters(fresh_db):
+    picked_up = [_session("MA1", 0, delay_min=0), _session("MA1", 61, delay_min=3)]
+    active = _session("MA1", 62)
+    other = _session("MC3", 63, delay_min=0)
+
+    assert _ids(db.get_session_history(machine_id="MA1")) == [active, picked_up[1], picked_up[0]]
+    assert _ids(db.get_session_history(status="active")) == [active]
+    assert _ids(db.get_session_history(since="2026-01-02 00:00:00")) == [other, active, picked_up[1]]
+    assert _ids(db.get_session_history(until="2026-01-02 00:00:00")) == [picked_up[0]]
+    assert _ids(db.get_session_history(machine_id="MA1", status="picked_up", before_id=picked_up[1])) == \
+           [picked_up[0]]
+
+
+def test_api_pages_follow_the_cursor(app_module, client):
+    ids = [_session("MA1", i, delay_min=0) for i in range(5)]
+    headers = {"X-Supervisor-Code": app_module.SUPERVISOR_CODE}
+
+    first = client.get("/api/sessions?limit=2", headers=headers).get_json()
+    assert (_ids(first["sessions"]), first["next_cursor"]) == (ids[:2:-1], ids[3])
+    second = client.get(f"/api/sessions?limit=2&cursor={first['next_cursor']}", headers=headers).get_json()
+    third = client.get(f"/api/sessions?limit=2&cursor={second['next_cursor']}", headers=headers).get_json()
+    assert _ids(second["sessions"]) + _ids(third["sessions"]) == ids[2::-1]
+    assert third["next_cursor"] is None
+
+    assert client.get("/api/sessions").status_code == 403
+    for query in ("limit=0", "limit=x", "cursor=x", "machine=ZZ9", "status=late", "since=yesterday"):
+        assert client.get(f"/api/sessions?{query}", headers=headers).status_code == 400
+
+
+def test_export_streams_csv_and_ndjson(app_module, client):
+    ids = [_session("MA1", i, delay_min=i) for i in range(3)]
+    _session("MB1", 10)
+    headers = {"X-Supervisor-Code": app_module.SUPERVISOR_CODE}
+
+    resp = client.get("/api/sessions/export?machine=MA1", headers=headers)
+    assert resp.mimetype == "text/csv"
+    assert resp.headers["Content-Disposition"] == "attachment; filename=sessions.csv"
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert [int(r["SESSIONID"]) for r in rows] == ids[::-1]
+    assert [r["DELAY_MIN"] for r in rows] == ["2", "1", "0"]
+    assert list(rows[0]) == list(db.HISTORY_COLUMNS)
+
+    resp = client.get("/api/sessions/export?format=ndjson&status=picked_up", headers=headers)
+    assert resp.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert _ids(lines) == ids[::-1]
+
+    assert client.get("/api/sessions/export?format=xml", headers=headers).status_code == 400
+    assert client.get("/api/sessions/export").status_code == 403
@@ -0,0 +1,70 @@
+"""
+SmsClient: finish messages and concurrent batch sending (send_many)
+against a local fake Twilio endpoint.
+"""
+import time
+
+import sms_service
+from sms_worker import is_retryable
+
+
+def _by_recipient(form: dict) -> tuple[int, dict]:
+    # 555000000N -> SM_N; numbers ending in 9 are rejected.
+    last = form["To"][-1]
+    if last == "9":
+        return 400, {"code": 21211, "message": "Invalid 'To' Phone Number"}
+    return 201, {"sid": f"SM_{last}"}
+
+
+def test_send_finish_sms_posts_the_message(twilio):
+    client = twilio((201, {"sid": "SM_ONE"}))
+
+    assert client.send_finish_sms("5550001111", "MA1", "alex") == {"success": True, "sid": "SM_ONE"}
+    path, form = client.fake.requests[0]
+    assert path == "/2010-04-01/Accounts/ACtest/Messages.json"
+    assert (form["From"], form["To"]) == ("+15550000000", "+15550001111")
+    assert form["Body"] == sms_service.build_finish_message("MA1", "alex")
+    assert form["Body"].startswith("Hello Alex, ")
+
+
+def test_send_many_keeps_order_and_reports_each_result(twilio):
+    client = twilio(respond=_by_recipient)
+    messages = [(f"555000000{i}", "MA1", None) for i in range(10)]
+
+    results = client.send_many(messages, max_workers=4)
+
+    assert [r.get("sid") for r in results] == [f"SM_{i}" for i in range(9)] + [None]
+    assert results[9] == {"success": False, "error_type": "TWILIO_21211", "details": "Invalid 'To' Phone Number"}
+    assert sorted(form["To"] for _, form in client.fake.requests) == sorted(f"+1{m[0]}" for m in messages)
+
+
+def test_send_many_sends_concurrently(twilio):
+    client = twilio(respond=_by_recipient, delay=0.2, max_workers=8)
+    messages = [(f"555000000{i}", "MB2", None) for i in range(8)]
+
+    started = time.perf_counter()
+    results = client.send_many(messages)
+    elapsed = time.perf_counter() - started
+
+    assert all(r["success"] for r in results)
+    assert elapsed < 0.2 * len(messages) / 2
+
+
+def test_send_many_edge_cases(twilio):
+    client = twilio(respond=_by_recipient)
+    assert client.send_many([]) == []
+    assert client.send_many([("5550000003", "MA1", None)], max_workers=1) == [{"success": True, "sid": "SM_3"}]
+
+    unconfigured = sms_service.SmsClient(account_sid="", auth_token="", from_number="")
+    assert [r["error_type"] for r in unconfigured.send_many([("5550000001", "MA1", None)] * 2)] == \
+           ["MISSING_CONFIG", "MISSING_CONFIG"]
+    unconfigured.close()
+
+
+def test_unreachable_server_is_a_retryable_error(twilio):
+    client = twilio()
+    client.fake.close()
+
+    result = client.send_finish_sms("5550001111", "MA1")
+    assert not result["success"]
+    assert is_retryable(result)
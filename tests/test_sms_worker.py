@@ -0,0 +1,95 @@
+"""
+SmsOutboxWorker against a local fake Twilio endpoint (TWILIO_API_BASE):
+claim, retry with backoff, and the final outbox and session status.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+from helpers import TIME_FORMAT
+from sms_worker import SmsOutboxWorker
+
+
+SENT = (201, {"sid": "SM_FAKE"})
+UNAVAILABLE = (503, {"code": None, "message": "Service Unavailable"})
+INVALID_NUMBER = (400, {"code": 21211, "message": "Invalid 'To' Phone Number"})
+
+
+def _queue_message(machine_id: str = "MA1") -> int:
+    now = datetime.now().strftime(TIME_FORMAT)
+    session_id = db.start_session(machine_id, "Test", "Student", "5550001111", now, now, "123456")["session"]["SESSIONID"]
+    assert db.enqueue_finish_sms(session_id, now)
+    return session_id
+
+
+def _outbox(session_id: int):
+    return db.get_connection().execute(
+        "SELECT STATUS, ATTEMPTS, NEXT_ATTEMPT_AT, LAST_ERROR FROM sms_outbox WHERE SESSIONID = ?", (session_id,)
+    ).fetchone()
+
+
+def _make_due(session_id: int) -> None:
+    with db.get_connection() as conn:
+        conn.execute("UPDATE sms_outbox SET NEXT_ATTEMPT_AT = '2000-01-01 00:00:00' WHERE SESSIONID = ?",
+                     (session_id,))
+
+
+def test_retry_with_backoff_then_sent(fresh_db, twilio):
+    client = twilio(UNAVAILABLE, SENT)
+    worker = SmsOutboxWorker(client=client, base_backoff=5.0)
+    session_id = _queue_message()
+
+    before = datetime.now().replace(microsecond=0)
+    assert worker.run_once() == 1
+    row = _outbox(session_id)
+    next_at = datetime.strptime(row["NEXT_ATTEMPT_AT"], TIME_FORMAT)
+    assert (row["STATUS"], row["ATTEMPTS"], row["LAST_ERROR"]) == ("pending", 1, "TWILIO_503")
+    assert before + timedelta(seconds=5) <= next_at <= datetime.now() + timedelta(seconds=6)
+    assert db.get_session_by_id(session_id)["FINISH_SMS_STATUS"] == "QUEUED"
+
+    # Not due yet: nothing is claimed until the backoff has passed.
+    assert worker.run_once() == 0
+
+    _make_due(session_id)
+    assert worker.run_once() == 1
+    assert _outbox(session_id)["STATUS"] == "sent"
+    assert db.get_session_by_id(session_id)["FINISH_SMS_STATUS"] == "SENT:SM_FAKE"
+
+    path, form = client.fake.requests[-1]
+    assert path == "/2010-04-01/Accounts/ACtest/Messages.json"
+    assert form["To"] == "+15550001111"
+    assert len(client.fake.requests) == 2
+
+
+def test_backoff_doubles_then_fails_after_max_attempts(fresh_db, twilio):
+    client = twilio(UNAVAILABLE, UNAVAILABLE, UNAVAILABLE)
+    worker = SmsOutboxWorker(client=client, base_backoff=5.0, max_attempts=3)
+    session_id = _queue_message()
+
+    gaps = []
+    for _ in range(2):
+        assert worker.run_once() == 1
+        row = _outbox(session_id)
+        assert row["STATUS"] == "pending"
+        gaps.append((datetime.strptime(row["NEXT_ATTEMPT_AT"], TIME_FORMAT) - datetime.now()).total_seconds())
+        _make_due(session_id)
+    assert gaps[0] == pytest.approx(5, abs=1.5)
+    assert gaps[1] == pytest.approx(10, abs=1.5)
+
+    assert worker.run_once() == 1
+    assert (_outbox(session_id)["STATUS"], _outbox(session_id)["ATTEMPTS"]) == ("failed", 3)
+    assert db.get_session_by_id(session_id)["FINISH_SMS_STATUS"] == "FAILED:TWILIO_503"
+
+
+def test_permanent_error_fails_without_retry(fresh_db, twilio):
+    client = twilio(INVALID_NUMBER)
+    worker = SmsOutboxWorker(client=client)
+    session_id = _queue_message()
+
+    assert worker.run_once() == 1
+    row = _outbox(session_id)
+    assert (row["STATUS"], row["ATTEMPTS"], row["LAST_ERROR"]) == ("failed", 1, "TWILIO_21211")
+    assert db.get_session_by_id(session_id)["FINISH_SMS_STATUS"] == "FAILED:TWILIO_21211"
+    assert worker.run_once() == 0
+    assert len(client.fake.requests) == 1
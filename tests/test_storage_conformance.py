@@ -0,0 +1,197 @@
+"""
+The shared storage.Repository conformance checks, run against every
+connection strategy: per-thread connections, the connection pool on a file,
+and the connection pool on an in-memory (memdb) database.
+"""
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import helpers
+import storage
+from conftest import create_schema
+from machine_catalog import ALL_MACHINE_IDS
+
+PARALLEL = 16
+POOL_SIZE = 4
+
+NOW = datetime.now()
+
+
+def ts(minutes: float = 0) -> str:
+    return (NOW + timedelta(minutes=minutes)).strftime(helpers.TIME_FORMAT)
+
+
+@pytest.fixture(params=["sqlite", "pooled", "pooled-memdb"])
+def repo(request, tmp_path):
+    previous = db.DB_PATH
+    if request.param == "sqlite":
+        path = str(tmp_path / "conformance.sqlite3")
+        repo = storage.from_env("sqlite", path)
+    else:
+        if request.param == "pooled":
+            path = str(tmp_path / "conformance.sqlite3")
+        else:
+            path = f"file:/dlms-{tmp_path.name}?vfs=memdb"
+        repo = storage.PooledRepository(storage.ConnectionPool(storage.sqlite_connector(path), POOL_SIZE))
+    db.DB_PATH = path
+
+    with repo.connection() as conn:
+        create_schema(conn)
+    repo.migrate_db()
+    repo.provision_machines()
+    yield repo
+
+    repo.close()
+    db.close_connection()
+    db.DB_PATH = previous
+
+
+def start(repo, machine_id: str, minutes: float = 1) -> dict:
+    return repo.start_session(machine_id, "Con", "Formance", "5550001111", ts(), ts(minutes), "123456")
+
+
+def test_interface(repo):
+    assert [name for name in storage.OPERATIONS if not callable(getattr(repo, name, None))] == []
+
+
+def test_provision_machines(repo):
+    snapshot, _ = repo.get_machines_snapshot()
+    assert len(snapshot) == len(ALL_MACHINE_IDS)
+    assert repo.provision_machines() == 0
+    assert repo.get_machine_by_id("MA1")["OCCUPANCY_STATUS"] == "vacant"
+
+
+def test_start_and_pickup(repo):
+    started, again = start(repo, "MA1"), start(repo, "MA1")
+    session_id = started["session"]["SESSIONID"]
+    assert (started["outcome"], again["outcome"]) == ("started", "active")
+    assert again["session"]["SESSIONID"] == session_id
+    assert repo.get_machine_by_id("MA1")["OCCUPANCY_STATUS"] == "occupied"
+    assert repo.get_active_session_by_machine("MA1")["SESSIONID"] == session_id
+
+    assert repo.mark_picked_up(session_id, ts(2), 0)
+    assert not repo.mark_picked_up(session_id, ts(3), 0)
+    assert repo.get_session_by_id(session_id)["TIMEOUT"] == ts(2)
+    assert repo.get_machine_by_id("MA1")["OCCUPANCY_STATUS"] == "vacant"
+
+
+def test_parallel_starts(repo, parallel):
+    outcomes = parallel(PARALLEL, lambda i: start(repo, "MB1")["outcome"])
+    assert outcomes.count("started") == 1
+    assert set(outcomes) == {"started", "active"}
+
+
+def test_cross_thread_reads(repo, parallel):
+    _, etag = repo.get_machines_snapshot()
+    version = repo.get_machines_version()
+
+    parallel(1, lambda i: repo.update_machine_condition("MA4", "broken", "conformance"))
+
+    _, new_etag = repo.get_machines_snapshot()
+    board = {m["machine_id"]: m for m in repo.get_board_state()["machines"]}
+    assert new_etag != etag
+    assert repo.get_machines_version() > version
+    assert repo.get_machine_by_id("MA4")["CONDITION_STATUS"] == "broken"
+    assert board["MA4"]["condition"] == "broken"
+    assert start(repo, "MA4")["outcome"] == "broken"
+
+
+def test_finish_sms_outbox(repo):
+    sms_id = start(repo, "MA2", -1)["session"]["SESSIONID"]
+    assert sms_id in [r["SESSIONID"] for r in repo.get_sessions_awaiting_finish_sms()]
+    assert repo.enqueue_finish_sms(sms_id, ts())
+    assert not repo.enqueue_finish_sms(sms_id, ts())
+
+    claimed = repo.claim_due_sms(ts(), ts(5), 10)
+    assert [r["SESSIONID"] for r in claimed] == [sms_id]
+    for row in claimed:
+        assert not repo.complete_sms(row["OUTBOXID"], "not-the-token", True, None, ts())
+        assert repo.complete_sms(row["OUTBOXID"], row["CLAIM_TOKEN"], True, None, ts())
+        repo.update_finish_sms(row["SESSIONID"], "SENT", ts())
+
+    assert not repo.claim_due_sms(ts(), ts(5), 10)
+    assert repo.get_session_by_id(sms_id)["FINISH_SMS_STATUS"] == "SENT"
+
+
+def test_idempotency_keys(repo):
+    assert repo.reserve_idempotency_key("conformance", "/p", ts()) is None
+    assert repo.reserve_idempotency_key("conformance", "/p", ts())["STATUS_CODE"] is None
+    repo.store_idempotent_response("conformance", "/p", 200, "text/plain", None, b"ok")
+    stored = repo.reserve_idempotency_key("conformance", "/p", ts())
+    assert (stored["STATUS_CODE"], bytes(stored["BODY"])) == (200, b"ok")
+    assert repo.reserve_idempotency_key("conformance", "/q", ts()) is None  # scoped to the path
+
+    repo.reserve_idempotency_key("released", "/p", ts())
+    repo.release_idempotency_key("released", "/q")
+    assert repo.reserve_idempotency_key("released", "/p", ts())["STATUS_CODE"] is None
+    repo.release_idempotency_key("released", "/p")
+    assert repo.reserve_idempotency_key("released", "/p", ts()) is None
+    assert repo.purge_idempotency_keys(ts(1)) == 3
+
+
+def test_hallway_queue(repo):
+    first = repo.join_queue("MA", "washing machine", "One", "token-1", ts(), ts(-120))
+    second = repo.join_queue("MA", "washing machine", "Two", "token-2", ts(), ts(-120))
+    assert (first["POSITION"], second["POSITION"]) == (0, 1)
+    assert second["TOKEN"] == "token-2"
+    assert repo.count_queue_waiting("MA", "washing machine", ts(-120)) == 2
+
+    assert repo.close_queue_entry(first["ENTRYID"], "served", ts(), "MA1")
+    assert not repo.close_queue_entry(first["ENTRYID"], "left", ts())
+    assert repo.get_queue_entry(second["ENTRYID"], ts(-120))["POSITION"] == 0
+    assert repo.get_queue_entry(first["ENTRYID"], ts(-120))["STATUS"] == "served"
+
+
+def test_stale_sweep(repo):
+    stale_id = start(repo, "MA3", -300)["session"]["SESSIONID"]
+    assert repo.close_stale_sessions(ts(-240), ts()) == [stale_id]
+    assert repo.get_machine_by_id("MA3")["OCCUPANCY_STATUS"] == "vacant"
+    assert not repo.close_stale_sessions(ts(-240), ts())
+
+
+def test_history_and_archive(repo):
+    oldest = start(repo, "MA1")["session"]["SESSIONID"]
+    repo.mark_picked_up(oldest, ts(2), 0)
+    start(repo, "MA2")
+
+    history = [r["SESSIONID"] for r in repo.get_session_history(limit=100)]
+    paged = [r["SESSIONID"] for r in repo.iter_session_history(chunk_size=1)]
+    assert history == paged == sorted(history, reverse=True)
+
+    # The newest session is never archived.
+    assert repo.archive_sessions(ts(60), ts()) == 1
+    assert [r["SESSIONID"] for r in repo.get_session_history(limit=100)] == history
+    assert oldest not in [r["SESSIONID"] for r in repo.get_session_history(limit=100, include_archive=False)]
+
+
+def test_summary_stats(repo):
+    session_id = start(repo, "MA1")["session"]["SESSIONID"]
+    repo.mark_picked_up(session_id, ts(2), 0)
+
+    assert repo.get_machine_summary_stats("MA1")["total_sessions"] == 1
+    assert set(repo.get_machine_summary_stats_many(["MA1", "MB1"])) == {"MA1", "MB1"}
+    assert not repo.check_machine_stats()
+    assert repo.rebuild_machine_stats() > 0
+    assert not repo.check_machine_stats()
+
+
+def test_pool_checkouts_returned(repo, parallel):
+    if not isinstance(repo, storage.PooledRepository):
+        pytest.skip("per-thread connections have no pool")
+
+    parallel(PARALLEL, lambda i: start(repo, "MC1"))
+    pool = repo.pool
+    try:
+        held = [pool.acquire() for _ in range(pool.size)]
+    except sqlite3.OperationalError as e:
+        pytest.fail(f"a checkout leaked: {e}")
+    clean = not any(conn.in_transaction for conn in held)
+    for conn in held:
+        pool.release(conn)
+
+    assert clean
+    assert pool.opened <= pool.size
+    assert not pool.timeouts
@@ -0,0 +1,70 @@
+"""
+Machine summary statistics: the single-machine lookup, the batch variant
+used by the dorm summary, and the summary pages that render them.
+"""
+import db
+
+
+def _session(machine_id: str, delay_min: int | None, minute: int) -> int:
+    time_in = f"2026-01-01 10:{minute:02d}:00"
+    session_id = db.start_session(machine_id, "Test", "Student", "5550001111",
+                                  time_in, time_in, "123456")["session"]["SESSIONID"]
+    if delay_min is not None:
+        assert db.mark_picked_up(session_id, time_in, delay_min)
+    return session_id
+
+
+def test_summary_for_one_machine(fresh_db):
+    db.provision_machines()
+    ids = [_session("MA1", delay, i) for i, delay in enumerate([0, 3, 0, 12, 5])]
+
+    stats = db.get_machine_summary_stats("MA1")
+
+    assert stats["total_sessions"] == 5
+    assert stats["late_count"] == 3
+    assert stats["avg_delay"] == 4.0
+    assert stats["max_delay"] == 12
+    assert [r["SESSIONID"] for r in stats["recent_sessions"]] == ids[::-1]
+
+
+def test_recent_sessions_are_the_last_ten(fresh_db):
+    db.provision_machines()
+    ids = [_session("MB2", 0, i) for i in range(12)]
+    _session("MB3", 0, 30)
+
+    assert [r["SESSIONID"] for r in db.get_machine_summary_stats("MB2")["recent_sessions"]] == ids[:-11:-1]
+
+
+def test_machine_without_sessions_reports_zeros(fresh_db):
+    db.provision_machines()
+    stats = db.get_machine_summary_stats("FD8")
+    assert (stats["total_sessions"], stats["late_count"], stats["avg_delay"], stats["max_delay"]) == (0, 0, 0.0, 0)
+    assert stats["recent_sessions"] == []
+
+
+def test_batch_matches_single_lookups(fresh_db):
+    db.provision_machines()
+    for i, (machine_id, delay) in enumerate([("MA1", 0), ("MA1", 7), ("MC4", 2), ("MA1", None)]):
+        _session(machine_id, delay, i)
+
+    many = db.get_machine_summary_stats_many(["MA1", "MC4", "FD8", "MA1"], include_recent=True)
+    assert set(many) == {"MA1", "MC4", "FD8"}
+    for machine_id, stats in many.items():
+        single = db.get_machine_summary_stats(machine_id)
+        assert {k: v for k, v in stats.items() if k != "recent_sessions"} == \
+               {k: v for k, v in single.items() if k != "recent_sessions"}
+        assert [r["SESSIONID"] for r in stats["recent_sessions"]] == \
+               [r["SESSIONID"] for r in single["recent_sessions"]]
+
+    everything = db.get_machine_summary_stats_many()
+    assert len(everything) == 64
+    assert everything["MA1"]["recent_sessions"] == []
+    assert db.get_machine_summary_stats_many([]) == {}
+
+
+def test_summary_pages_render(app_module, client):
+    db.provision_machines()
+    _session("MA1", 4, 0)
+
+    assert client.get("/summary").status_code == 200
+    assert client.get("/machine/MA1/summary").status_code == 200
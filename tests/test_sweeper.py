@@ -0,0 +1,78 @@
+"""
+Periodic cleanup: StaleSessionSweeper closes sessions never picked up,
+IdempotencyKeyPurger drops old stored responses.
+"""
+import time
+from datetime import datetime, timedelta
+
+import db
+from helpers import PICKUPDELAYMINUTES, TIME_FORMAT
+from sweeper import IdempotencyKeyPurger, StaleSessionSweeper
+
+NOW = datetime(2026, 1, 1, 18, 0, 0)
+
+
+def _start(machine_id: str, ended_minutes_ago: int) -> int:
+    expected_end = (NOW - timedelta(minutes=ended_minutes_ago)).strftime(TIME_FORMAT)
+    return db.start_session(machine_id, "Test", "Student", "5550001111",
+                            "2026-01-01 08:00:00", expected_end, "123456")["session"]["SESSIONID"]
+
+
+def test_sweep_closes_stale_sessions_in_batches(fresh_db):
+    db.provision_machines()
+    stale = [_start(f"MA{i}", 61 + i) for i in range(1, 6)]
+    fresh = _start("MB1", 30)
+
+    assert StaleSessionSweeper(stale_after_minutes=60, batch_size=2).sweep(NOW) == 5
+
+    for session_id in stale:
+        session = db.get_session_by_id(session_id)
+        assert (session["STATUS"], session["TIMEOUT"]) == ("picked_up", NOW.strftime(TIME_FORMAT))
+        assert session["DELAY_MIN"] == PICKUPDELAYMINUTES(session["EXPECTED_END"], session["TIMEOUT"])
+        assert db.get_machine_by_id(session["MACHINEID"])["OCCUPANCY_STATUS"] == "vacant"
+    assert db.get_session_by_id(fresh)["STATUS"] == "active"
+    assert db.get_machine_by_id("MB1")["OCCUPANCY_STATUS"] == "occupied"
+    assert db.check_machine_stats() == []
+
+    assert StaleSessionSweeper(stale_after_minutes=60).sweep(NOW) == 0
+
+
+def test_disabled_sweeper_does_nothing(fresh_db):
+    session_id = _start("MC1", 600)
+    sweeper = StaleSessionSweeper(stale_after_minutes=0)
+
+    assert not sweeper.enabled
+    assert sweeper.sweep(NOW) == 0
+    sweeper.start()
+    assert sweeper._thread is None
+    assert db.get_session_by_id(session_id)["STATUS"] == "active"
+
+
+def test_thread_sweeps_on_start(fresh_db):
+    # EXPECTED_END relative to the real clock: the thread sweeps with datetime.now().
+    expected_end = (datetime.now() - timedelta(hours=2)).strftime(TIME_FORMAT)
+    session_id = db.start_session("MD1", "Test", "Student", "5550001111",
+                                  expected_end, expected_end, "123456")["session"]["SESSIONID"]
+    sweeper = StaleSessionSweeper(stale_after_minutes=60, interval=3600)
+
+    sweeper.start()
+    try:
+        deadline = time.monotonic() + 5
+        while db.get_session_by_id(session_id)["STATUS"] == "active" and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        sweeper.stop(timeout=5)
+
+    assert db.get_session_by_id(session_id)["STATUS"] == "picked_up"
+    assert not sweeper._thread.is_alive()
+
+
+def test_purger_drops_keys_past_their_ttl(fresh_db):
+    for hours_ago, key in ((30, "old"), (25, "older-than-a-day"), (2, "recent")):
+        created_at = (NOW - timedelta(hours=hours_ago)).strftime(TIME_FORMAT)
+        assert db.reserve_idempotency_key(key, "/machine/MA1/start", created_at) is None
+
+    assert IdempotencyKeyPurger(ttl_hours=24).purge(NOW) == 2
+    keys = db.get_connection().execute("SELECT IDEMPOTENCY_KEY FROM idempotency_keys").fetchall()
+    assert [r[0] for r in keys] == ["recent"]
+    assert IdempotencyKeyPurger(ttl_hours=24).purge(NOW) == 0
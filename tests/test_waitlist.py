@@ -0,0 +1,177 @@
+"""
+Hallway queues (SC2/SC5): predicted free times from the per-group heaps,
+incremental refresh from local writes, and queue entries guarded by the
+token handed out at join.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import waitlist
+from helpers import GRACE_MINUTES, TIME_FORMAT
+from waitlist import HallwayQueues, expected_lag_minutes
+
+WASHER = "washing machine"
+
+
+@pytest.fixture
+def queues(fresh_db, monkeypatch):
+    """A HallwayQueues that syncs on every read, and counts its full rebuilds."""
+    db.provision_machines()
+    queues = HallwayQueues(cycle_minutes=45, resync_interval=0)
+    monkeypatch.setattr(db, "_machine_listeners", [queues.notify])
+
+    queues.rebuilds = 0
+    rebuild = queues._rebuild
+
+    def counting_rebuild(rows):
+        queues.rebuilds += 1
+        rebuild(rows)
+
+    monkeypatch.setattr(queues, "_rebuild", counting_rebuild)
+    return queues
+
+
+def _start(machine_id: str, ends_in_minutes: float) -> str:
+    now = datetime.now()
+    expected_end = (now + timedelta(minutes=ends_in_minutes)).strftime(TIME_FORMAT)
+    db.start_session(machine_id, "Test", "Student", "5550001111", now.strftime(TIME_FORMAT), expected_end, "123456")
+    return expected_end
+
+
+def _order(queues: HallwayQueues, slots: int, now: float) -> list[tuple[str, float]]:
+    return [(m, round((t - now) / 60, 3)) for m, t in queues.predict("MA", WASHER, slots, now)]
+
+
+def test_expected_lag():
+    assert expected_lag_minutes(0, 0, 0) == GRACE_MINUTES
+    assert expected_lag_minutes(4, 0, 0) == GRACE_MINUTES / 2
+    assert expected_lag_minutes(4, 4, 8) == GRACE_MINUTES + 2
+    assert expected_lag_minutes(4, 2, 8) == 0.5 * (GRACE_MINUTES + 4) + 0.5 * GRACE_MINUTES / 2
+
+
+def test_predictions_follow_occupancy_and_condition(queues):
+    expected_end = _start("MA1", 20)
+    db.update_machine_condition("MA2", "broken", "leak")
+    _start("MA3", 10)
+    _start("MA4", 30)
+    now = datetime.strptime(expected_end, TIME_FORMAT).timestamp() - 20 * 60
+
+    # MA3 frees first (end + pickup lag), then MA1, MA4; MA3 again after a cycle.
+    # Each machine's only session is the active one, not late: half the grace period.
+    lag = expected_lag_minutes(1, 0, 0)
+    assert [m for m, _ in _order(queues, 4, now)] == ["MA3", "MA1", "MA4", "MA3"]
+    assert _order(queues, 2, now)[1] == ("MA1", 20 + lag)
+    assert _order(queues, 4, now)[3][1] == pytest.approx(10 + lag + 45 + lag, abs=0.02)
+
+    status = queues.status("MA", WASHER, position=1, now=now)
+    assert [m["machine_id"] for m in status["machines"]] == ["MA3", "MA1", "MA4"]
+    assert status["next"]["machine_id"] == "MA1"
+    assert status["next"]["wait_min"] == 20 + lag
+
+
+def test_vacant_machines_are_free_now(queues):
+    now = datetime.now().timestamp()
+    order = _order(queues, 5, now)
+    assert [w for _, w in order[:4]] == [0.0] * 4
+    assert order[4][1] == 45 + GRACE_MINUTES
+    assert queues.predict("FD", "drying machine", 1, now)[0][1] == now
+
+
+def test_local_writes_update_without_a_rebuild(queues):
+    now = datetime.now().timestamp()
+    queues.refresh()
+    assert queues.rebuilds == 1
+
+    _start("MA1", 20)
+    db.update_machine_condition("MA2", "broken", "leak")
+    db.close_stale_sessions("2000-01-01 00:00:00", "2000-01-01 00:00:00")  # nothing stale: no bump
+
+    assert [m for m, _ in _order(queues, 3, now)] == ["MA3", "MA4", "MA1"]
+    assert queues.rebuilds == 1
+
+
+def test_writes_from_another_process_force_a_rebuild(queues):
+    queues.refresh()
+    _start("MA1", 20)
+
+    other = db.open_connection(db.DB_PATH)
+    other.execute("UPDATE machines SET CONDITION_STATUS = 'broken' WHERE MACHINEID = 'MA3'")
+    other.commit()
+    other.close()
+    _start("MA4", 20)
+
+    now = datetime.now().timestamp()
+    assert [m for m, _ in _order(queues, 3, now)] == ["MA2", "MA1", "MA4"]
+    assert queues.rebuilds == 2
+    queues.refresh()
+    assert queues.rebuilds == 2
+
+
+def test_reset_rebuilds(queues):
+    queues.refresh()
+    queues.reset()
+    queues.refresh()
+    assert queues.rebuilds == 2
+
+
+# -----------------------------
+# Queue API
+# -----------------------------
+
+def _join(client, first_name: str = "Ann") -> dict:
+    resp = client.post("/api/queue/MA", json={"kind": "washer", "first_name": first_name})
+    assert resp.status_code == 201
+    return resp.get_json()
+
+
+def test_join_returns_a_token_needed_to_read_the_entry(app_module, client):
+    db.provision_machines()
+    entry = _join(client)
+    other = _join(client, "Ben")
+
+    assert (entry["position"], other["position"]) == (0, 1)
+    assert len(entry["token"]) >= 20 and entry["token"] != other["token"]
+    assert entry["next"]["machine_id"] == "MA1"
+
+    url = f"/api/queue/entries/{entry['entry_id']}"
+    assert client.get(url).status_code == 404
+    assert client.get(url, headers={"X-Queue-Token": other["token"]}).status_code == 404
+    resp = client.get(url, headers={"X-Queue-Token": entry["token"]})
+    assert resp.status_code == 200
+    assert "token" not in resp.get_json()
+    assert f"queue_token={entry['token']}" in resp.get_json()["start_url"]
+
+    summary = client.get("/api/queue/MA?kind=washer").get_json()
+    assert summary["waiting"] == 2
+    assert "token" not in str(summary)
+
+
+def test_leaving_requires_the_token(app_module, client):
+    db.provision_machines()
+    entry = _join(client)
+    url = f"/api/queue/entries/{entry['entry_id']}"
+
+    assert client.delete(url).status_code == 404
+    assert client.delete(url, headers={"X-Queue-Token": "guess"}).status_code == 404
+    assert db.get_queue_entry(entry["entry_id"], waitlist.queue_cutoff())["STATUS"] == "waiting"
+
+    resp = client.delete(url, headers={"X-Queue-Token": entry["token"]})
+    assert (resp.status_code, resp.get_json()["status"]) == (200, "left")
+    assert client.delete(url, headers={"X-Queue-Token": entry["token"]}).status_code == 409
+
+
+def test_start_link_claims_only_with_the_token(app_module, client):
+    db.provision_machines()
+    form = {"first_name": "Ann", "last_name": "Student", "phone_number": "5550001111"}
+    guessed, entry = _join(client, "Cat"), _join(client)
+
+    client.post(f"/machine/MA2/start?queue_entry={guessed['entry_id']}&queue_token={entry['token']}", data=form)
+    assert db.get_queue_entry(guessed["entry_id"], waitlist.queue_cutoff())["STATUS"] == "waiting"
+
+    start_url = client.get(f"/api/queue/entries/{entry['entry_id']}",
+                           headers={"X-Queue-Token": entry["token"]}).get_json()["start_url"]
+    assert client.post(start_url, data=form).status_code == 302
+    claimed = db.get_queue_entry(entry["entry_id"], waitlist.queue_cutoff())
+    assert (claimed["STATUS"], claimed["MACHINEID"]) == ("served", start_url.split("/")[2])
@@ -0,0 +1,242 @@
+"""
+Per-hallway waiting queues with predicted wait times (SC2/SC5).
+
+When every washer (or dryer) in a hallway is occupied, a student can join
+that hallway's queue instead of rescanning machines. HallwayQueues keeps,
+per (hallway, machine type), a min-heap of the time each machine is
+predicted to be free:
+
+    vacant            now
+    occupied          EXPECTED_END + the machine's expected pickup lag
+    broken            not in the heap
+
+The expected lag comes from the machine's DELAY_MIN history in
+machine_stats (see expected_lag_minutes). Machine writes in this process
+(start, pickup, sweeper, condition) mark the machine dirty through
+db.add_machine_listener; the next read re-fetches only those machines and
+pushes their new times, O(log n) each, with superseded heap entries
+dropped lazily. Writes by other worker processes are caught by reading
+the machines version counter at most every `resync_interval` seconds.
+Each local write reports the version range it committed, so the heaps
+are rebuilt only when the counter moved past what those ranges account
+for. The queue entries themselves live in queue_entries so every process
+sees the same order.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+from helpers import GRACE_MINUTES, TIME_FORMAT
+from machine_catalog import CATALOG
+
+# API name -> machine_catalog machine_type.
+KINDS = {"washer": "washing machine", "dryer": "drying machine"}
+
+# Floor code + hallway letter, e.g. "MA".
+HALLWAY_IDS = tuple(dict.fromkeys(info.floor_code + info.hallway for info in CATALOG.values()))
+
+# Local write ranges kept between reads before HallwayQueues gives up and rebuilds.
+LOCAL_RANGES_MAX = 256
+
+# Waiting entries older than this no longer count (the student gave up).
+QUEUE_ENTRY_TTL_MINUTES = int(os.getenv("QUEUE_ENTRY_TTL_MINUTES", "120"))
+
+
+def group_of(machine_id: str) -> tuple[str, str]:
+    info = CATALOG[machine_id]
+    return info.floor_code + info.hallway, info.machine_type
+
+
+def expected_lag_minutes(session_count: int, late_count: int, delay_sum: float) -> float:
+    """
+    Expected minutes between EXPECTED_END and pickup for one machine.
+    DELAY_MIN only counts lateness beyond the grace period, so a late pickup
+    waited GRACE_MINUTES + its delay; an on-time one is taken as half the
+    grace period. Machines without history assume the grace period.
+    """
+    if session_count <= 0:
+        return float(GRACE_MINUTES)
+    late_share = late_count / session_count
+    mean_late = GRACE_MINUTES + (delay_sum / late_count if late_count else 0.0)
+    return late_share * mean_late + (1 - late_share) * GRACE_MINUTES / 2
+
+
+def queue_cutoff(now: datetime | None = None) -> str:
+    """Entries that joined before this are expired."""
+    now = now or datetime.now()
+    return (now - timedelta(minutes=QUEUE_ENTRY_TTL_MINUTES)).strftime(TIME_FORMAT)
+
+
+class HallwayQueues:
+    def __init__(self, cycle_minutes: float, resync_interval: float = 2.0):
+        self.cycle_minutes = cycle_minutes
+        self.resync_interval = resync_interval
+
+        # (hallway, machine_type) -> heap of (free_at epoch, seq, machine_id)
+        self._heaps: dict[tuple[str, str], list] = {}
+        self._current: dict[str, int] = {}    # machine_id -> seq of its live heap entry
+        self._lag: dict[str, float] = {}      # machine_id -> expected pickup lag (minutes)
+        self._seq = itertools.count()
+        self._dirty: set[str] = set()
+        self._local: list[tuple[int, int]] = []  # (since, version) of local writes not yet synced
+        self._lock = threading.Lock()
+        self._version = None
+        self._next_resync = 0.0
+
+    def reset(self) -> None:
+        """Forgets the heaps; the next read rebuilds them from the database."""
+        with self._lock:
+            self._dirty.clear()
+            self._local.clear()
+            self._version = None
+            self._next_resync = 0.0
+
+    def notify(self, machine_id: str, versions: tuple[int, int]) -> None:
+        """db machine listener: only marks the machine for the next read."""
+        since, version = versions
+        with self._lock:
+            self._dirty.add(machine_id)
+            if version <= since:
+                return
+            if self._local and self._local[-1][1] == since:
+                self._local[-1] = (self._local[-1][0], version)  # back-to-back writes: one range
+            else:
+                self._local.append(versions)
+            if len(self._local) > LOCAL_RANGES_MAX:
+                # No read in a long while: forget the ranges, rebuild on the next resync.
+                self._local.clear()
+                self._version = None
+
+    # -----------------------------
+    # Heap maintenance
+    # -----------------------------
+
+    def _push(self, row) -> None:
+        machine_id = row["MACHINEID"]
+        if machine_id not in CATALOG:
+            return
+        self._lag[machine_id] = expected_lag_minutes(row["SESSION_COUNT"], row["LATE_COUNT"], row["DELAY_SUM"])
+
+        if row["CONDITION_STATUS"] == "broken":
+            self._current.pop(machine_id, None)  # any heap entry is now stale
+            return
+
+        free_at = 0.0  # vacant: free now
+        if row["OCCUPANCY_STATUS"] == "occupied":
+            if row["EXPECTED_END"] is not None:
+                end = datetime.strptime(row["EXPECTED_END"], TIME_FORMAT).timestamp()
+                free_at = end + self._lag[machine_id] * 60
+            else:
+                free_at = time.time() + self._lag[machine_id] * 60
+
+        seq = next(self._seq)
+        self._current[machine_id] = seq
+        heap = self._heaps.setdefault(group_of(machine_id), [])
+        heapq.heappush(heap, (free_at, seq, machine_id))
+
+        # Superseded entries are skipped on read; compact once they dominate.
+        if len(heap) > 16 and len(heap) > 4 * len(self._live(heap)):
+            self._heaps[group_of(machine_id)] = self._live(heap)
+            heapq.heapify(self._heaps[group_of(machine_id)])
+
+    def _live(self, heap: list) -> list:
+        return [e for e in heap if self._current.get(e[2]) == e[1]]
+
+    def _rebuild(self, rows) -> None:
+        self._heaps.clear()
+        self._current.clear()
+        for row in rows:
+            self._push(row)
+
+    def _only_local_since_sync(self, version: int) -> bool:
+        # True if the local writes' version ranges cover every bump from
+        # self._version to `version`; a gap is a write from another process.
+        if self._version is None or version < self._version:
+            return False  # never synced, or a different database
+        covered = self._version
+        for since, until in sorted(self._local):
+            if since > covered:
+                return False
+            covered = max(covered, until)
+        return covered >= version
+
+    def refresh(self) -> None:
+        """Applies pending local changes, and other processes' changes once per resync_interval."""
+        version = None
+        if time.monotonic() >= self._next_resync:
+            version = db.get_machines_version()
+            self._next_resync = time.monotonic() + self.resync_interval
+
+        with self._lock:
+            # Every range counted here has its machine in `dirty`, applied below.
+            dirty, self._dirty = self._dirty, set()
+            if version is not None:
+                rebuild = not self._only_local_since_sync(version)
+                self._local = [r for r in self._local if r[1] > version]
+                if not rebuild:
+                    self._version = version
+
+        if version is not None and rebuild:
+            rows = db.get_queue_inputs()
+            with self._lock:
+                self._rebuild(rows)
+                self._version = version
+            return
+
+        if dirty:
+            rows = db.get_queue_inputs(dirty)
+            with self._lock:
+                for row in rows:
+                    self._push(row)
+
+    # -----------------------------
+    # Predictions
+    # -----------------------------
+
+    def predict(self, hallway: str, machine_type: str, slots: int, now: float | None = None) -> list[tuple[str, float]]:
+        """
+        The first `slots` (machine_id, free_at) hand-offs in the group, in
+        order: once a machine is handed to someone it becomes free again
+        after a cycle plus its lag.
+        """
+        self.refresh()
+        now = now or time.time()
+        with self._lock:
+            sim = [(max(t, now), m) for t, _, m in self._live(self._heaps.get((hallway, machine_type), []))]
+            lag = dict(self._lag)
+        heapq.heapify(sim)
+
+        result = []
+        while sim and len(result) < slots:
+            free_at, machine_id = heapq.heappop(sim)
+            result.append((machine_id, free_at))
+            heapq.heappush(sim, (free_at + (self.cycle_minutes + lag[machine_id]) * 60, machine_id))
+        return result
+
+    def status(self, hallway: str, machine_type: str, position: int, now: float | None = None) -> dict:
+        """
+        Machines in predicted free order and the machine/wait for the student
+        at `position` in line (0 = next).
+        """
+        now = now or time.time()
+        order = self.predict(hallway, machine_type, max(position + 1, 1), now)
+        with self._lock:
+            machines = sorted(
+                (max(t, now), m) for t, _, m in self._live(self._heaps.get((hallway, machine_type), []))
+            )
+
+        def slot(machine_id, free_at):
+            return {
+                "machine_id": machine_id,
+                "predicted_free_at": datetime.fromtimestamp(free_at).strftime(TIME_FORMAT),
+                "wait_min": round((free_at - now) / 60, 1),
+            }
+
+        return {
+            "machines": [slot(m, t) for t, m in machines],
+            "next": slot(*order[position]) if len(order) > position else None,
+        }